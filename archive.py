@@ -0,0 +1,159 @@
+"""
+extraction of multi-file scene archives
+members are spread across a pool of workers by size and streamed straight from the on-disk archive to their destination
+"""
+import os
+import time
+import zlib
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from config import DAEMON_LOGGER
+from encryption import encrypt_stream
+
+
+def find_main_file(names):
+    """
+    return name of main animation file from list of archive member names, "" if not found
+    NOTE: backend job_queue.py and scan.py perform the same search and should call this
+    """
+    for name in names:
+        # look for the main animation file to identify which software is used
+        extension = os.path.splitext(name)[1]
+        if extension in MAIN_FILE_EXTENSIONS:
+            return name
+
+    return ""
+
+
+def get_member_path(dest_dir, name):
+    """
+    return path member name will be extracted to within dest_dir
+    sanitizes absolute paths, drive letters, and parent directory references the same way zipfile does
+    """
+    arcname = name.replace("/", os.path.sep)
+    if os.path.altsep:
+        arcname = arcname.replace(os.path.altsep, os.path.sep)
+    arcname = os.path.splitdrive(arcname)[1]
+    invalid_path_parts = ("", os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(part for part in arcname.split(os.path.sep) if part not in invalid_path_parts)
+
+    return os.path.join(dest_dir, arcname)
+
+
+def _assign_members(infos, n_workers):
+    """
+    split members into n_workers groups with roughly equal total uncompressed size
+    largest members are assigned first, each to the currently smallest group
+    """
+    groups = [[] for _ in range(n_workers)]
+    group_sizes = [0] * n_workers
+    for info in sorted(infos, key=lambda info: info.file_size, reverse=True):
+        smallest = group_sizes.index(min(group_sizes))
+        groups[smallest].append(info)
+        group_sizes[smallest] += info.file_size
+
+    return [group for group in groups if group]
+
+
+def _is_unchanged(path, info):
+    """
+    return True iff path already exists with the same contents as member
+    contents are compared by crc since same-size edits with unchanged timestamps are common, such as uncompressed textures
+    """
+    try:
+        if os.path.getsize(path) != info.file_size:
+            return False
+        crc = 0
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+    except FileNotFoundError:
+        return False
+
+    return crc == info.CRC
+
+
+def _extract_group(open_archive, infos, dest_dir, main_file, key):
+    """
+    extract group of members using this worker's own handle on the archive
+    return number of bytes written and number of members skipped
+    """
+    n_bytes = 0
+    n_skipped = 0
+    with open_archive() as archive, zipfile.ZipFile(archive, mode="r") as zipf:
+        for info in infos:
+            path = get_member_path(dest_dir, info.filename)
+            is_main = info.filename == main_file and key
+            if not is_main and _is_unchanged(path, info):
+                n_skipped += 1
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # existing file may be hardlinked from cache, so unlink it rather than writing over shared contents
+            if os.path.lexists(path):
+                os.remove(path)
+            with zipf.open(info) as member:
+                if is_main:
+                    # main file is encrypted as it's extracted so its plaintext never touches the disk
+                    encrypt_stream(key, member, path)
+                else:
+                    with open(path, "wb") as f:
+                        shutil.copyfileobj(member, f, COPY_BUFFER_SIZE)
+                    date_time = time.mktime(info.date_time + (0, 0, -1))
+                    os.utime(path, (date_time, date_time))
+            n_bytes += info.file_size
+
+    return n_bytes, n_skipped
+
+
+def list_members(open_archive, dest_dir):
+    """
+    return set of paths relative to dest_dir that archive's files would be extracted to
+    """
+    with open_archive() as archive, zipfile.ZipFile(archive, mode="r") as zipf:
+        infos = zipf.infolist()
+
+    return {os.path.relpath(get_member_path(dest_dir, info.filename), dest_dir) for info in infos if not info.is_dir()}
+
+
+def extract_archive(open_archive, dest_dir, key=None, n_workers=None):
+    """
+    extract zip archive into dest_dir in parallel
+    open_archive is a function returning a new readable, seekable file object for the archive, called once per worker
+    if key is set, main file is encrypted with it during extraction
+    members already present from a previous extraction are skipped
+    return path to main file, dict of extraction stats
+    """
+    start_time = time.time()
+    with open_archive() as archive, zipfile.ZipFile(archive, mode="r") as zipf:
+        infos = zipf.infolist()
+    main_file = find_main_file([info.filename for info in infos])
+    for info in infos:
+        if info.is_dir():
+            os.makedirs(get_member_path(dest_dir, info.filename), exist_ok=True)
+    infos = [info for info in infos if not info.is_dir()]
+    n_workers = n_workers or min(MAX_WORKERS, os.cpu_count() or 1)
+    groups = _assign_members(infos, n_workers)
+    n_bytes = 0
+    n_skipped = 0
+    if groups:
+        with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+            futures = [executor.submit(_extract_group, open_archive, group, dest_dir, main_file, key) for group in groups]
+            for future in futures:
+                group_bytes, group_skipped = future.result()
+                n_bytes += group_bytes
+                n_skipped += group_skipped
+
+    seconds = time.time() - start_time
+    throughput = n_bytes / seconds / (1024 * 1024) if seconds > 0 else 0.0
+    stats = {"n_members": len(infos), "n_skipped": n_skipped, "bytes": n_bytes, "seconds": round(seconds, 2), \
+             "mb_per_second": round(throughput, 2)}
+    DAEMON_LOGGER.debug(f"Extracted {len(infos) - n_skipped} members ({n_bytes} bytes) with {len(groups)} workers in {seconds:.2f}s " \
+                        f"({throughput:.2f} MB/s), skipped {n_skipped} already present")
+
+    return get_member_path(dest_dir, main_file), stats
+
+
+MAIN_FILE_EXTENSIONS = [".blend", ".blend1"]
+MAX_WORKERS = 8
+COPY_BUFFER_SIZE = 1024 * 1024
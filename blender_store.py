@@ -0,0 +1,362 @@
+"""
+versioned store of extracted blender installations shared by all tasks
+each version is downloaded, extracted, and verified once, then run in place and read-only by every task that needs it
+tasks hold a shared lock on the versions they use so eviction never removes an installation that's running
+"""
+import os
+import time
+import fcntl
+import shutil
+import json
+import threading
+import subprocess
+from config import DAEMON_LOGGER, BLENDER_STORE_DIR
+from utils import run_shell_cmd
+
+
+def get_install_path(version):
+    """
+    return directory blender version is installed to
+    """
+    return os.path.join(STORE_DIR, f"blender-{version}")
+
+
+def is_installed(version):
+    """
+    return True iff blender version is extracted and verified
+    """
+    return os.path.exists(os.path.join(get_install_path(version), VERIFIED_FILE))
+
+
+def _lock(lock_path, exclusive=False, blocking=True):
+    """
+    acquire flock on lock_path
+    return open lock file, or None if non-blocking and lock is held elsewhere
+    """
+    lock_file = open(lock_path, "a")
+    flags = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+    if not blocking:
+        flags |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lock_file, flags)
+    except BlockingIOError:
+        lock_file.close()
+
+        return None
+
+    return lock_file
+
+
+def _get_install_size(install_path):
+    """
+    return disk usage in bytes of blender installation recorded when it was verified
+    """
+    try:
+        with open(os.path.join(install_path, SIZE_FILE), "r") as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def _set_writable(path, writable):
+    """
+    recursively add or remove write permission on path
+    """
+    run_shell_cmd(f"chmod -R {'u+w' if writable else 'a-w'} {path}", very_quiet=True)
+
+
+def _verify(install_path, version):
+    """
+    return True iff blender in install_path runs and reports the expected version
+    """
+    output = run_shell_cmd(f"{install_path}/blender --version", very_quiet=True, format_output=False)
+
+    return bool(output) and f"Blender {version}" in output
+
+
+def is_installing(version):
+    """
+    return True iff another thread or process is currently installing blender version
+    """
+    install_lock = _lock(os.path.join(STORE_DIR, f".blender-{version}.install.lock"), exclusive=True, blocking=False)
+    if install_lock is None:
+        return True
+    install_lock.close()
+
+    return False
+
+
+def _get_unthrottle_path(version):
+    return os.path.join(STORE_DIR, f".blender-{version}.unthrottle")
+
+
+def request_unthrottle(version):
+    """
+    have a bandwidth-capped install of blender version, such as a prefetch, finish its download at full speed
+    used when a task needs a version that's being prefetched, from any process
+    """
+    with open(_get_unthrottle_path(version), "w"):
+        pass
+
+
+def _download(url, tar_path, version, limit_rate):
+    """
+    download url to tar_path with wget, capped at limit_rate until someone calls request_unthrottle for version
+    """
+    unthrottle_path = _get_unthrottle_path(version)
+    cmd = ["wget", "-q", url, "-O", tar_path]
+    if not limit_rate or os.path.exists(unthrottle_path):
+        subprocess.run(cmd)
+
+        return
+    process = subprocess.Popen(cmd[:2] + [f"--limit-rate={limit_rate}"] + cmd[2:])
+    while process.poll() is None:
+        if os.path.exists(unthrottle_path):
+            process.terminate()
+            process.wait()
+            DAEMON_LOGGER.debug(f"Blender version {version} needed by a task, continuing its download at full speed...")
+            # continue from where capped download stopped
+            subprocess.run(cmd[:2] + ["-c"] + cmd[2:])
+
+            return
+        time.sleep(UNTHROTTLE_POLL_INTERVAL)
+
+
+def install_blender(version, limit_rate=None):
+    """
+    download, extract, and verify blender version if not already installed
+    limit_rate is passed to wget to cap download bandwidth, such as "2m", until request_unthrottle is called for version
+    concurrent installs of the same version wait for the first to finish rather than downloading twice
+    return install path
+    """
+    install_path = get_install_path(version)
+    install_lock = _lock(os.path.join(STORE_DIR, f".blender-{version}.install.lock"), exclusive=True)
+    try:
+        if is_installed(version):
+            return install_path
+
+        DAEMON_LOGGER.debug(f"Installing blender version {version}...")
+        start_time = time.time()
+        short_version = version.rpartition(".")[0]
+        tar_path = os.path.join(STORE_DIR, f"blender-{version}.tar.xz")
+        tmp_path = os.path.join(STORE_DIR, f".blender-{version}.tmp")
+        # go to https://download.blender.org/release/ to check blender version updates
+        _download(f"https://download.blender.org/release/Blender{short_version}/blender-{version}-linux-x64.tar.xz", tar_path, version, limit_rate)
+        download_time = time.time() - start_time
+        if os.path.exists(tmp_path):
+            _set_writable(tmp_path, True)
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        run_shell_cmd(f"tar -xf {tar_path} -C {tmp_path} --strip-components 1", quiet=True)
+        if os.path.exists(tar_path):
+            os.remove(tar_path)
+        if not _verify(tmp_path, version):
+            _set_writable(tmp_path, True)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise Exception(f"Failed to verify blender version {version} installation!")
+
+        install_size = int(run_shell_cmd(f"du -sb {tmp_path} | cut -f 1", quiet=True, format_output=False))
+        with open(os.path.join(tmp_path, SIZE_FILE), "w") as f:
+            f.write(str(install_size))
+        with open(os.path.join(tmp_path, VERIFIED_FILE), "w") as f:
+            f.write(version)
+        # tasks run blender in place, so installation is made read-only to keep one task from modifying it for others
+        _set_writable(tmp_path, False)
+        # clean up any partially-evicted installation of this version
+        if os.path.exists(install_path):
+            _set_writable(install_path, True)
+            shutil.rmtree(install_path)
+        os.rename(tmp_path, install_path)
+        DAEMON_LOGGER.debug(f"Installed blender version {version} ({install_size} bytes) in {time.time() - start_time:.2f}s, " \
+                            f"download took {download_time:.2f}s")
+    finally:
+        if os.path.exists(_get_unthrottle_path(version)):
+            os.remove(_get_unthrottle_path(version))
+        install_lock.close()
+
+    evict_installs(keep=[version])
+
+    return install_path
+
+
+def acquire_blender(version):
+    """
+    install blender version if necessary and mark it in use until released or this process exits
+    return path to directory containing blender executable
+    """
+    # lock before installing so version can't be evicted between install and use
+    use_lock = _lock(os.path.join(STORE_DIR, f".blender-{version}.use.lock"))
+    # released by release_blender or when process exits
+    with _HELD_LOCKS_LOCK:
+        _HELD_LOCKS.append((version, use_lock))
+    # task shouldn't wait on a capped prefetch of the version it needs
+    if is_installing(version):
+        request_unthrottle(version)
+    install_path = install_blender(version)
+    # update last used time for LRU eviction
+    os.utime(os.path.join(install_path, VERIFIED_FILE))
+
+    return install_path
+
+
+def release_blender(version):
+    """
+    release one use of blender version acquired by this process so it can be evicted again
+    needed by long-running processes like the daemon, which would otherwise hold every version they've used
+    """
+    with _HELD_LOCKS_LOCK:
+        for i, (held_version, use_lock) in enumerate(_HELD_LOCKS):
+            if held_version == version:
+                use_lock.close()
+                del _HELD_LOCKS[i]
+
+                return
+
+
+def get_installed_versions():
+    """
+    return list of installed blender versions
+    """
+    versions = []
+    for name in os.listdir(STORE_DIR):
+        if name.startswith("blender-") and is_installed(name.replace("blender-", "", 1)):
+            versions.append(name.replace("blender-", "", 1))
+
+    return versions
+
+
+def get_store_size():
+    """
+    return total disk usage in bytes of installed blender versions
+    """
+    return sum(_get_install_size(get_install_path(version)) for version in get_installed_versions())
+
+
+def evict_installs(max_size=None, keep=()):
+    """
+    remove least recently used blender versions until store uses less than max_size bytes
+    versions in keep and versions currently in use by a task are never removed
+    """
+    max_size = MAX_STORE_SIZE if max_size is None else max_size
+    versions = get_installed_versions()
+    total_size = get_store_size()
+    last_used = lambda version: os.path.getmtime(os.path.join(get_install_path(version), VERIFIED_FILE))
+    for version in sorted(versions, key=last_used):
+        if total_size <= max_size:
+            break
+        if version in keep:
+            continue
+        use_lock = _lock(os.path.join(STORE_DIR, f".blender-{version}.use.lock"), exclusive=True, blocking=False)
+        if use_lock is None:
+            continue
+        try:
+            install_path = get_install_path(version)
+            install_size = _get_install_size(install_path)
+            _set_writable(install_path, True)
+            shutil.rmtree(install_path, ignore_errors=True)
+            total_size -= install_size
+            DAEMON_LOGGER.debug(f"Evicted blender version {version} from store")
+        finally:
+            use_lock.close()
+
+
+def _read_history():
+    """
+    return dict of requested blender versions like {"3.6.2": {"score": 4.2, "last_seen": 1690000000.0}}
+    """
+    try:
+        with open(HISTORY_FILE, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def _decayed_score(entry, now):
+    """
+    return request score of history entry decayed by time since it was last seen
+    """
+    age_days = (now - entry["last_seen"]) / 86400.0
+
+    return entry["score"] * 0.5 ** (age_days / HISTORY_HALF_LIFE_DAYS)
+
+
+def record_blender_request(version):
+    """
+    add a request for blender version to history used to predict which versions to prefetch
+    """
+    now = time.time()
+    with _HISTORY_LOCK:
+        history = _read_history()
+        entry = history.get(version)
+        score = _decayed_score(entry, now) if entry else 0.0
+        history[version] = {"score": score + 1.0, "last_seen": now}
+        with open(HISTORY_FILE, "w") as f:
+            json.dump(history, f)
+
+
+def ensure_blender(version):
+    """
+    start installing blender version in the background unless it's installed or already being downloaded
+    lets a task's blender download overlap with its input download and processing
+    """
+    if is_installed(version):
+        return
+    if is_installing(version):
+        # task shouldn't wait on a capped prefetch of the version it needs
+        request_unthrottle(version)
+
+        return
+
+    threading.Thread(target=install_blender, args=(version,), daemon=True).start()
+
+
+def prefetch_blender_versions():
+    """
+    install the most frequently and recently requested blender version that isn't installed yet
+    bandwidth is capped and versions are only prefetched while the store is under its prefetch disk budget
+    return version prefetched, None if nothing to do
+    """
+    now = time.time()
+    history = _read_history()
+    ranked = sorted(history, key=lambda version: _decayed_score(history[version], now), reverse=True)
+    installed = get_installed_versions()
+    sizes = [_get_install_size(get_install_path(version)) for version in installed]
+    # estimate size of a new version from the ones already installed
+    estimated_size = (sum(sizes) / len(sizes)) if sizes else DEFAULT_INSTALL_SIZE
+    for version in ranked[:PREFETCH_COUNT]:
+        if version in installed or is_installing(version):
+            continue
+        if get_store_size() + estimated_size > PREFETCH_DISK_BUDGET:
+            return None
+
+        DAEMON_LOGGER.debug(f"Prefetching blender version {version}...")
+        try:
+            install_blender(version, limit_rate=PREFETCH_RATE_LIMIT)
+        except Exception as e:
+            DAEMON_LOGGER.error(f"Failed to prefetch blender version {version}: {e}")
+
+            return None
+
+        return version
+
+    return None
+
+
+STORE_DIR = BLENDER_STORE_DIR
+VERIFIED_FILE = ".rentaflop_verified"
+SIZE_FILE = ".rentaflop_size"
+# roughly 5 extracted versions
+MAX_STORE_SIZE = 8 * 1024 * 1024 * 1024
+# prefetching never fills the store enough to evict versions that were actually used
+PREFETCH_DISK_BUDGET = int(MAX_STORE_SIZE * 0.75)
+DEFAULT_INSTALL_SIZE = 1024 * 1024 * 1024
+PREFETCH_COUNT = 3
+PREFETCH_RATE_LIMIT = "5m"
+# seconds between checks for a task needing a version that's being prefetched
+UNTHROTTLE_POLL_INTERVAL = 1
+HISTORY_FILE = os.path.join(STORE_DIR, "history.json")
+HISTORY_HALF_LIFE_DAYS = 7.0
+os.makedirs(STORE_DIR, exist_ok=True)
+_HELD_LOCKS = []
+_HELD_LOCKS_LOCK = threading.Lock()
+_HISTORY_LOCK = threading.Lock()
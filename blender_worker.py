@@ -0,0 +1,118 @@
+"""
+long-lived blender render worker that keeps a scene loaded between tasks from the same job
+runs inside blender and serves frame-range render requests from run.py over a unix socket
+usage:
+    blender -b --python blender_worker.py -- socket_path [--cycles-device OPTIX]
+protocol is newline-delimited json; each connection carries one render request:
+    -> {"scene_id": ..., "task_dir": ..., "output_path": ..., "start_frame": ..., "end_frame": ..., "is_png": ..., "log_path": ...}
+    <- {"event": "need_scene"} if scene isn't loaded yet
+    -> {"render_path": ...} path to decrypted scene, which is deleted once loaded
+    <- {"event": "rendering"} after settings overrides are applied
+    <- {"event": "done"} or {"event": "error", "message": ...}
+"""
+import bpy
+import json
+import os
+import socket
+import sys
+import time
+import traceback
+# get all args after "--", which allows us to ignore blender command args and only use args for this script
+argv = sys.argv
+argv = argv[argv.index("--") + 1:]
+socket_path = argv[0]
+render_config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "render_config.py")
+loaded_scene_id = None
+# output format saved with the scene, restored before each request since overrides like is_png change it in place
+loaded_file_format = None
+
+
+def send(conn_file, message):
+    conn_file.write(json.dumps(message) + "\n")
+    conn_file.flush()
+
+
+def redirect_output(log_path):
+    """
+    point blender's stdout and stderr at log_path so task log looks the same as a cold render
+    return saved file descriptors to restore afterwards
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+    log_fd = os.open(log_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.dup2(log_fd, 1)
+    os.dup2(log_fd, 2)
+    os.close(log_fd)
+
+    return saved_fds
+
+
+def restore_output(saved_fds):
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(saved_fds[0], 1)
+    os.dup2(saved_fds[1], 2)
+    os.close(saved_fds[0])
+    os.close(saved_fds[1])
+
+
+def handle_request(conn_file, request):
+    global loaded_scene_id, loaded_file_format
+    if loaded_scene_id is not None and request["scene_id"] != loaded_scene_id:
+        send(conn_file, {"event": "error", "message": f"Worker has scene {loaded_scene_id} loaded, not {request['scene_id']}"})
+        return
+
+    saved_fds = redirect_output(request["log_path"])
+    try:
+        if loaded_scene_id is None:
+            send(conn_file, {"event": "need_scene"})
+            render_path = json.loads(conn_file.readline())["render_path"]
+            bpy.ops.wm.open_mainfile(filepath=render_path, load_ui=False, use_scripts=True)
+            os.remove(render_path)
+            loaded_scene_id = request["scene_id"]
+            loaded_file_format = bpy.context.scene.render.image_settings.file_format
+
+        bpy.context.scene.render.image_settings.file_format = loaded_file_format
+        # same overrides a cold render applies; render_config.py reads task dir from args after "--"
+        sys.argv = ["blender", "--", request["task_dir"]]
+        with open(render_config_path, "r") as f:
+            exec(compile(f.read(), render_config_path, "exec"), {"__name__": "__main__"})
+        scene = bpy.context.scene
+        # keep scene data on the gpu between renders
+        scene.render.use_persistent_data = True
+        scene.frame_start = int(request["start_frame"])
+        scene.frame_end = int(request["end_frame"])
+        scene.render.filepath = request["output_path"]
+        if request.get("is_png"):
+            scene.render.image_settings.file_format = "PNG"
+        send(conn_file, {"event": "rendering"})
+        bpy.ops.render.render(animation=True)
+        send(conn_file, {"event": "done"})
+    except Exception:
+        error = traceback.format_exc()
+        print(error)
+        send(conn_file, {"event": "error", "message": error})
+    finally:
+        restore_output(saved_fds)
+
+
+def serve():
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(1)
+    print(f"Render worker listening on {socket_path}")
+    while True:
+        conn, _ = server.accept()
+        with conn, conn.makefile("rw") as conn_file:
+            line = conn_file.readline()
+            if not line:
+                continue
+            start_time = time.time()
+            handle_request(conn_file, json.loads(line))
+            print(f"Handled render request in {time.time() - start_time:.2f}s")
+
+
+serve()
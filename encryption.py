@@ -0,0 +1,150 @@
+"""
+in-process encryption at rest for task input files
+files are encrypted in fixed-size AES-GCM frames so they can be written while streaming and read back with random access
+file layout is MAGIC, a 4 byte random nonce prefix, then frames of FRAME_SIZE plaintext bytes (last frame may be shorter)
+"""
+import os
+import shutil
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+def generate_key():
+    """
+    return new random hex-encoded encryption key
+    """
+    return AESGCM.generate_key(bit_length=256).hex()
+
+
+class EncryptedFileWriter:
+    """
+    file-like object that encrypts data written to it and saves it to path
+    """
+    def __init__(self, key, path):
+        self._aesgcm = AESGCM(bytes.fromhex(key))
+        self._file = open(path, "wb")
+        self._buffer = bytearray()
+        self._nonce_prefix = os.urandom(NONCE_PREFIX_SIZE)
+        self._n_frames = 0
+        self._file.write(MAGIC + self._nonce_prefix)
+
+    def _write_frame(self, data):
+        nonce = self._nonce_prefix + self._n_frames.to_bytes(12 - NONCE_PREFIX_SIZE, "big")
+        self._file.write(self._aesgcm.encrypt(nonce, bytes(data), None))
+        self._n_frames += 1
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= FRAME_SIZE:
+            self._write_frame(self._buffer[:FRAME_SIZE])
+            del self._buffer[:FRAME_SIZE]
+
+        return len(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        # always write final frame, even if empty, so an empty file still has a frame to authenticate
+        if self._buffer or self._n_frames == 0:
+            self._write_frame(self._buffer)
+            self._buffer = bytearray()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class EncryptedFileReader:
+    """
+    seekable file-like object that decrypts file at path written by EncryptedFileWriter
+    decrypts one frame at a time, so zip archives can be read without a plaintext copy on disk
+    """
+    def __init__(self, key, path):
+        self._aesgcm = AESGCM(bytes.fromhex(key))
+        self._file = open(path, "rb")
+        header = self._file.read(len(MAGIC) + NONCE_PREFIX_SIZE)
+        if not header.startswith(MAGIC):
+            self._file.close()
+            raise ValueError(f"{path} is not an encrypted task file!")
+        self._nonce_prefix = header[len(MAGIC):]
+        encrypted_size = os.path.getsize(path) - len(header)
+        self._n_frames = max(1, -(-encrypted_size // ENCRYPTED_FRAME_SIZE))
+        self._size = encrypted_size - self._n_frames * TAG_SIZE
+        self._position = 0
+        self._frame_idx = None
+        self._frame = b""
+
+    def _load_frame(self, frame_idx):
+        if frame_idx == self._frame_idx:
+            return
+        self._file.seek(len(MAGIC) + NONCE_PREFIX_SIZE + frame_idx * ENCRYPTED_FRAME_SIZE)
+        nonce = self._nonce_prefix + frame_idx.to_bytes(12 - NONCE_PREFIX_SIZE, "big")
+        self._frame = self._aesgcm.decrypt(nonce, self._file.read(ENCRYPTED_FRAME_SIZE), None)
+        self._frame_idx = frame_idx
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            n = self._size - self._position
+        n = min(n, self._size - self._position)
+        chunks = []
+        while n > 0:
+            frame_idx, frame_offset = divmod(self._position, FRAME_SIZE)
+            self._load_frame(frame_idx)
+            chunk = self._frame[frame_offset:frame_offset + n]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            n -= len(chunk)
+
+        return b"".join(chunks)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = max(0, offset)
+
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def decrypt_file(key, src_path, dst_path):
+    """
+    decrypt src_path written by EncryptedFileWriter into plaintext dst_path in a single pass
+    """
+    with EncryptedFileReader(key, src_path) as src, open(dst_path, "wb") as dst:
+        shutil.copyfileobj(src, dst, FRAME_SIZE)
+
+
+def encrypt_stream(key, src, dst_path):
+    """
+    encrypt contents of readable file-like object src into dst_path in a single pass
+    """
+    with EncryptedFileWriter(key, dst_path) as dst:
+        shutil.copyfileobj(src, dst, FRAME_SIZE)
+
+
+MAGIC = b"RAFENC1\n"
+NONCE_PREFIX_SIZE = 4
+TAG_SIZE = 16
+FRAME_SIZE = 1024 * 1024
+ENCRYPTED_FRAME_SIZE = FRAME_SIZE + TAG_SIZE
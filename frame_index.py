@@ -0,0 +1,132 @@
+"""
+indexes a task's finished output frames so frame timing can be read without listing and stat-ing the whole output dir
+the output dir is only rescanned when its mtime changes, which happens when blender adds a frame, and each scan only stats
+frames that weren't indexed yet
+"""
+import os
+import threading
+
+
+class FrameIndex:
+    """
+    completion time of each file in a task's output dir
+    """
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.dir_mtime = None
+        # filename -> mtime of frame
+        self.frames = {}
+        self.first_frame = None
+        self.last_frame = None
+        self._lock = threading.Lock()
+
+    def update(self):
+        """
+        index frames added since last update
+        """
+        with self._lock:
+            try:
+                dir_mtime = os.stat(self.output_path).st_mtime_ns
+            except FileNotFoundError:
+                return
+            if dir_mtime == self.dir_mtime:
+                # newest frame may still have been being written at last scan, so only its mtime can be stale
+                self._refresh_last_frame()
+                return
+            # read before scanning, so a frame added during the scan changes mtime again and triggers another scan
+            self.dir_mtime = dir_mtime
+            names = set()
+            is_removed = False
+            with os.scandir(self.output_path) as entries:
+                for entry in entries:
+                    names.add(entry.name)
+                    if entry.name in self.frames:
+                        continue
+                    try:
+                        self._add_frame(entry.name, entry.stat().st_mtime)
+                    except FileNotFoundError:
+                        names.discard(entry.name)
+            for name in list(self.frames):
+                if name not in names:
+                    del self.frames[name]
+                    is_removed = True
+            if is_removed:
+                self._recompute_bounds()
+            self._refresh_last_frame()
+
+    def _add_frame(self, name, mtime):
+        self.frames[name] = mtime
+        if self.first_frame is None or mtime < self.frames[self.first_frame]:
+            self.first_frame = name
+        if self.last_frame is None or mtime > self.frames[self.last_frame]:
+            self.last_frame = name
+
+    def _recompute_bounds(self):
+        self.first_frame = min(self.frames, key=self.frames.get) if self.frames else None
+        self.last_frame = max(self.frames, key=self.frames.get) if self.frames else None
+
+    def _refresh_last_frame(self):
+        if self.last_frame is None:
+            return
+        try:
+            self.frames[self.last_frame] = os.stat(os.path.join(self.output_path, self.last_frame)).st_mtime
+        except FileNotFoundError:
+            # picked up by next scan since removing a file changes dir mtime
+            pass
+
+    @property
+    def n_frames(self):
+        return len(self.frames)
+
+    def get_first_frame_finish(self):
+        """
+        return unix time first frame finished, None if no frames finished
+        """
+        return self.frames[self.first_frame] if self.first_frame is not None else None
+
+    def get_last_frame_finish(self):
+        """
+        return unix time latest frame finished, None if no frames finished
+        """
+        return self.frames[self.last_frame] if self.last_frame is not None else None
+
+    def get_subsequent_frames_avg(self):
+        """
+        return average seconds per frame after the first, None if fewer than two frames finished
+        """
+        if self.n_frames < 2:
+            return None
+
+        return (self.get_last_frame_finish() - self.get_first_frame_finish()) / (self.n_frames - 1)
+
+    def get_completed_frames(self):
+        """
+        return filenames of finished frames in the order they finished
+        """
+        return sorted(self.frames, key=self.frames.get)
+
+
+def get_frame_index(task_dir):
+    """
+    return up-to-date index of task_dir's output frames, reusing the index from earlier calls for the same task
+    """
+    with _INDEXES_LOCK:
+        index = _INDEXES.get(task_dir)
+        if index is None:
+            index = FrameIndex(os.path.join(task_dir, "output"))
+            _INDEXES[task_dir] = index
+    index.update()
+
+    return index
+
+
+def remove_frame_index(task_dir):
+    """
+    forget task's index once task is removed
+    """
+    with _INDEXES_LOCK:
+        _INDEXES.pop(task_dir, None)
+
+
+_INDEXES = {}
+_INDEXES_LOCK = threading.Lock()
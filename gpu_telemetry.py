@@ -0,0 +1,229 @@
+"""
+gpu telemetry shared by everything that needs to know about gpus, such as which processes are using them
+reads come from a backend; NVML bindings are used when installed, nvidia-smi otherwise, and a fake backend with made-up gpus
+can be selected with RENTAFLOP_GPU_TELEMETRY=fake for machines without gpus
+readings are cached for a short time so callers checking gpus around the same time share one read
+each gpu reading looks like:
+{"index": "0", "name": "NVIDIA GeForce RTX 3080", "bus_id": "00000000:01:00.0", "memory_used_mb": 1024, "memory_total_mb": 10240,
+ "utilization": 97, "power_w": 310.5, "temperature": 65, "clocks": {"graphics": 1905, "memory": 9501}, "pcie_gen": 3,
+ "pcie_width": 16, "processes": [{"pid": 1234, "name": "/hive/miners/t-rex/t-rex", "memory_mb": 512}]}
+values a gpu doesn't report are None
+"""
+import os
+import time
+import threading
+import subprocess
+from config import DAEMON_LOGGER, GPU_TELEMETRY_BACKEND
+try:
+    import pynvml
+except ImportError:
+    pynvml = None
+
+
+def _to_str(value):
+    # older NVML bindings return bytes
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _read_or_none(func, *args):
+    try:
+        return func(*args)
+    except Exception:
+        return None
+
+
+class NvmlBackend:
+    """
+    reads gpus in-process through NVML, without starting any processes
+    """
+    def __init__(self):
+        pynvml.nvmlInit()
+
+    def _read_processes(self, handle):
+        processes = []
+        seen_pids = set()
+        for get_processes in [pynvml.nvmlDeviceGetComputeRunningProcesses, pynvml.nvmlDeviceGetGraphicsRunningProcesses]:
+            for process in _read_or_none(get_processes, handle) or []:
+                if process.pid in seen_pids:
+                    continue
+                seen_pids.add(process.pid)
+                name = _read_or_none(pynvml.nvmlSystemGetProcessName, process.pid)
+                memory = process.usedGpuMemory
+                processes.append({"pid": process.pid, "name": _to_str(name) if name else None, \
+                                  "memory_mb": memory // 1024**2 if isinstance(memory, int) else None})
+
+        return processes
+
+    def read(self):
+        gpus = []
+        for i in range(pynvml.nvmlDeviceGetCount()):
+            handle = pynvml.nvmlDeviceGetHandleByIndex(i)
+            memory = _read_or_none(pynvml.nvmlDeviceGetMemoryInfo, handle)
+            utilization = _read_or_none(pynvml.nvmlDeviceGetUtilizationRates, handle)
+            power = _read_or_none(pynvml.nvmlDeviceGetPowerUsage, handle)
+            pci_info = _read_or_none(pynvml.nvmlDeviceGetPciInfo, handle)
+            gpus.append({
+                "index": str(i),
+                "name": _to_str(pynvml.nvmlDeviceGetName(handle)),
+                "bus_id": _to_str(pci_info.busId) if pci_info else None,
+                "memory_used_mb": memory.used // 1024**2 if memory else None,
+                "memory_total_mb": memory.total // 1024**2 if memory else None,
+                "utilization": utilization.gpu if utilization else None,
+                # reported in milliwatts
+                "power_w": power / 1000 if power is not None else None,
+                "temperature": _read_or_none(pynvml.nvmlDeviceGetTemperature, handle, pynvml.NVML_TEMPERATURE_GPU),
+                "clocks": {"graphics": _read_or_none(pynvml.nvmlDeviceGetClockInfo, handle, pynvml.NVML_CLOCK_SM),
+                           "memory": _read_or_none(pynvml.nvmlDeviceGetClockInfo, handle, pynvml.NVML_CLOCK_MEM)},
+                "pcie_gen": _read_or_none(pynvml.nvmlDeviceGetCurrPcieLinkGeneration, handle),
+                "pcie_width": _read_or_none(pynvml.nvmlDeviceGetCurrPcieLinkWidth, handle),
+                "processes": self._read_processes(handle),
+            })
+
+        return gpus
+
+
+class NvidiaSmiBackend:
+    """
+    reads gpus with two nvidia-smi queries, for hosts without NVML bindings installed
+    """
+    def _query(self, query):
+        # not using utils.run_shell_cmd since utils reads gpus through this module
+        result = subprocess.run(["nvidia-smi", query, "--format=csv,noheader,nounits"], capture_output=True, encoding="utf8")
+
+        return result.stdout if result.returncode == 0 else ""
+
+    def read(self):
+        gpu_output = self._query(f"--query-gpu={','.join(_SMI_GPU_FIELDS)}")
+        process_output = self._query("--query-compute-apps=gpu_bus_id,pid,process_name,used_memory")
+        processes = {}
+        for line in process_output.splitlines():
+            values = [value.strip() for value in line.split(",")]
+            if len(values) != 4:
+                continue
+            bus_id, pid, name, memory = values
+            processes.setdefault(bus_id, []).append({"pid": int(pid), "name": name, "memory_mb": _parse_number(memory)})
+        gpus = []
+        for line in gpu_output.splitlines():
+            values = dict(zip(_SMI_GPU_FIELDS, [value.strip() for value in line.split(",")]))
+            if len(values) != len(_SMI_GPU_FIELDS):
+                continue
+            gpus.append({
+                "index": values["index"],
+                "name": values["name"],
+                "bus_id": values["pci.bus_id"],
+                "memory_used_mb": _parse_number(values["memory.used"]),
+                "memory_total_mb": _parse_number(values["memory.total"]),
+                "utilization": _parse_number(values["utilization.gpu"]),
+                "power_w": _parse_number(values["power.draw"], float),
+                "temperature": _parse_number(values["temperature.gpu"]),
+                "clocks": {"graphics": _parse_number(values["clocks.sm"]), "memory": _parse_number(values["clocks.mem"])},
+                "pcie_gen": _parse_number(values["pcie.link.gen.current"]),
+                "pcie_width": _parse_number(values["pcie.link.width.current"]),
+                "processes": processes.get(values["pci.bus_id"], []),
+            })
+
+        return gpus
+
+
+def _parse_number(value, to_type=int):
+    """
+    return nvidia-smi value as to_type, None for values like [N/A]
+    """
+    try:
+        return to_type(float(value)) if to_type is int else to_type(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class FakeBackend:
+    """
+    made-up gpus for testing on machines without gpus; readings are whatever gpus was set to
+    """
+    def __init__(self, gpus=None):
+        if gpus is None:
+            gpus = [{"index": str(i), "name": "NVIDIA GeForce RTX 3080", "bus_id": f"00000000:0{i + 1}:00.0", "memory_used_mb": 0, \
+                     "memory_total_mb": 10240, "utilization": 0, "power_w": 20.0, "temperature": 40, \
+                     "clocks": {"graphics": 210, "memory": 405}, "pcie_gen": 3, "pcie_width": 16, "processes": []} for i in range(2)]
+        self.gpus = gpus
+
+    def read(self):
+        return self.gpus
+
+
+def _create_backend():
+    if GPU_TELEMETRY_BACKEND == "fake":
+        return FakeBackend()
+    if pynvml is not None and GPU_TELEMETRY_BACKEND in ["", "nvml"]:
+        try:
+            return NvmlBackend()
+        except Exception as e:
+            DAEMON_LOGGER.error(f"Failed to initialize NVML, reading gpus with nvidia-smi instead: {e}")
+
+    return NvidiaSmiBackend()
+
+
+def set_backend(backend):
+    """
+    replace telemetry backend, such as with a FakeBackend in tests
+    """
+    global _BACKEND, _BACKEND_PID, _CACHE
+    with _LOCK:
+        _BACKEND = backend
+        _BACKEND_PID = os.getpid()
+        _CACHE = None
+
+
+def get_gpus(max_age=None):
+    """
+    return list of gpu readings, reusing a reading up to max_age seconds old
+    """
+    global _CACHE
+    max_age = TELEMETRY_TTL if max_age is None else max_age
+    with _LOCK:
+        if _CACHE is not None and time.time() - _CACHE[0] <= max_age:
+            return _CACHE[1]
+        # backend is created lazily in the process that uses it, since NVML handles don't survive a fork
+        if _BACKEND is None or _BACKEND_PID != os.getpid():
+            _set_process_backend()
+        try:
+            gpus = _BACKEND.read()
+        except Exception as e:
+            DAEMON_LOGGER.error(f"Failed to read gpu telemetry: {e}")
+            gpus = []
+        _CACHE = (time.time(), gpus)
+
+    return gpus
+
+
+def _set_process_backend():
+    global _BACKEND, _BACKEND_PID
+    _BACKEND = _create_backend()
+    _BACKEND_PID = os.getpid()
+
+
+def get_gpu(index, max_age=None):
+    """
+    return reading of gpu at index, None if there's no such gpu
+    """
+    for gpu in get_gpus(max_age):
+        if gpu["index"] == str(index):
+            return gpu
+
+    return None
+
+
+def is_process_running(name, max_age=None):
+    """
+    return True iff a process with name in its path is using any gpu
+    """
+    return any(name in (process["name"] or "") for gpu in get_gpus(max_age) for process in gpu["processes"])
+
+
+_SMI_GPU_FIELDS = ["index", "name", "pci.bus_id", "memory.used", "memory.total", "utilization.gpu", "power.draw", "temperature.gpu", \
+                   "clocks.sm", "clocks.mem", "pcie.link.gen.current", "pcie.link.width.current"]
+# short enough that process lists are current, long enough that callers checking gpus at the same time share a read
+TELEMETRY_TTL = 2
+_BACKEND = None
+_BACKEND_PID = None
+_CACHE = None
+_LOCK = threading.Lock()
@@ -77,4 +77,11 @@ calc_stats() {
     echo $stats
 }
 
-calc_stats $1
+# rentaflop daemon writes stats to this snapshot while it's running, so they only need to be reshaped here if it's stale
+# must match trex_stats.get_snapshot_path
+snapshot="/tmp/rentaflop_trex_stats_$1.txt"
+if [[ -f $snapshot && $(( $(date +%s) - $(stat -c %Y "$snapshot") )) -lt 30 ]]; then
+    cat "$snapshot"
+else
+    calc_stats $1
+fi
@@ -0,0 +1,177 @@
+"""
+shared http client for calls to rentaflop servers and storage
+keeps a pool of kept-alive connections per host so repeated calls skip tcp and tls handshakes, retries failed requests with
+jittered backoff, and counts requests, errors, and latency per endpoint
+endpoints are a method and host unless callers label them, so presigned urls, which differ on every call, share one set of counters
+"""
+import os
+import time
+import random
+import socket
+import ipaddress
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from config import DAEMON_LOGGER
+
+
+def _get_session(url):
+    """
+    return this process's session for url's host, creating it if needed
+    sessions aren't shared with forked processes since their pooled connections can't be
+    """
+    parts = urlsplit(url)
+    key = (os.getpid(), parts.scheme, parts.netloc)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount(f"{parts.scheme}://", adapter)
+            _SESSIONS[key] = session
+
+    return session
+
+
+def _record(endpoint, latency, is_error):
+    with _METRICS_LOCK:
+        metrics = _METRICS.setdefault(endpoint, {"requests": 0, "errors": 0, "total_latency": 0.0, "max_latency": 0.0})
+        metrics["requests"] += 1
+        metrics["errors"] += int(is_error)
+        metrics["total_latency"] += latency
+        metrics["max_latency"] = max(metrics["max_latency"], latency)
+
+
+def get_metrics(reset=False):
+    """
+    return {endpoint: {"requests": ..., "errors": ..., "avg_latency": ..., "max_latency": ...}} for requests made by this process
+    endpoint looks like "PUT storage.example.com" or a caller's label like "POST /api/host/daemon"; latencies are in seconds
+    if reset, counters start over so the next call only covers requests made since this one
+    """
+    global _METRICS
+    with _METRICS_LOCK:
+        metrics_by_endpoint = _METRICS
+        if reset:
+            _METRICS = {}
+
+    return {endpoint: {"requests": metrics["requests"], "errors": metrics["errors"], \
+                       "avg_latency": round(metrics["total_latency"] / metrics["requests"], 4), \
+                       "max_latency": round(metrics["max_latency"], 4)} for endpoint, metrics in metrics_by_endpoint.items()}
+
+
+def _is_unsent(e):
+    """
+    return True iff request failed before it could have reached the server
+    """
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(e.args[0], "reason", None) if e.args else None
+
+    return isinstance(reason, NewConnectionError)
+
+
+def request(method, url, max_retries=None, timeout=None, retry_statuses=None, is_idempotent=None, endpoint=None, **kwargs):
+    """
+    make request with a pooled session, retrying connection errors, timeouts, and retry_statuses up to max_retries attempts in total
+    endpoint labels request in metrics and logs, defaulting to its method and host
+    requests that aren't idempotent, which by default is every POST, are only retried if they never reached the server, since a
+    lost response to something like a checkin or confirm can't be told apart from a request the server never processed
+    kwargs are passed to requests; bodies that can only be read once, like open files, must use max_retries=1
+    return response of last attempt; raises requests.exceptions.RequestException if the last attempt failed to connect
+    """
+    max_retries = max_retries or MAX_RETRIES
+    timeout = timeout or TIMEOUT
+    is_idempotent = method.upper() in IDEMPOTENT_METHODS if is_idempotent is None else is_idempotent
+    retry_statuses = RETRY_STATUSES if retry_statuses is None else retry_statuses
+    if not is_idempotent:
+        # server turned request away without processing it
+        retry_statuses = set(retry_statuses) & {429}
+    endpoint = endpoint or f"{method.upper()} {urlsplit(url).netloc}"
+    session = _get_session(url)
+    for attempt in range(max_retries):
+        start_time = time.time()
+        try:
+            response = session.request(method, url, timeout=timeout, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            _record(endpoint, time.time() - start_time, True)
+            if attempt == max_retries - 1 or not (is_idempotent or _is_unsent(e)):
+                raise
+            DAEMON_LOGGER.info(f"{endpoint} failed on attempt {attempt + 1}/{max_retries}: {e}")
+        else:
+            is_retryable = response.status_code in retry_statuses
+            _record(endpoint, time.time() - start_time, not response.ok)
+            if not is_retryable or attempt == max_retries - 1:
+                return response
+            DAEMON_LOGGER.info(f"{endpoint} returned {response.status_code} on attempt {attempt + 1}/{max_retries}")
+            response.close()
+        # full jitter so hosts that lost their connection at the same time don't all retry at once
+        time.sleep(random.uniform(0, min(BACKOFF_BASE * 2**attempt, BACKOFF_MAX)))
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def put(url, **kwargs):
+    return request("PUT", url, **kwargs)
+
+
+def _get_local_address():
+    """
+    return local address of the default route, which changes when the host's network connection does
+    connecting a udp socket only picks a route, so nothing is sent
+    """
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+
+def get_public_ip():
+    """
+    return host's public ip, None if it can't be found
+    only looked up again once the local network connection changes or the cached ip is older than PUBLIC_IP_TTL
+    """
+    global _PUBLIC_IP
+    local_address = _get_local_address()
+    with _PUBLIC_IP_LOCK:
+        ip, checked_at, checked_local_address = _PUBLIC_IP
+        if ip and local_address == checked_local_address and time.time() - checked_at < PUBLIC_IP_TTL:
+            return ip
+        try:
+            response = get("https://api.ipify.org", max_retries=2, timeout=(5, 10))
+            response.raise_for_status()
+            # error pages from proxies and captive portals can come back with a 200
+            new_ip = str(ipaddress.ip_address(response.content.decode("utf8").strip()))
+        except (requests.exceptions.RequestException, ValueError) as e:
+            DAEMON_LOGGER.info(f"Failed to look up public ip: {e}")
+            # keep reporting the last known ip rather than none while offline
+            return ip
+        _PUBLIC_IP = (new_ip, time.time(), local_address)
+
+    return new_ip
+
+
+MAX_RETRIES = 3
+# (connect, read) timeouts in seconds
+TIMEOUT = (10, 60)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+BACKOFF_BASE = 1
+BACKOFF_MAX = 30
+POOL_SIZE = 8
+PUBLIC_IP_TTL = 60 * 60
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_METRICS = {}
+_METRICS_LOCK = threading.Lock()
+_PUBLIC_IP = (None, 0, None)
+_PUBLIC_IP_LOCK = threading.Lock()
@@ -0,0 +1,199 @@
+"""
+on-host cache of extracted render inputs so repeated tasks from the same job skip the download and extraction
+entries are keyed by job id plus content hash or ETag and stored once, then hardlinked into each task directory
+cache is evicted in LRU order once it grows past its size cap
+"""
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import datetime as dt
+from config import DAEMON_LOGGER
+
+
+def get_cache_key(job_id, content_id):
+    """
+    return cache key for job's input file identified by content_id, which is an ETag or content hash
+    """
+    content_id = content_id.replace('"', "").replace("/", "_")
+
+    return f"{job_id}-{content_id}"
+
+
+def _get_max_size():
+    """
+    return max number of bytes the cache may hold, bounded by a fraction of its filesystem size
+    """
+    disk_total = shutil.disk_usage(CACHE_DIR).total
+
+    return min(MAX_CACHE_SIZE, int(disk_total * MAX_CACHE_FRACTION))
+
+
+def _link_tree(src_dir, dst_dir, exclude=(), include=None):
+    """
+    hardlink every file under src_dir into dst_dir, falling back to a copy if hardlinks aren't possible
+    if include is set, only files with relative paths in include are linked
+    return total bytes linked
+    """
+    total_size = 0
+    for root, _, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        os.makedirs(os.path.join(dst_dir, rel_root), exist_ok=True)
+        for file_name in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, file_name))
+            if rel_path in exclude or (include is not None and rel_path not in include):
+                continue
+            src_path = os.path.join(src_dir, rel_path)
+            dst_path = os.path.join(dst_dir, rel_path)
+            try:
+                os.link(src_path, dst_path)
+            except OSError:
+                # different filesystem or hardlinks unsupported
+                shutil.copy2(src_path, dst_path)
+            total_size += os.path.getsize(src_path)
+
+    return total_size
+
+
+def _read_stats():
+    """
+    return today's cache stats, resetting counters if stats are from a previous day
+    """
+    today = dt.date.today().isoformat()
+    stats = {}
+    try:
+        with open(STATS_FILE, "r") as f:
+            stats = json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        pass
+    if stats.get("date") != today:
+        stats = {"date": today, "hits": 0, "misses": 0, "saved_minutes": 0.0}
+
+    return stats
+
+
+def _record(is_hit, saved_seconds=0.0):
+    """
+    update hit and miss counters
+    stats are written to disk since status may be requested from a different process
+    """
+    stats = _read_stats()
+    if is_hit:
+        stats["hits"] += 1
+        stats["saved_minutes"] = round(stats["saved_minutes"] + saved_seconds / 60.0, 2)
+    else:
+        stats["misses"] += 1
+    with open(STATS_FILE, "w") as f:
+        json.dump(stats, f)
+
+
+def get_input_cache_stats():
+    """
+    return dict with today's cache hits, misses, and minutes of download and extraction saved
+    """
+    return _read_stats()
+
+
+def has_entry(cache_key):
+    """
+    return True iff cache contains input for cache_key
+    """
+    with _LOCK:
+        return cache_key in _ENTRIES
+
+
+def link_entry(cache_key, task_dir):
+    """
+    populate task_dir with cached input files
+    return entry dict with main_file and uuid_str, or None if not cached
+    """
+    with _LOCK:
+        entry = _ENTRIES.get(cache_key)
+        if not entry:
+            return None
+        entry["last_used"] = time.time()
+        _link_tree(entry["path"], task_dir)
+        _record(True, entry["ingest_time"])
+        DAEMON_LOGGER.debug(f"Input cache hit for {cache_key}, saved {entry['ingest_time']:.2f}s")
+
+        return {"main_file": entry["main_file"], "uuid_str": entry["uuid_str"]}
+
+
+def link_previous_job_entry(job_id, task_dir, include):
+    """
+    populate task_dir with files from the job's most recently used entry that are also in include, excluding its main file
+    include is the relative paths of files in the job's new input, so files it no longer has aren't carried over
+    used when a job's input changed so archive extraction only has to write members that differ
+    return True iff an entry was found
+    """
+    with _LOCK:
+        job_keys = [key for key in _ENTRIES if key.startswith(f"{job_id}-")]
+        if not job_keys:
+            return False
+        entry = _ENTRIES[max(job_keys, key=lambda key: _ENTRIES[key]["last_used"])]
+        _link_tree(entry["path"], task_dir, exclude=[os.path.normpath(entry["main_file"])], include=include)
+
+        return True
+
+
+def _evict(max_size):
+    """
+    remove least recently used entries until cache is under max_size bytes
+    requires caller to hold _LOCK
+    """
+    total_size = sum(entry["size"] for entry in _ENTRIES.values())
+    least_to_most_recent = sorted(_ENTRIES, key=lambda key: _ENTRIES[key]["last_used"])
+    for cache_key in least_to_most_recent:
+        if total_size <= max_size:
+            break
+        entry = _ENTRIES.pop(cache_key)
+        shutil.rmtree(entry["path"], ignore_errors=True)
+        total_size -= entry["size"]
+        DAEMON_LOGGER.debug(f"Evicted {cache_key} from input cache")
+
+
+def add_entry(cache_key, task_dir, main_file, uuid_str, ingest_time, exclude=()):
+    """
+    add input files already extracted into task_dir to the cache
+    main_file is path of main render file relative to task_dir and ingest_time is seconds spent downloading and extracting
+    files in exclude are task-specific and not cached
+    """
+    cache_path = os.path.join(CACHE_DIR, cache_key)
+    with _LOCK:
+        _record(False)
+        if cache_key in _ENTRIES:
+            return
+        shutil.rmtree(cache_path, ignore_errors=True)
+        size = _link_tree(task_dir, cache_path, exclude=exclude)
+        max_size = _get_max_size()
+        if size > max_size:
+            shutil.rmtree(cache_path, ignore_errors=True)
+            DAEMON_LOGGER.debug(f"Input for {cache_key} too large to cache ({size} bytes)")
+
+            return
+        _ENTRIES[cache_key] = {"path": cache_path, "size": size, "main_file": main_file, "uuid_str": uuid_str, \
+                               "ingest_time": ingest_time, "last_used": time.time()}
+        _evict(max_size)
+
+
+def clear_input_cache():
+    """
+    remove all cached inputs; called on startup since the cache index isn't persisted between daemon runs
+    """
+    with _LOCK:
+        _ENTRIES.clear()
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+
+
+# kept on the same filesystem as task directories so entries can be hardlinked
+CACHE_DIR = os.path.join(tempfile.gettempdir(), "rentaflop_input_cache")
+STATS_FILE = os.path.join(tempfile.gettempdir(), "rentaflop_input_cache_stats.json")
+MAX_CACHE_SIZE = 10 * 1024 * 1024 * 1024
+MAX_CACHE_FRACTION = 0.25
+os.makedirs(CACHE_DIR, exist_ok=True)
+# cache_key -> {"path": ..., "size": ..., "main_file": ..., "uuid_str": ..., "ingest_time": ..., "last_used": ...}
+_ENTRIES = {}
+_LOCK = threading.Lock()
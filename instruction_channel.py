@@ -0,0 +1,101 @@
+"""
+long-poll channel that receives instructions from rentaflop servers as soon as they're queued
+each poll is held open by the server until instructions arrive or the poll times out, then the next poll is sent right away;
+failed polls are retried with jittered backoff, and the periodic checkin keeps delivering instructions while the channel is down
+channel is off unless RENTAFLOP_INSTRUCTION_CHANNEL_URL is set, since rentaflop servers don't serve a long-poll endpoint yet
+poll is a POST of {"rentaflop_id": ..., "max_instructions": ..., "wait": seconds server may hold poll}
+response looks like {"instructions": [{"cmd": ..., "params": ..., "rentaflop_id": ...}, ...]}
+"""
+import time
+import random
+import threading
+import requests
+import http_client
+from config import DAEMON_LOGGER
+
+
+class InstructionChannel:
+    """
+    polls url in a background thread, posting get_payload() and passing each non-empty list of instructions to on_instructions
+    """
+    def __init__(self, url, get_payload, on_instructions, poll_timeout=None):
+        self.url = url
+        self.get_payload = get_payload
+        self.on_instructions = on_instructions
+        self.poll_timeout = poll_timeout or POLL_TIMEOUT
+        self.is_connected = False
+        self.reconnects = 0
+        self.instructions_received = 0
+        self._failures = 0
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def poll(self):
+        """
+        send one poll and hand off any instructions received
+        return number of instructions received; raises requests.exceptions.RequestException or ValueError if poll failed
+        """
+        data = dict(self.get_payload(), wait=self.poll_timeout)
+        # read timeout leaves the server time to answer a poll it held for the whole timeout
+        response = http_client.post(self.url, json=data, max_retries=1, timeout=(10, self.poll_timeout + READ_TIMEOUT_MARGIN), \
+                                    retry_statuses=set())
+        response.raise_for_status()
+        instructions = response.json().get("instructions") or []
+        if instructions:
+            self.instructions_received += len(instructions)
+            self.on_instructions(instructions)
+
+        return len(instructions)
+
+    def _backoff(self):
+        # full jitter so hosts that lost the server at the same time don't all reconnect at once
+        return random.uniform(0, min(BACKOFF_BASE * 2**self._failures, BACKOFF_MAX))
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.poll()
+            except (requests.exceptions.RequestException, ValueError) as e:
+                if self.is_connected or self._failures == 0:
+                    DAEMON_LOGGER.info(f"Instruction channel disconnected, relying on checkins until it reconnects: {e}")
+                self.is_connected = False
+                self._failures += 1
+                self._stop_event.wait(self._backoff())
+                continue
+            except Exception as e:
+                # keep channel alive through bugs in instruction handling; checkins would still deliver instructions
+                DAEMON_LOGGER.exception(f"Caught exception in instruction channel: {e}")
+                self._failures += 1
+                self._stop_event.wait(self._backoff())
+                continue
+            if not self.is_connected:
+                if self._failures:
+                    self.reconnects += 1
+                DAEMON_LOGGER.debug("Instruction channel connected.")
+            self.is_connected = True
+            self._failures = 0
+
+    def start(self):
+        """
+        start polling in the background; must be called in the process that runs instructions
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        stop polling once the current poll returns
+        """
+        self._stop_event.set()
+
+    def get_metrics(self):
+        return {"connected": self.is_connected, "reconnects": self.reconnects, "instructions": self.instructions_received}
+
+
+# seconds the server may hold each poll open before answering with no instructions
+POLL_TIMEOUT = 30
+READ_TIMEOUT_MARGIN = 15
+BACKOFF_BASE = 1
+# servers without a long-poll endpoint are retried rarely, since checkins deliver their instructions
+BACKOFF_MAX = 300
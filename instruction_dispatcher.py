@@ -0,0 +1,171 @@
+"""
+runs daemon instructions from rentaflop servers through the daemon's command functions
+instructions received on checkin are run here, in the daemon process, on a bounded pool of worker threads rather than being
+re-posted to the local https server; that server is only for requests that actually come from outside the host
+instructions are run concurrently unless they share an ordering key, such as a task id or gpu, in which case they run in the order
+they were submitted; instructions without keys, like updates, run alone after everything submitted before them
+instruction looks like {"cmd": ..., "params": ..., "rentaflop_id": ...}
+"""
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, Future
+from config import DAEMON_LOGGER
+from utils import log_before_after
+
+
+class InstructionDispatcher:
+    """
+    looks up each instruction's cmd in cmd_to_func and runs it, calling on_finished if the command returns True,
+    which means the daemon should shut down
+    get_keys returns an instruction's ordering keys: a set of hashable keys, an empty set if it can run alongside anything,
+    or None if it must run alone; every instruction runs alone if get_keys isn't given
+    """
+    def __init__(self, cmd_to_func, on_finished=None, max_workers=None, get_keys=None):
+        self.cmd_to_func = cmd_to_func
+        self.on_finished = on_finished
+        self.max_workers = max_workers or MAX_WORKERS
+        self.get_keys = get_keys
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        # key -> future of last submitted instruction with key, and future of last instruction that runs alone
+        self._tails = {}
+        self._barrier = None
+        self._pending = set()
+        self._order_lock = threading.Lock()
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def dispatch(self, cmd, params):
+        """
+        run cmd with params now, in the calling thread
+        return what cmd's function returned, False if cmd is unknown or failed
+        """
+        func = self.cmd_to_func.get(cmd)
+        finished = False
+        if func:
+            try:
+                if cmd != "status":
+                    func_log = log_before_after(func, params)
+                    finished = func_log()
+                else:
+                    # avoid logging on status since this is called every 10 seconds by hive stats checker
+                    finished = func(params)
+            except Exception as e:
+                DAEMON_LOGGER.exception(f"Caught exception: {e}")
+                error = traceback.format_exc()
+                DAEMON_LOGGER.error(f"More info on exception: {error}")
+        if finished is True and self.on_finished:
+            self.on_finished(finished)
+
+        return finished
+
+    def _get_executor(self):
+        # created on first use so it's never carried through a fork into the server process
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="instruction")
+
+            return self._executor
+
+    def _run(self, instruction, submitted_at):
+        cmd = instruction.get("cmd")
+        started_at = time.time()
+        self.dispatch(cmd, instruction.get("params"))
+        finished_at = time.time()
+        self._record(cmd, started_at - submitted_at, finished_at - submitted_at)
+        if cmd != "status":
+            DAEMON_LOGGER.debug(f"Dispatched {cmd} in {round(finished_at - submitted_at, 4)}s")
+
+    def _get_dependencies(self, future, keys):
+        """
+        return futures of earlier instructions that must finish before instruction with keys, registering future as the
+        latest instruction for its keys
+        must be called with order lock held
+        """
+        if keys is None:
+            dependencies = set(self._pending)
+            # anything submitted later waits for this instruction, so earlier tails no longer matter
+            self._tails.clear()
+            self._barrier = future
+        else:
+            dependencies = {self._tails[key] for key in keys if key in self._tails}
+            if self._barrier:
+                dependencies.add(self._barrier)
+            for key in keys:
+                self._tails[key] = future
+        self._pending.add(future)
+
+        return dependencies
+
+    def _forget(self, future, keys):
+        with self._order_lock:
+            self._pending.discard(future)
+            if self._barrier is future:
+                self._barrier = None
+            for key in keys or []:
+                if self._tails.get(key) is future:
+                    del self._tails[key]
+
+    def _start(self, future, instruction, submitted_at):
+        def copy_result(inner):
+            if inner.exception():
+                future.set_exception(inner.exception())
+            else:
+                future.set_result(inner.result())
+
+        self._get_executor().submit(self._run, instruction, submitted_at).add_done_callback(copy_result)
+
+    def submit(self, instruction):
+        """
+        run instruction on worker pool once earlier instructions it's ordered after have finished
+        return future that's done once instruction has run
+        """
+        submitted_at = time.time()
+        keys = self.get_keys(instruction) if self.get_keys else None
+        future = Future()
+        with self._order_lock:
+            dependencies = self._get_dependencies(future, keys)
+        future.add_done_callback(lambda _: self._forget(future, keys))
+        if not dependencies:
+            self._start(future, instruction, submitted_at)
+
+            return future
+        # instruction is handed to pool only once it's ready so waiting instructions never hold a worker
+        remaining = [len(dependencies)]
+        remaining_lock = threading.Lock()
+        def on_dependency_done(_):
+            with remaining_lock:
+                remaining[0] -= 1
+                is_ready = remaining[0] == 0
+            if is_ready:
+                self._start(future, instruction, submitted_at)
+
+        for dependency in dependencies:
+            dependency.add_done_callback(on_dependency_done)
+
+        return future
+
+    def _record(self, cmd, wait, latency):
+        with self._metrics_lock:
+            metrics = self._metrics.setdefault(cmd, {"instructions": 0, "total_wait": 0.0, "total_latency": 0.0, "max_latency": 0.0})
+            metrics["instructions"] += 1
+            metrics["total_wait"] += wait
+            metrics["total_latency"] += latency
+            metrics["max_latency"] = max(metrics["max_latency"], latency)
+
+    def get_metrics(self):
+        """
+        return {cmd: {"instructions": ..., "avg_wait": ..., "avg_latency": ..., "max_latency": ...}} for submitted instructions
+        wait is time spent waiting for earlier instructions and a worker, and latency is time from submit until instruction
+        finished, both in seconds
+        """
+        with self._metrics_lock:
+            return {cmd: {"instructions": metrics["instructions"], \
+                          "avg_wait": round(metrics["total_wait"] / metrics["instructions"], 4), \
+                          "avg_latency": round(metrics["total_latency"] / metrics["instructions"], 4), \
+                          "max_latency": round(metrics["max_latency"], 4)} for cmd, metrics in self._metrics.items()}
+
+
+# instructions are mostly short calls into the task queue, so a few workers are plenty
+MAX_WORKERS = 4
@@ -0,0 +1,115 @@
+"""
+follows blender task logs incrementally so render progress can be read from memory on every status poll
+each log is read from where the last read stopped, so a status call only parses lines written since the previous one
+"""
+import os
+import re
+import threading
+
+
+class LogTailer:
+    """
+    keeps byte offset into a task log and the progress parsed from it so far
+    """
+    def __init__(self, log_path, start_frame):
+        self.log_path = log_path
+        self.start_frame = int(start_frame)
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.inode = None
+        self.partial = b""
+        self.frame_in_progress = None
+        self.last_frame_saved = None
+        # fraction of current frame's samples rendered, None for engines that don't report samples
+        self.sample_progress = None
+        self.peak_memory_mb = None
+
+    def update(self):
+        """
+        parse lines appended to log since last update
+        """
+        with self._lock:
+            try:
+                stat = os.stat(self.log_path)
+            except FileNotFoundError:
+                return
+            # log is rewritten when a task is retried, so start over
+            if stat.st_ino != self.inode or stat.st_size < self.offset:
+                self._reset()
+                self.inode = stat.st_ino
+            if stat.st_size == self.offset:
+                return
+            with open(self.log_path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read(stat.st_size - self.offset)
+            self.offset += len(data)
+            lines = (self.partial + data).split(b"\n")
+            # last element is an incomplete line or empty
+            self.partial = lines.pop()
+            for line in lines:
+                self._parse_line(line.decode("utf8", errors="replace"))
+
+    def _parse_line(self, line):
+        if line.startswith("Fra:"):
+            match = _FRAME_RE.match(line)
+            if match:
+                frame = int(match.group(1))
+                if frame != self.frame_in_progress:
+                    self.frame_in_progress = frame
+                    self.sample_progress = None
+            for value, unit in _PEAK_RE.findall(line):
+                peak = float(value) * _UNIT_MB[unit]
+                self.peak_memory_mb = peak if self.peak_memory_mb is None else max(self.peak_memory_mb, peak)
+            samples = _SAMPLE_RE.search(line)
+            if samples and int(samples.group(2)):
+                self.sample_progress = round(int(samples.group(1)) / int(samples.group(2)), 3)
+        elif line.startswith("Saved:"):
+            self.last_frame_saved = self.frame_in_progress
+
+    def get_progress(self):
+        """
+        return progress parsed so far without reading log
+        """
+        last_frame_completed = None
+        if self.frame_in_progress is not None and self.frame_in_progress != self.start_frame:
+            last_frame_completed = self.frame_in_progress - 1
+        # current frame is done once it's saved, even before blender logs the next one
+        if self.last_frame_saved is not None and (last_frame_completed is None or self.last_frame_saved > last_frame_completed):
+            last_frame_completed = self.last_frame_saved
+
+        return {"last_frame_completed": last_frame_completed, "sample_progress": self.sample_progress, \
+                "peak_memory_mb": self.peak_memory_mb}
+
+
+def get_log_progress(task_dir, start_frame):
+    """
+    return progress of render logging to task_dir/log.txt, reading only what was logged since last call
+    """
+    with _TAILERS_LOCK:
+        tailer = _TAILERS.get(task_dir)
+        if tailer is None or tailer.start_frame != int(start_frame):
+            tailer = LogTailer(os.path.join(task_dir, "log.txt"), start_frame)
+            _TAILERS[task_dir] = tailer
+    tailer.update()
+
+    return tailer.get_progress()
+
+
+def remove_tailer(task_dir):
+    """
+    forget task's log once task is removed
+    """
+    with _TAILERS_LOCK:
+        _TAILERS.pop(task_dir, None)
+
+
+# Fra:12 Mem:1024.50M (Peak 2048.00M) | Time:00:10.12 | Mem:512.00M, Peak:600.00M | Scene, ViewLayer | Sample 64/128
+_FRAME_RE = re.compile(r"Fra:(\d+)")
+_PEAK_RE = re.compile(r"Peak[: ]\s*([\d.]+)([KMG])")
+_SAMPLE_RE = re.compile(r"Sample (\d+)/(\d+)")
+_UNIT_MB = {"K": 1 / 1024, "M": 1, "G": 1024}
+_TAILERS = {}
+_TAILERS_LOCK = threading.Lock()
@@ -5,14 +5,22 @@ import os
 import logging
 import uuid
 import multiprocessing
+import concurrent.futures
 from flask import jsonify, request, abort, redirect
 from flask_apscheduler import APScheduler
-from config import DAEMON_LOGGER, FIRST_STARTUP, LOG_FILE, REGISTRATION_FILE, DAEMON_PORT, app, db, _get_logger
+from config import DAEMON_LOGGER, FIRST_STARTUP, LOG_FILE, REGISTRATION_FILE, DAEMON_PORT, CHECKIN_BATCH_SIZE, \
+    INSTRUCTION_CHANNEL_URL, app, db, _get_logger
 from utils import *
-from task_queue import push_task, pop_task, update_queue, queue_status
+from task_queue import push_task, pop_task, update_queue, queue_status, create_task_dir, start_queue_listener
 import sys
-import requests
+import http_client
 from requirement_checks import perform_host_requirement_checks
+from input_cache import clear_input_cache
+from encryption import generate_key
+from blender_store import record_blender_request, ensure_blender, prefetch_blender_versions
+from state_cache import StateCache
+from instruction_dispatcher import InstructionDispatcher
+from instruction_channel import InstructionChannel
 import json
 import socket
 import urllib3
@@ -52,6 +60,16 @@ def _start_mining(startup=False):
         mine({"action": "start"})
 
 
+def _prefetch_blender():
+    """
+    prefetch blender versions likely to be requested while gpus aren't running tasks
+    """
+    if queue_status({})["queue"]:
+        return
+
+    prefetch_blender_versions()
+
+
 def _get_registration(is_checkin=True):
     """
     return registration details from registration file or register if it doesn't exist
@@ -100,17 +118,23 @@ def _get_registration(is_checkin=True):
             
             return _get_registration(is_checkin=is_checkin)
     
-    # using external website to get ip address
-    try:
-        ip = requests.get('https://api.ipify.org').content.decode('utf8')
-    except requests.exceptions.ConnectionError:
-        ip = None
+    # using external website to get ip address, which is cached until the network connection changes
+    ip = http_client.get_public_ip()
     # register host with rentaflop or perform checkin if already registered
     data = {"state": get_state(RENTAFLOP_CONFIG["available_resources"], queue_status, quiet=is_checkin, version=RENTAFLOP_CONFIG["version"]), \
             "ip": ip, "rentaflop_id": rentaflop_id, "email": crypto_config["email"], "wallet_address": crypto_config["wallet_address"], \
             "task_miner_currency": crypto_config["task_miner_currency"]}
     if not is_checkin:
         data["ignore_instruction"] = True
+    else:
+        # latency and error counts of this process's calls to rentaflop servers and storage since the last checkin
+        data["http_metrics"] = http_client.get_metrics(reset=True)
+        # time from receiving each instruction until it finished running
+        data["dispatch_metrics"] = _DISPATCHER.get_metrics()
+        # servers that support batching return up to this many instructions as {"instructions": [...]}
+        data["max_instructions"] = CHECKIN_BATCH_SIZE
+        if _INSTRUCTION_CHANNEL:
+            data["instruction_channel"] = _INSTRUCTION_CHANNEL.get_metrics()
     response_json = post_to_rentaflop(data, "daemon", quiet=is_checkin)
     if response_json is None:
         type_str = "checkin" if is_checkin else "registration"
@@ -139,23 +163,82 @@ def _get_registration(is_checkin=True):
     return rentaflop_id, sandbox_id, crypto_config
 
 
+def _get_instructions():
+    """
+    check in with rentaflop servers
+    return list of instructions received and whether more may be waiting
+    """
+    response_json = _get_registration()
+    # servers that don't batch instructions return a single instruction, or {} if instruction queue empty
+    if "instructions" not in response_json:
+        return ([response_json] if response_json else []), bool(response_json)
+    instructions = response_json["instructions"]
+
+    return instructions, len(instructions) >= CHECKIN_BATCH_SIZE
+
+
 def _handle_checkin():
     """
     handles checkins with rentaflop servers and executes instructions returned
     continues reading instructions until queue is empty
     """
-    finished = False
-    while not finished:
-        # instruction looks like {"cmd": ..., "params": ..., "rentaflop_id": ...}
-        # {} if instruction queue empty
-        instruction_json = _get_registration()
-        # if no instruction, do nothing otherwise execute instruction
-        if not instruction_json:
-            finished = True
-        else:
-            # hand off instruction to localhost web server
-            files = {"json": json.dumps(instruction_json)}
-            requests.post(f"https://localhost:{DAEMON_PORT}", files=files, verify=False)
+    has_more = True
+    while has_more:
+        instructions, has_more = _get_instructions()
+        futures = _submit_instructions(instructions)
+        # batch finishes before next checkin so state sent with it reflects these instructions
+        concurrent.futures.wait(futures)
+
+
+def _submit_instructions(instructions):
+    """
+    run instructions received from checkin or instruction channel
+    return futures that are done once each instruction has run
+    """
+    futures = []
+    # instruction looks like {"cmd": ..., "params": ..., "rentaflop_id": ...}
+    for instruction_json in instructions:
+        if instruction_json.get("rentaflop_id", "") != RENTAFLOP_CONFIG["rentaflop_id"]:
+            DAEMON_LOGGER.error(f"Ignoring instruction for another host: {instruction_json.get('cmd')}")
+            continue
+        # run in this process rather than handing off to localhost web server, which would cost a tls handshake per instruction
+        # instructions for different tasks run concurrently; see _get_ordering_keys
+        futures.append(_DISPATCHER.submit(instruction_json))
+
+    return futures
+
+
+def _start_instruction_channel():
+    """
+    start receiving instructions as soon as they're queued rather than on the next checkin
+    """
+    global _INSTRUCTION_CHANNEL
+    if not INSTRUCTION_CHANNEL_URL:
+        return
+    get_payload = lambda: {"rentaflop_id": RENTAFLOP_CONFIG["rentaflop_id"], "max_instructions": CHECKIN_BATCH_SIZE}
+    _INSTRUCTION_CHANNEL = InstructionChannel(INSTRUCTION_CHANNEL_URL, get_payload, _submit_instructions)
+    _INSTRUCTION_CHANNEL.start()
+
+
+def _get_ordering_keys(instruction):
+    """
+    return keys of what instruction acts on, so instructions acting on the same task or gpu run in the order they were received
+    empty set if instruction only reads state, None if it acts on the whole host and must run alone
+    """
+    cmd = instruction.get("cmd")
+    params = instruction.get("params") or {}
+    if cmd in ["status", "send_logs"]:
+        return set()
+    # crypto mining starts and stops affect every gpu and stop all tasks, so only task starts and stops are ordered by key
+    if cmd != "mine" or not params.get("task_id"):
+        return None
+    keys = {("task", str(params["task_id"]))}
+    for directive in (params.get("directives") or "").split(";"):
+        k, _, v = directive.partition("=")
+        if k == "CUDA_VISIBLE_DEVICES":
+            keys.update(("gpu", gpu.strip()) for gpu in v.split(",") if gpu.strip())
+
+    return keys
 
 
 def _first_startup():
@@ -247,6 +330,7 @@ def _handle_startup():
     run_shell_cmd("./nvidia_uvm_init.sh", quiet=True)
     # must do installation check before anything required by it is used
     check_installation()
+    clear_input_cache()
     global RENTAFLOP_CONFIG
     RENTAFLOP_CONFIG["available_resources"] = _get_available_resources()
     RENTAFLOP_CONFIG["version"] = run_shell_cmd("git rev-parse --short HEAD", quiet=True, format_output=False).replace("\n", "")
@@ -264,22 +348,23 @@ def _handle_startup():
 
 def send_to_task_queue(data):
     """
-    send commands, files, and params to job queue functions
+    send commands and params to job queue functions
     """
     cmd = data.get("cmd")
     params = data.get("params")
-    render_file = data.get("render_file")
-    if render_file:
-        params["render_file"] = render_file
+    result = TASK_QUEUE_CMD_TO_FUNC[cmd](params)
+    # so status reflects pushed and popped tasks without waiting for the next refresh
+    if _STATE_CACHE and cmd != "queue_status":
+        _STATE_CACHE.request_refresh("queue")
 
-    return TASK_QUEUE_CMD_TO_FUNC[cmd](params)
+    return result
 
 
 def mine(params):
     """
     handle commands related to mining, whether crypto mining or guest "mining"
-    params looks like {"action": "start" | "stop", "task_id": "13245", "render_file": contents}
-    iff render job, we receive task_id and render_file parameter (if action is start) that contains data to be rendered
+    params looks like {"action": "start" | "stop", "task_id": "13245", "job_id": "123", ...}
+    iff render job, we receive task_id and job_id parameters (if action is start) used to download the file to be rendered
     """
     action = params["action"]
     task_id = params.get("task_id")
@@ -307,7 +392,25 @@ def mine(params):
     
     if action == "start":
         if is_render:
-            render_file, filename = get_render_file(RENTAFLOP_CONFIG["rentaflop_id"], job_id)
+            record_blender_request(blender_version)
+            # check prefetch state first so blender download overlaps with input download without fetching a version twice
+            ensure_blender(blender_version)
+            # render file is streamed straight into task directory so it's never held in memory
+            task_dir = create_task_dir(task_id)
+            if not task_dir:
+                DAEMON_LOGGER.info(f"Task {task_id} already in queue! Exiting...")
+                return
+            download_start_time = time.time()
+            # render file is encrypted at rest with this key as it's downloaded
+            uuid_str = generate_key()
+            try:
+                # render_path is None if job's input is already cached, in which case it's already linked into task_dir
+                render_path, filename, cache_key, cached_input = get_render_file(RENTAFLOP_CONFIG["rentaflop_id"], job_id, task_dir, uuid_str)
+            except:
+                # clean up partial download so task can be pushed again
+                run_shell_cmd(f"rm -rf {task_dir}", very_quiet=True)
+                raise
+            download_time = time.time() - download_start_time
             extension = os.path.splitext(filename)[1]
             is_zip = True if extension in [".zip"] else False
             stop_crypto_miner()
@@ -315,7 +418,9 @@ def mine(params):
             end_frame = start_frame + n_frames - 1
             data = {"cmd": "push_task", "params": {"task_id": task_id, "start_frame": start_frame, "end_frame": end_frame, "blender_version": blender_version, \
                                                    "is_cpu": is_cpu, "cuda_visible_devices": cuda_visible_devices, "is_zip": is_zip, \
-                                                   "render_settings": render_settings}, "render_file": render_file}
+                                                   "render_settings": render_settings, "render_path": render_path, \
+                                                   "cache_key": cache_key, "download_time": download_time, "uuid_str": uuid_str, \
+                                                   "job_id": job_id, "cached_input": cached_input}}
             send_to_task_queue(data)
         else:
             if RENTAFLOP_CONFIG["crypto_config"]["disable_crypto"]:
@@ -419,6 +524,11 @@ def status(params):
     """
     return the state of this host
     """
+    # hive polls this every 10 seconds, so it's served from a background-refreshed snapshot when the server has one
+    if _STATE_CACHE:
+        return {"state": _STATE_CACHE.get_state(version=RENTAFLOP_CONFIG["version"], \
+                                                algo=RENTAFLOP_CONFIG["crypto_config"].get("hash_algorithm"))}
+
     return {"state": get_state(RENTAFLOP_CONFIG["available_resources"], queue_status, quiet=True, \
                                version=RENTAFLOP_CONFIG["version"], algo=RENTAFLOP_CONFIG["crypto_config"].get("hash_algorithm"))}
 
@@ -439,6 +549,8 @@ def prep_daemon_shutdown(server):
     prepare daemon for shutdown without assuming system is restarting
     stops all mining jobs and terminates server
     """
+    if _INSTRUCTION_CHANNEL:
+        _INSTRUCTION_CHANNEL.stop()
     _stop_all()
     gpu_indexes = RENTAFLOP_CONFIG["available_resources"]["gpu_indexes"]
     gpu_indexes = [int(gpu) for gpu in gpu_indexes]
@@ -496,7 +608,20 @@ def before_request():
         return redirect(url, code=code)
 
 
+def _signal_finished(finished):
+    """
+    tell daemon to shut down, from either daemon or server process
+    """
+    _FINISHED_QUEUE.put(finished)
+
+
 def run_flask_server(q):
+    global _STATE_CACHE, _FINISHED_QUEUE
+    _FINISHED_QUEUE = q
+    # started here rather than at startup since the server runs in its own process
+    _STATE_CACHE = StateCache(RENTAFLOP_CONFIG["available_resources"], queue_status)
+    _STATE_CACHE.start()
+
     @app.route("/", methods=["POST"])
     def index():
         request_json = json.loads(request.files.get("json").read())
@@ -506,22 +631,7 @@ def run_flask_server(q):
         if render_file:
             params["render_file"] = render_file
         
-        func = CMD_TO_FUNC.get(cmd)
-        finished = False
-        if func:
-            try:
-                if cmd != "status":
-                    func_log = log_before_after(func, params)
-                    finished = func_log()
-                else:
-                    # avoid logging on status since this is called every 10 seconds by hive stats checker
-                    finished = func(params)
-            except Exception as e:
-                DAEMON_LOGGER.exception(f"Caught exception: {e}")
-                error = traceback.format_exc()
-                DAEMON_LOGGER.error(f"More info on exception: {error}")
-        if finished is True:
-            q.put(finished)
+        finished = _DISPATCHER.dispatch(cmd, params)
         # finished isn't True but it's not Falsey, so return it in response
         if (finished is not True) and finished:
             return jsonify(finished), 200
@@ -539,6 +649,7 @@ CMD_TO_FUNC = {
     "status": status,
     "benchmark": benchmark
 }
+_DISPATCHER = InstructionDispatcher(CMD_TO_FUNC, on_finished=_signal_finished, get_keys=_get_ordering_keys)
 TASK_QUEUE_CMD_TO_FUNC = {
     "push_task": push_task,
     "pop_task": pop_task,
@@ -550,9 +661,16 @@ TASK_QUEUE_CMD_TO_FUNC = {
 # "email": ..., "disable_crypto": ..., "pool_url": ..., "hash_algorithm": ..., "pass": ...}, "version": ...}
 RENTAFLOP_CONFIG = {"rentaflop_id": None, "sandbox_id": None, "available_resources": {}, \
                     "crypto_config": {}, "version": None}
+# snapshot of host state served by status, only set in server process
+_STATE_CACHE = None
+# daemon shuts down once True is put on this queue
+_FINISHED_QUEUE = None
+# long-poll channel for instructions, only set in daemon process
+_INSTRUCTION_CHANNEL = None
 
 
 def main():
+    global _FINISHED_QUEUE
     try:
         server = None
         _handle_startup()
@@ -563,13 +681,22 @@ def main():
         if not RENTAFLOP_CONFIG["crypto_config"]["disable_crypto"]:
             scheduler.add_job(id='Start Miners', func=_start_mining, trigger="interval", seconds=60, max_instances=1, next_run_time=first_run_time)
         scheduler.add_job(id='Rentaflop Checkin', func=_handle_checkin, trigger="interval", seconds=60, max_instances=1, next_run_time=first_run_time)
-        scheduler.add_job(id='Handle Finished Tasks', func=update_queue, trigger="interval", seconds=10, max_instances=1)
+        queue_params = {"gpu_indexes": RENTAFLOP_CONFIG["available_resources"]["gpu_indexes"]}
+        # tasks are started and cleaned up as soon as they're pushed or exit; periodic update is only a fallback and handles timeouts
+        start_queue_listener(queue_params, on_idle=None if RENTAFLOP_CONFIG["crypto_config"]["disable_crypto"] else _start_mining)
+        scheduler.add_job(id='Handle Finished Tasks', func=update_queue, trigger="interval", seconds=30, max_instances=1, args=[queue_params])
+        scheduler.add_job(id='Prefetch Blender', func=_prefetch_blender, trigger="interval", minutes=5, max_instances=1)
+        # created before scheduler starts since checkin instructions can shut daemon down too
+        q = multiprocessing.Queue()
+        _FINISHED_QUEUE = q
         scheduler.start()
         # run server, allowing it to shut itself down
-        q = multiprocessing.Queue()
         server = multiprocessing.Process(target=run_flask_server, args=(q,))
         DAEMON_LOGGER.debug("Starting server...")
         server.start()
+        # started after server forks so the fork can't copy a logging or connection pool lock held by the channel thread
+        # periodic checkin is kept as a fallback for when the channel is down
+        _start_instruction_channel()
         finished = q.get(block=True)
         if finished:
             DAEMON_LOGGER.info("Daemon shutting down for update...")
@@ -0,0 +1,192 @@
+"""
+packages task output into a tarball servers can extract with tar -xzf
+tarball is written as a series of independently compressed gzip members so chunks are compressed in parallel on all cores
+formats that are already compressed, like PNG and MP4, are stored without recompressing, and the compression level of everything
+else depends on how fast uploads have been so we don't spend longer compressing than the smaller upload saves
+each file is checksummed as it's read into the tarball, so verifying the tarball doesn't need a second pass over the output
+"""
+import os
+import json
+import time
+import gzip
+import hashlib
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import DAEMON_LOGGER
+
+
+class _ParallelGzipWriter:
+    """
+    file-like object that compresses written data in chunks on a thread pool and writes the gzip members to f in order
+    level may be changed between writes, in which case the pending chunk is flushed so it's compressed at the level it was written with
+    """
+    def __init__(self, f, level, n_workers=None):
+        self.f = f
+        self.level = level
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        self.pending = []
+        self.chunk = bytearray()
+        self.chunk_level = level
+        self.bytes_in = 0
+
+    def set_level(self, level):
+        if level != self.chunk_level:
+            self._flush_chunk()
+        self.level = level
+        self.chunk_level = level
+
+    def write(self, data):
+        self.chunk += data
+        self.bytes_in += len(data)
+        if len(self.chunk) >= CHUNK_SIZE:
+            self._flush_chunk()
+
+        return len(data)
+
+    def tell(self):
+        """
+        return number of uncompressed bytes written, which tarfile uses as its offset
+        """
+        return self.bytes_in
+
+    def _flush_chunk(self):
+        if not self.chunk:
+            return
+        # zlib releases the gil, so chunks really are compressed in parallel
+        self.pending.append(self.executor.submit(gzip.compress, bytes(self.chunk), self.chunk_level, mtime=0))
+        self.chunk = bytearray()
+        # bound memory use by writing out finished members once enough are queued
+        while len(self.pending) > 2 * self.n_workers:
+            self.f.write(self.pending.pop(0).result())
+
+    def close(self):
+        self._flush_chunk()
+        for future in self.pending:
+            self.f.write(future.result())
+        self.pending = []
+        self.executor.shutdown()
+
+
+class _HashingReader:
+    """
+    wraps file f, updating sha256 with everything read from it
+    """
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.f.read(size)
+        self.sha256.update(data)
+
+        return data
+
+
+def record_upload_throughput(n_bytes, seconds):
+    """
+    fold an upload's throughput into the moving average used to pick compression levels
+    """
+    if n_bytes < MIN_SAMPLE_BYTES or seconds <= 0:
+        return
+    throughput = n_bytes / seconds
+    with _THROUGHPUT_LOCK:
+        previous = get_upload_throughput()
+        if previous is not None:
+            throughput = THROUGHPUT_SMOOTHING * throughput + (1 - THROUGHPUT_SMOOTHING) * previous
+        # tasks run in their own processes, so estimate is kept on disk; replace is atomic so readers never see a partial file
+        tmp_path = f"{UPLOAD_THROUGHPUT_FILE}.{os.getpid()}.{threading.get_ident()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"bytes_per_second": throughput}, f)
+        os.replace(tmp_path, UPLOAD_THROUGHPUT_FILE)
+
+
+def get_upload_throughput():
+    """
+    return estimated upload throughput in bytes per second, None if nothing has been uploaded yet
+    """
+    try:
+        with open(UPLOAD_THROUGHPUT_FILE, "r") as f:
+            return json.load(f)["bytes_per_second"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def get_compression_level(upload_throughput=None):
+    """
+    return gzip level for compressible output; slower uplinks make higher levels worth their cpu time
+    """
+    upload_throughput = get_upload_throughput() if upload_throughput is None else upload_throughput
+    if upload_throughput is None:
+        return DEFAULT_COMPRESSION_LEVEL
+    for max_throughput, level in COMPRESSION_LEVELS:
+        if upload_throughput < max_throughput:
+            return level
+
+    return FASTEST_COMPRESSION_LEVEL
+
+
+def is_compressed(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS
+
+
+def package_output(task_dir, output_name="output", tgz_name="output.tar.gz", level=None):
+    """
+    write task_dir/output_name to task_dir/tgz_name with the same layout tar -czf would produce
+    level is gzip level for compressible files, chosen from upload throughput if None
+    return stats dict with packaging_time, compression_ratio (output bytes / tarball bytes), level, and manifest
+    manifest is like [{"filename": "0001.exr", "size": 123, "sha256": ...}] with filenames relative to output dir
+    """
+    manifest = []
+    start_time = time.time()
+    level = get_compression_level() if level is None else level
+    tgz_path = os.path.join(task_dir, tgz_name)
+    with open(tgz_path, "wb") as f:
+        writer = _ParallelGzipWriter(f, level)
+        try:
+            with tarfile.open(fileobj=writer, mode="w", format=tarfile.GNU_FORMAT) as tar:
+                output_path = os.path.join(task_dir, output_name)
+                for root, dirs, files in os.walk(output_path):
+                    dirs.sort()
+                    writer.set_level(level)
+                    tar.add(root, arcname=os.path.relpath(root, task_dir), recursive=False)
+                    for filename in sorted(files):
+                        path = os.path.join(root, filename)
+                        # stored members still need a gzip wrapper, but level 0 costs about as much as a copy
+                        writer.set_level(0 if is_compressed(path) else level)
+                        tarinfo = tar.gettarinfo(path, arcname=os.path.relpath(path, task_dir))
+                        if not tarinfo.isreg():
+                            tar.addfile(tarinfo)
+                            continue
+                        with open(path, "rb") as member_file:
+                            reader = _HashingReader(member_file)
+                            tar.addfile(tarinfo, reader)
+                        manifest.append({"filename": os.path.relpath(path, output_path), "size": tarinfo.size, \
+                                         "sha256": reader.sha256.hexdigest()})
+                writer.set_level(level)
+        finally:
+            writer.close()
+
+    packaging_time = round(time.time() - start_time, 2)
+    tgz_size = os.path.getsize(tgz_path)
+    compression_ratio = round(writer.bytes_in / tgz_size, 3) if tgz_size else None
+    DAEMON_LOGGER.debug(f"Packaged output at level {level} in {packaging_time}s with compression ratio {compression_ratio}")
+
+    return {"packaging_time": packaging_time, "compression_ratio": compression_ratio, "level": level, "manifest": manifest}
+
+
+# formats blender writes that are already compressed, so gzip only costs cpu
+COMPRESSED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".jp2", ".j2c", ".mp4", ".mkv", ".avi", ".mov", ".webm", ".ogv", ".ogg", \
+                         ".mpg", ".mpeg", ".dv", ".flv", ".gz", ".zip"}
+CHUNK_SIZE = 4 * 1024 * 1024
+# (uplink bytes per second below which level is used, level); levels ascend as uplinks get slower
+COMPRESSION_LEVELS = [(2 * 1024**2, 9), (10 * 1024**2, 6), (40 * 1024**2, 3)]
+FASTEST_COMPRESSION_LEVEL = 1
+DEFAULT_COMPRESSION_LEVEL = 6
+# uploads smaller than this are dominated by request overhead rather than bandwidth
+MIN_SAMPLE_BYTES = 1024 * 1024
+THROUGHPUT_SMOOTHING = 0.3
+UPLOAD_THROUGHPUT_FILE = os.path.join(tempfile.gettempdir(), "rentaflop_upload_throughput.json")
+_THROUGHPUT_LOCK = threading.Lock()
@@ -1,15 +1,19 @@
 """
 read config info from blend file
-write any settings overrides provided by user since upload
+apply any settings overrides provided by user since upload
 these are strictly settings that'd be set in the file itself and not provided in CLI command
+runs in the render invocation itself right after the scene loads, so overrides are applied in memory and never saved
 """
 import bpy
 import json
 import sys
+import time
 # get all args after "--", which allows us to ignore blender command args and only use args for this script
 argv = sys.argv
 argv = argv[argv.index("--") + 1:]
 
+# scripts run right after the scene finishes loading
+scene_loaded_at = time.time()
 print(f"Found render engine: {bpy.context.scene.render.engine}")
 
 task_dir = argv[0]
@@ -91,5 +95,5 @@ if engine == "CYCLES":
         if use_noise_threshold:
             bpy.context.scene.cycles.adaptive_threshold = float(noise_threshold)
 
-# ensure changes are persistent
-bpy.ops.wm.save_mainfile()
+# NOTE: run.py parses these lines from blender output; scene loaded line also marks end of preprocessing so frame times only include rendering
+print(f"Scene loaded at: {scene_loaded_at}", flush=True)
@@ -0,0 +1,174 @@
+"""
+persistent blender render workers, at most one per gpu
+a worker keeps a job's scene and its persistent render data loaded, so consecutive tasks from the same job skip blender startup,
+scene loading, and render device initialization
+workers are recycled when the scene they're asked to render changes and stopped once idle so crypto mining can use the gpu
+"""
+import os
+import json
+import time
+import socket
+import signal
+import shutil
+import subprocess
+import threading
+from config import DAEMON_LOGGER
+from blender_store import acquire_blender, release_blender
+
+
+class RenderWorker:
+    """
+    long-lived blender process running blender_worker.py in the task sandbox
+    """
+    def __init__(self, worker_dir, scene_id, blender_version, is_cpu, cuda_visible_devices):
+        self.worker_dir = worker_dir
+        self.scene_id = scene_id
+        self.blender_version = blender_version
+        self.is_cpu = is_cpu
+        self.cuda_visible_devices = cuda_visible_devices
+        self.socket_path = os.path.join(worker_dir, "worker.sock")
+        self.process = None
+        self.last_used = time.time()
+        self.is_busy = False
+
+    def matches(self, scene_id, blender_version, is_cpu):
+        """
+        return True iff worker can render scene without being recycled
+        """
+        return self.scene_id == scene_id and self.blender_version == blender_version and self.is_cpu == is_cpu
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        """
+        launch worker and wait for it to start listening for render requests
+        """
+        start_time = time.time()
+        blender_path = acquire_blender(self.blender_version)
+        os.makedirs(self.worker_dir, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        sandbox_options = f"firejail --noprofile --net=none --caps.drop=all --private={self.worker_dir} --read-only={blender_path} --blacklist=/"
+        cmd = f"DISPLAY=:0.0 {sandbox_options} {blender_path}/blender --enable-autoexec -noaudio -b --python {WORKER_SCRIPT_PATH} -- {self.socket_path}"
+        if not self.is_cpu:
+            cmd += " --cycles-device OPTIX"
+        if self.cuda_visible_devices:
+            # number devices the same way nvidia-smi and hive do rather than fastest first
+            cmd = f"CUDA_DEVICE_ORDER=PCI_BUS_ID CUDA_VISIBLE_DEVICES={self.cuda_visible_devices} {cmd}"
+        with open(os.path.join(self.worker_dir, "log.txt"), "w") as f:
+            # own process group so stopping the worker also stops firejail and blender
+            self.process = subprocess.Popen(cmd, shell=True, stdout=f, stderr=subprocess.STDOUT, start_new_session=True)
+        while not os.path.exists(self.socket_path):
+            if not self.is_alive() or time.time() - start_time > WORKER_START_TIMEOUT:
+                self.stop()
+                raise Exception(f"Render worker failed to start, see {self.worker_dir}/log.txt")
+            time.sleep(0.1)
+        self.last_used = time.time()
+        DAEMON_LOGGER.debug(f"Started render worker for GPU {self.cuda_visible_devices} in {time.time() - start_time:.2f}s")
+
+    def stop(self):
+        """
+        stop worker and release its blender installation
+        """
+        if self.process is None:
+            return
+        if self.is_alive():
+            try:
+                os.killpg(self.process.pid, signal.SIGTERM)
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+        self.process = None
+        release_blender(self.blender_version)
+        shutil.rmtree(self.worker_dir, ignore_errors=True)
+        DAEMON_LOGGER.debug(f"Stopped render worker for GPU {self.cuda_visible_devices}")
+
+    def render(self, request, get_scene_path, on_rendering=None):
+        """
+        send frame range render request to worker and block until it finishes
+        request contains task_dir, output_path, start_frame, end_frame, is_png, and log_path
+        get_scene_path is called iff the worker hasn't loaded the scene yet and returns path to decrypted scene file for it to load
+        on_rendering is called once scene is loaded and settings are applied, right before frames start rendering
+        raises subprocess.CalledProcessError on failure; worker is stopped since its scene may be left in a bad state
+        """
+        request = dict(request, scene_id=self.scene_id)
+        self.is_busy = True
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+                conn.connect(self.socket_path)
+                with conn.makefile("rw") as conn_file:
+                    conn_file.write(json.dumps(request) + "\n")
+                    conn_file.flush()
+                    for line in conn_file:
+                        event = json.loads(line)
+                        if event["event"] == "need_scene":
+                            conn_file.write(json.dumps({"render_path": get_scene_path()}) + "\n")
+                            conn_file.flush()
+                        elif event["event"] == "rendering" and on_rendering:
+                            on_rendering()
+                        elif event["event"] == "done":
+                            return
+                        elif event["event"] == "error":
+                            raise subprocess.CalledProcessError(cmd="render worker", returncode=1, output=event["message"])
+            raise subprocess.CalledProcessError(cmd="render worker", returncode=1, output="Render worker exited during render")
+        except (subprocess.CalledProcessError, OSError):
+            self.stop()
+            raise
+        finally:
+            self.is_busy = False
+            self.last_used = time.time()
+
+
+def get_worker(base_dir, scene_id, blender_version, is_cpu, cuda_visible_devices):
+    """
+    return running worker for gpu with scene_id, recycling the gpu's current worker if it has a different scene
+    base_dir is directory worker files are kept in
+    worker is marked busy so it isn't stopped as idle before the caller's render request
+    """
+    gpu = cuda_visible_devices or "all"
+    with _WORKERS_LOCK:
+        worker = _WORKERS.get(gpu)
+        if worker and worker.is_alive() and worker.matches(scene_id, blender_version, is_cpu):
+            worker.is_busy = True
+
+            return worker
+        if worker:
+            DAEMON_LOGGER.debug(f"Recycling render worker for GPU {gpu}...")
+            worker.stop()
+            del _WORKERS[gpu]
+        worker = RenderWorker(os.path.join(base_dir, f"worker_{gpu}"), scene_id, blender_version, is_cpu, cuda_visible_devices)
+        worker.start()
+        worker.is_busy = True
+        _WORKERS[gpu] = worker
+
+    return worker
+
+
+def stop_idle_workers(idle_timeout=None):
+    """
+    stop workers that haven't rendered anything for idle_timeout seconds, all workers if idle_timeout is 0
+    """
+    idle_timeout = WORKER_IDLE_TIMEOUT if idle_timeout is None else idle_timeout
+    # don't wait on a worker that's in the middle of starting
+    if not _WORKERS_LOCK.acquire(blocking=False):
+        return
+    try:
+        for gpu in list(_WORKERS):
+            worker = _WORKERS[gpu]
+            if not worker.is_busy and time.time() - worker.last_used >= idle_timeout:
+                worker.stop()
+                del _WORKERS[gpu]
+    finally:
+        _WORKERS_LOCK.release()
+
+
+WORKER_SCRIPT_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "blender_worker.py")
+WORKER_START_TIMEOUT = 120
+# short enough that an idle gpu is freed before the crypto miner is restarted on it
+WORKER_IDLE_TIMEOUT = 30
+_WORKERS = {}
+_WORKERS_LOCK = threading.Lock()
@@ -6,6 +6,7 @@ if no GPU, instruct user to drive to micro center
 import re
 from config import DAEMON_LOGGER
 from utils import run_shell_cmd, SUPPORTED_GPUS
+from gpu_telemetry import get_gpus, get_gpu
 
 
 daemon_log_func = {"DEBUG": DAEMON_LOGGER.debug, "INFO": DAEMON_LOGGER.info, "WARNING": DAEMON_LOGGER.warning,
@@ -70,13 +71,9 @@ def _check_pcie(gpu):
     ensure gpu pcie resources pass minimum benchmark
     return generation and width
     """
-    command_output = run_shell_cmd(f"nvidia-smi -i {gpu} --query-gpu=pcie.link.gen.current,pcie.link.width.current --format=csv",
-                                   format_output=False, quiet=True).splitlines()
-    pci_generation, pci_width = command_output[1].split(", ")
-    pci_generation = int(pci_generation)
-    pci_width = int(pci_width)
+    gpu_info = get_gpu(gpu) or {}
 
-    return pci_generation, pci_width
+    return gpu_info.get("pcie_gen"), gpu_info.get("pcie_width")
 
 
 def check_gpu_resources(include_stdout=False):
@@ -84,13 +81,10 @@ def check_gpu_resources(include_stdout=False):
     ensure gpu resources are present and minimum PCIe requirements are met
     benchmarking does not happen here, this is just a quick check for expected GPUs and PCIe
     """
-    gpu_info = run_shell_cmd("nvidia-smi --query-gpu=index,gpu_name --format=csv", format_output=False, quiet=True).splitlines()
-    if len(gpu_info) > 1:
-        gpu_info = gpu_info[1:]
     gpus = []
     names = []
-    for line in gpu_info:
-        gpu_idx, gpu_name = line.split(", ")
+    for gpu_info in get_gpus():
+        gpu_idx, gpu_name = gpu_info["index"], gpu_info["name"]
         if gpu_name in SUPPORTED_GPUS:
             gpus.append(int(gpu_idx))
             names.append(gpu_name)
@@ -2,97 +2,153 @@
 runs render task
 usage:
     # task_dir is directory containing render file for task
-    python3 run.py task_dir main_file_path start_frame end_frame uuid_str blender_version is_cpu cuda_visible_devices
+    python3 run.py task_dir main_file_path start_frame end_frame uuid_str blender_version is_cpu cuda_visible_devices job_id
 """
 import sys
 import os
-import requests
+import http_client
 import json
 from config import DAEMON_LOGGER
 import subprocess
 from utils import run_shell_cmd, calculate_frame_times, post_to_rentaflop, get_rentaflop_id
-import glob
 import traceback
+import time
+from encryption import decrypt_file
+from blender_store import acquire_blender, release_blender
+from render_worker import get_worker
+from task_state import set_task_status
+from uploader import FrameUploader
+from output_packaging import package_output
+from upload_client import upload_file, get_resumable_upload_id
+import hashlib
 
 
-def check_blender(target_version):
+def _get_scene_id(job_id, uuid_str, task_dir):
     """
-    check for blender target_version installation and install if not found
-    does nothing if target_version installed
-    maintains a LRU cache of downloaded blender versions
+    return id of the scene state a task renders; tasks with the same id can share a warm render worker
     """
-    file_path = f"blender-{target_version}.tar.xz"
-    if os.path.exists(file_path):
-        # update last modified time to now
-        os.utime(file_path)
-        
-        return
-
-    DAEMON_LOGGER.debug(f"Installing blender version {target_version}...")
-    short_version = target_version.rpartition(".")[0]
-    # go to https://download.blender.org/release/ to check blender version updates
-    run_shell_cmd(f"wget https://download.blender.org/release/Blender{short_version}/blender-{target_version}-linux-x64.tar.xz -O blender.tar.xz && mv blender.tar.xz blender-{target_version}.tar.xz")
-
-    # update cache, if necessary
-    cache_size = 5
-    list_of_files = glob.glob("blender-*.tar.xz")
-    if len(list_of_files) <= cache_size:
-        return
-
-    # cache too large, need to remove LRU version
-    file_modification_times = [os.path.getmtime(f) for f in list_of_files]
-    least_to_most_recent = [f for _, f in sorted(zip(file_modification_times, list_of_files), key=lambda pair: pair[0])]
-    lru_version = least_to_most_recent[0]
-    run_shell_cmd(f"rm -rf {lru_version}")
-
-
-def run_task(is_png=False):
+    with open(os.path.join(task_dir, "render_settings.json"), "rb") as f:
+        settings_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+
+    return f"{job_id}-{uuid_str}-{settings_hash}"
+
+
+def _upload_tarball(task_dir, server_url, data):
+    """
+    zip output dir and upload it as a single tarball, for servers that don't support per-frame uploads
+    data identifies task to servers
+    return packaging and upload stats
+    """
+    tgz_path = os.path.join(task_dir, "output.tar.gz")
+    # already-compressed frames are stored as-is and everything else is compressed on all cores
+    # frames are checksummed while they're packaged, and servers verify the tarball against the manifest instead of us re-reading it
+    packaging_stats = package_output(task_dir)
+
+    # first request to get upload location, which is safe to repeat; an earlier run's unfinished upload is resumed if servers allow
+    upload_id = get_resumable_upload_id(tgz_path)
+    if upload_id:
+        data = dict(data, upload_id=upload_id)
+    response = http_client.post(server_url, json=data, is_idempotent=True)
+    # streamed from disk, so tarball size isn't limited by memory; uploads in parts resume from the last acknowledged part on retry
+    upload_stats = upload_file(response.json(), tgz_path)
+
+    return dict(packaging_stats, **upload_stats)
+
+
+def run_task(args, is_png=False, use_worker=False):
     """
     run rendering task
+    args are the command line args described above
+    if use_worker, frames are rendered by this gpu's persistent render worker instead of a new blender process
     """
-    task_dir = sys.argv[1]
-    render_path = sys.argv[2]
-    start_frame = int(sys.argv[3])
-    end_frame = int(sys.argv[4])
-    uuid_str = sys.argv[5]
-    blender_version = sys.argv[6]
-    is_cpu = sys.argv[7].lower() == "true"
-    cuda_visible_devices = sys.argv[8]
+    task_dir = args[0]
+    render_path = args[1]
+    start_frame = int(args[2])
+    end_frame = int(args[3])
+    uuid_str = args[4]
+    blender_version = args[5]
+    is_cpu = args[6].lower() == "true"
+    cuda_visible_devices = args[7]
     if cuda_visible_devices.lower() == "none":
         cuda_visible_devices = None
+    job_id = args[8] if len(args) > 8 and args[8].lower() != "none" else None
+    task_id = int(os.path.basename(task_dir))
     output_path = os.path.join(task_dir, "output/")
-    blender_path = os.path.join(task_dir, "blender/")
     os.makedirs(output_path, exist_ok=True)
-    os.makedirs(blender_path, exist_ok=True)
-    run_shell_cmd(f"touch {task_dir}/started.txt", quiet=True)
-    check_blender(blender_version)
-    run_shell_cmd(f"tar -xf blender-{blender_version}.tar.xz -C {blender_path} --strip-components 1", quiet=True)
     render_name, render_extension = os.path.splitext(render_path)
     render_path2 = render_name + "2" + render_extension
-    de_script = f""" "import os; os.system('''gpg --passphrase {uuid_str} --batch --no-tty -d '{render_path}' > '{render_path2}' ''')" """
-    # reformats videos to PNG
-    # fmt_script = f'''"import bpy; file_format = bpy.context.scene.render.image_settings.file_format; bpy.context.scene.render.image_settings.file_format = 'PNG' if file_format in ['FFMPEG', 'AVI_RAW', 'AVI_JPEG'] else file_format"'''
-    rm_script = f'''"import os; os.remove('{render_path2}')"'''
-    # NOTE: cannot pass additional args to blender after " -- " because the -- tells blender to ignore all subsequent args
-    render_config = subprocess.check_output(f"{blender_path}/blender --python-expr {de_script} --disable-autoexec -noaudio -b '{render_path2}' --python render_config.py -- {task_dir}", shell=True, encoding="utf8", stderr=subprocess.STDOUT)
-    eevee_name = "BLENDER_EEVEE"
-    eevee_next_name = "BLENDER_EEVEE_NEXT"
-    is_eevee = (f"Found render engine: {eevee_name}" in render_config) or (f"Found render engine: {eevee_next_name}" in render_config)
-
-    run_shell_cmd(f"touch {task_dir}/started_render.txt", quiet=True)
-    sandbox_options = f"firejail --noprofile --net=none --caps.drop=all --private={task_dir} --blacklist=/"
-    # render results for specified frames to output path; enables scripting; if eevee is specified in blend file then it'll use eevee, even though cycles is specified here
-    cmd = f"DISPLAY=:0.0 {sandbox_options} {blender_path}/blender --enable-autoexec -noaudio -b '{render_path2}' --python-expr {rm_script} -o {output_path} -s {start_frame} -e {end_frame}{' -F PNG' if is_png else ''} -a --"
-    # most of the time we run on GPU with OPTIX, but sometimes we run on cpu if not enough VRAM or other GPU issue
-    if not is_cpu:
-        cmd += " --cycles-device OPTIX"
-    if cuda_visible_devices:
-        cmd = f"CUDA_VISIBLE_DEVICES={cuda_visible_devices} {cmd}"
     # send output to log file
     log_path = os.path.join(task_dir, "log.txt")
+    worker = None
+    if use_worker and job_id is not None:
+        try:
+            worker = get_worker(os.path.dirname(task_dir), _get_scene_id(job_id, uuid_str, task_dir), blender_version, is_cpu, cuda_visible_devices)
+        except Exception as e:
+            DAEMON_LOGGER.error(f"Failed to get render worker, rendering with a new blender process instead: {e}")
+
+    launch_time = time.time()
+
+    def decrypt_render_file():
+        nonlocal launch_time
+        # decrypt in a single pass straight into the file blender opens; task dir is in the tmpfs-backed temp dir on hive
+        decrypt_start_time = time.time()
+        decrypt_file(uuid_str, render_path, render_path2)
+        DAEMON_LOGGER.debug(f"Decrypted render file in {time.time() - decrypt_start_time:.2f}s")
+        # scene load time shouldn't include decryption
+        launch_time = time.time()
+
+        return render_path2
+
+    render_start_time = None
+
+    def start_rendering(timestamp):
+        nonlocal render_start_time
+        render_start_time = timestamp
+        set_task_status(task_id, "rendering", timestamp)
+
+    # frames are uploaded as blender saves them rather than all at once after the render
+    uploader = FrameUploader(task_id, output_path)
+    uploader.start(log_path)
+    cmd = "render worker"
     try:
-        with open(log_path, "w") as f:
-            subprocess.run(cmd, shell=True, encoding="utf8", check=True, stderr=subprocess.STDOUT, stdout=f)
+        if worker:
+            request = {"task_dir": task_dir, "output_path": output_path, "start_frame": start_frame, "end_frame": end_frame, \
+                       "is_png": is_png, "log_path": log_path}
+            # scene is only decrypted if worker doesn't already have it loaded from an earlier task
+            worker.render(request, decrypt_render_file, on_rendering=lambda: start_rendering(time.time()))
+        else:
+            # shared read-only installation that's extracted once per version rather than once per task
+            blender_path = acquire_blender(blender_version)
+            try:
+                decrypt_render_file()
+                # reformats videos to PNG
+                # fmt_script = f'''"import bpy; file_format = bpy.context.scene.render.image_settings.file_format; bpy.context.scene.render.image_settings.file_format = 'PNG' if file_format in ['FFMPEG', 'AVI_RAW', 'AVI_JPEG'] else file_format"'''
+                rm_script = f'''"import os; os.remove('{render_path2}')"'''
+                sandbox_options = f"firejail --noprofile --net=none --caps.drop=all --private={task_dir} --read-only={blender_path} --blacklist=/"
+                # render results for specified frames to output path; enables scripting; if eevee is specified in blend file then it'll use eevee, even though cycles is specified here
+                # render_config.py runs right after the scene loads to apply settings overrides in memory, so the scene is only loaded once and never re-saved
+                # NOTE: cannot pass additional args to blender after " -- " because the -- tells blender to ignore all subsequent args
+                cmd = f"DISPLAY=:0.0 {sandbox_options} {blender_path}/blender --enable-autoexec -noaudio -b '{render_path2}' --python-expr {rm_script} " \
+                    f"--python {RENDER_CONFIG_PATH} -o {output_path} -s {start_frame} -e {end_frame}{' -F PNG' if is_png else ''} -a -- {task_dir}"
+                # most of the time we run on GPU with OPTIX, but sometimes we run on cpu if not enough VRAM or other GPU issue
+                if not is_cpu:
+                    cmd += " --cycles-device OPTIX"
+                if cuda_visible_devices:
+                    # number devices the same way nvidia-smi and hive do rather than fastest first
+                    cmd = f"CUDA_DEVICE_ORDER=PCI_BUS_ID CUDA_VISIBLE_DEVICES={cuda_visible_devices} {cmd}"
+                with open(log_path, "w") as f:
+                    process = subprocess.Popen(cmd, shell=True, encoding="utf8", stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+                    # tee output to log file, watching for render_config.py's line marking the end of preprocessing
+                    for line in process.stdout:
+                        f.write(line)
+                        f.flush()
+                        if line.startswith("Scene loaded at:"):
+                            start_rendering(float(line.split(":")[1]))
+                    return_code = process.wait()
+                if return_code:
+                    raise subprocess.CalledProcessError(cmd=cmd, returncode=return_code)
+            finally:
+                release_blender(blender_version)
 
         # checking log tail because sometimes Blender throws an error and exits quietly without subprocess error
         log_tail = run_shell_cmd(f"tail {log_path}", very_quiet=True, format_output=False)
@@ -100,36 +156,48 @@ def run_task(is_png=False):
                          "Error: height not divisible by 2" in log_tail):
             raise subprocess.CalledProcessError(cmd=cmd, returncode=1, output=log_tail)
     except subprocess.CalledProcessError as e:
+        uploader.cancel()
         log_tail = run_shell_cmd(f"tail {log_path}", very_quiet=True, format_output=False)
         # manually setting output to log file tail since everything is output to log file
         raise subprocess.CalledProcessError(cmd=e.cmd, returncode=e.returncode, output=log_tail)
+    except:
+        uploader.cancel()
+        raise
     
-    # successful render if no CalledProcessError, so send result to servers
-    first_frame_time, subsequent_frames_avg = calculate_frame_times(task_dir, start_frame)
-    tgz_path = os.path.join(task_dir, "output.tar.gz")
-    output = os.path.join(task_dir, "output")
-    old_dir = os.getcwd()
-    os.chdir(task_dir)
-    # zip and send output dir
-    run_shell_cmd(f"tar -czf output.tar.gz output", quiet=True)
-    # check to ensure we're sending a correctly-zipped output to rentaflop servers
-    incorrect_tar_output = run_shell_cmd("tar --compare --file=output.tar.gz", quiet=True)
-    os.chdir(old_dir)
-    if incorrect_tar_output:
-        raise Exception("Output tarball doesn't match output frames!")
+    # render engine and scene load timing are printed by render_config.py
+    render_config = run_shell_cmd(f"grep -m 2 -e 'Found render engine:' -e 'Scene loaded at:' {log_path}", very_quiet=True, format_output=False) or ""
+    eevee_name = "BLENDER_EEVEE"
+    eevee_next_name = "BLENDER_EEVEE_NEXT"
+    is_eevee = (f"Found render engine: {eevee_name}" in render_config) or (f"Found render engine: {eevee_next_name}" in render_config)
+    scene_load_time = None
+    for line in render_config.splitlines():
+        if line.startswith("Scene loaded at:"):
+            scene_load_time = round(float(line.split(":")[1]) - launch_time, 2)
+            DAEMON_LOGGER.debug(f"Scene load took {scene_load_time}s")
 
+    # successful render if no CalledProcessError, so send result to servers
+    set_task_status(task_id, "packaging")
+    first_frame_time, subsequent_frames_avg = calculate_frame_times(task_dir, start_frame, render_start_time)
+    set_task_status(task_id, "uploading")
+    # most frames were uploaded during the render, so this only waits on the last few
+    manifest = uploader.finish()
     sandbox_id = os.getenv("SANDBOX_ID")
     server_url = "https://api.rentaflop.com/host/output"
-    task_id = os.path.basename(task_dir)
-    # first request to get upload location
     data = {"task_id": str(task_id), "sandbox_id": str(sandbox_id)}
-    response = requests.post(server_url, json=data)
-    response_json = response.json()
-    storage_url, fields = response_json["url"], response_json["fields"]
-    # upload output to upload location
-    # using curl instead of python requests because large files get overflowError: string longer than 2147483647 bytes
-    fields_flags = " ".join([f"-F {k}={fields[k]}" for k in fields])
-    run_shell_cmd(f"curl -X POST {fields_flags} -F file=@{tgz_path} {storage_url}", quiet=True)
+    if manifest is None:
+        upload_stats = _upload_tarball(task_dir, server_url, data)
+        data["packaging_time"] = upload_stats["packaging_time"]
+        data["compression_ratio"] = upload_stats["compression_ratio"]
+        data["bytes_per_second"] = upload_stats["bytes_per_second"]
+        if "parts" in upload_stats:
+            # servers complete uploads in parts with each part's etag
+            data["upload_id"] = upload_stats["upload_id"]
+            data["parts"] = upload_stats["parts"]
+        manifest = upload_stats["manifest"]
+    else:
+        data["bytes_per_second"] = uploader.get_bytes_per_second()
+    # lets servers check every frame arrived intact without listing storage
+    data["manifest"] = manifest
 
     # confirm upload
     data["confirm"] = True
@@ -137,17 +205,28 @@ def run_task(is_png=False):
     data["subsequent_frames_avg"] = subsequent_frames_avg
     if is_eevee:
         data["is_eevee"] = True
-    requests.post(server_url, json=data)
+    if scene_load_time is not None:
+        data["scene_load_time"] = scene_load_time
+    http_client.post(server_url, json=data)
 
 
-def main():
-    task_dir = sys.argv[1]
+RENDER_CONFIG_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "render_config.py")
+
+
+def main(args=None, use_worker=False):
+    """
+    run task described by args, which default to the command line args
+    """
+    args = sys.argv[1:] if args is None else args
+    task_dir = args[0]
     task_id = os.path.basename(task_dir)
     try_with_png = False
+    is_done = False
     max_tries = 2
     for i in range(max_tries):
         try:
-            run_task(is_png=try_with_png)
+            run_task(args, is_png=try_with_png, use_worker=use_worker)
+            is_done = True
         except subprocess.CalledProcessError as e:
             DAEMON_LOGGER.error(f"Task execution command failed: {e}")
             DAEMON_LOGGER.error(f"Task execution command output: {e.output}")
@@ -173,11 +252,11 @@ def main():
             error = traceback.format_exc()
             DAEMON_LOGGER.error(f"Exception during task execution: {error}")
 
-        if not try_with_png:
+        if is_done or not try_with_png:
             break
 
     # lets the task queue know when the run is finished
-    run_shell_cmd(f"touch {task_dir}/finished.txt", quiet=True)
+    set_task_status(task_id, "done" if is_done else "failed")
 
 
 if __name__=="__main__":
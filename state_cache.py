@@ -0,0 +1,100 @@
+"""
+keeps a snapshot of host state that's refreshed in the background so status polls are answered from memory
+each part of the state is refreshed on its own interval, since crypto stats need several processes to read while task queue
+status is a database query
+"""
+import time
+import threading
+from config import DAEMON_LOGGER
+from utils import get_crypto_state, is_queue_ready, build_state
+
+
+class StateCache:
+    """
+    background-refreshed parts of get_state
+    """
+    def __init__(self, available_resources, queue_status, intervals=None):
+        self.available_resources = available_resources
+        intervals = dict(REFRESH_INTERVALS, **(intervals or {}))
+        # name -> (function returning part, seconds between refreshes)
+        self.parts = {
+            "crypto": (get_crypto_state, intervals["crypto"]),
+            "queue": (lambda: queue_status({}) if is_queue_ready() else {}, intervals["queue"]),
+        }
+        self.values = {}
+        self.updated_at = {}
+        self.avg_latency = None
+        self.max_latency = 0
+        self._lock = threading.Lock()
+        self._refresh_events = {name: threading.Event() for name in self.parts}
+        self._wake = threading.Event()
+        self._thread = None
+
+    def refresh(self, name):
+        """
+        refresh part now, keeping its previous value if refresh fails
+        """
+        func, _ = self.parts[name]
+        try:
+            value = func()
+        except Exception as e:
+            DAEMON_LOGGER.exception(f"Failed to refresh {name} state: {e}")
+            return
+        with self._lock:
+            self.values[name] = value
+            self.updated_at[name] = time.time()
+
+    def request_refresh(self, name):
+        """
+        have background thread refresh part as soon as possible, such as after the task queue changes
+        """
+        self._refresh_events[name].set()
+        self._wake.set()
+
+    def _run(self):
+        next_refresh = {name: 0 for name in self.parts}
+        while True:
+            now = time.time()
+            for name, (_, interval) in self.parts.items():
+                if now >= next_refresh[name] or self._refresh_events[name].is_set():
+                    self._refresh_events[name].clear()
+                    self.refresh(name)
+                    next_refresh[name] = time.time() + interval
+            self._wake.wait(max(min(next_refresh.values()) - time.time(), 0))
+            self._wake.clear()
+
+    def start(self):
+        """
+        start refreshing in the background; must be called in the process that serves status
+        """
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get_state(self, gpu_only=False, version=None, algo=None):
+        """
+        return state like utils.get_state from latest snapshot, plus "snapshot" with its age and status latency in seconds
+        parts that haven't been read yet are read now
+        """
+        start_time = time.time()
+        for name in self.parts:
+            if name not in self.values:
+                self.refresh(name)
+        with self._lock:
+            values = dict(self.values)
+            oldest_update = min(self.updated_at.values()) if self.updated_at else start_time
+        state = build_state(self.available_resources, values.get("crypto", (False, 0, {})), values.get("queue", {}), gpu_only=gpu_only, \
+                            version=version, algo=algo)
+        latency = time.time() - start_time
+        with self._lock:
+            self.avg_latency = latency if self.avg_latency is None else LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.avg_latency
+            self.max_latency = max(self.max_latency, latency)
+            avg_latency, max_latency = self.avg_latency, self.max_latency
+        if not gpu_only:
+            state["snapshot"] = {"age": round(start_time - oldest_update, 2), "avg_latency": round(avg_latency, 4), \
+                                 "max_latency": round(max_latency, 4)}
+
+        return state
+
+
+REFRESH_INTERVALS = {"crypto": 10, "queue": 5}
+LATENCY_SMOOTHING = 0.1
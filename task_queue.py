@@ -1,17 +1,26 @@
 """
 manages queue for compute tasks
 """
-from config import DAEMON_LOGGER, app, db, Task
-from utils import run_shell_cmd, calculate_frame_times, get_last_frame_completed
+from config import DAEMON_LOGGER, app, db, Task, RENDER_WORKER_MODE
+from utils import run_shell_cmd, calculate_frame_times
+from log_tailer import get_log_progress, remove_tailer
+from frame_index import remove_frame_index
+from input_cache import link_previous_job_entry, add_entry, get_input_cache_stats
+from encryption import EncryptedFileReader
+from archive import extract_archive, list_members
+from render_worker import stop_idle_workers
+from task_state import set_task_status, get_task_status, get_phase_durations, RUNNING_STATES, FINISHED_STATES
+import run
 import os
 import datetime as dt
-import requests
+import time
+import http_client
 import tempfile
-import uuid
-import io
-import zipfile
-import pymysql
 import json
+import functools
+import threading
+import subprocess
+import socket
 
 
 def push_task(params):
@@ -19,18 +28,25 @@ def push_task(params):
     add a task to the queue; could be benchmark or render
     """
     task_id = params.get("task_id")
-    render_file = params.get("render_file")
+    # path to render file already streamed to disk in task directory; None if input is in cache
+    render_path = params.get("render_path")
+    cache_key = params.get("cache_key")
+    # main_file and uuid_str of cached input already linked into task directory; None if render file was downloaded
+    cached_input = params.get("cached_input")
+    job_id = params.get("job_id")
+    job_id = int(job_id) if job_id is not None else None
+    download_time = params.get("download_time", 0.0)
+    # key render file was encrypted with during download
+    uuid_str = params.get("uuid_str")
     # user-edited settings overrides for start and end frame are provided here by backend; render_settings values are not necessarily correct for this task
     start_frame = params.get("start_frame")
     end_frame = params.get("end_frame")
     blender_version = params.get("blender_version")
     is_cpu = params.get("is_cpu")
-    is_cpu = 1 if is_cpu else 0
-    cuda_visible_devices = params.get("cuda_visible_devices")
-    cuda_visible_devices = "NULL" if not cuda_visible_devices else f'"{cuda_visible_devices}"'
+    cuda_visible_devices = params.get("cuda_visible_devices") or None
     is_zip = params.get("is_zip")
     render_settings = params.get("render_settings", {})
-    is_render = render_file is not None
+    is_render = render_path is not None or cache_key is not None
     DAEMON_LOGGER.debug(f"Pushing task {task_id}...")
     # prevent duplicate tasks from being created in case of network delays or failures
     with app.app_context():
@@ -39,66 +55,71 @@ def push_task(params):
         DAEMON_LOGGER.info(f"Task {task_id} already in queue! Exiting...")
         return
     
-    # create directory for task and write render file there
+    # create directory for task if render file wasn't already downloaded there
     task_dir = os.path.join(FILE_DIR, str(task_id))
-    os.makedirs(task_dir)
+    os.makedirs(task_dir, exist_ok=True)
     # create task straight away to add it to queue so we don't restart crypto miner if we have to take a few minutes to process a large render file
     with app.app_context():
-        task = Task(task_dir=task_dir, task_id=task_id)
+        task = Task(task_dir=task_dir, task_id=task_id, status="queued", queued_at=time.time())
         db.session.add(task)
         db.session.commit()
+    task_id = int(task_id)
     if is_render:
-        with open(f"{task_dir}/render_settings.json", "w") as f:
-            json.dump(render_settings, f)
-        
-        if is_zip:
-            # NOTE: partially duplicated in job_queue.py and scan.py
-            with io.BytesIO(render_file) as archive:
-                archive.seek(0)
-                with zipfile.ZipFile(archive, mode='r') as zipf:
-                    main_subfile = ""
-                    for subfile in zipf.namelist():
-                        # parse zip file and look for the main animation file to identify which software is used
-                        # guaranteed to exist since rentaflop servers already found it
-                        sub_extension = os.path.splitext(subfile)[1]
-                        if sub_extension in [".blend", ".blend1"]:
-                            main_subfile = subfile
-                            break
-                    
-                    zipf.extractall(task_dir)
-
-            render_path = os.path.join(task_dir, main_subfile)            
-        else:
-            render_path = os.path.join(task_dir, "render_file.blend")
-            with open(render_path, "wb") as f:
-                f.write(render_file)
+        set_task_status(task_id, "ingesting")
+        try:
+            with open(f"{task_dir}/render_settings.json", "w") as f:
+                json.dump(render_settings, f)
             
-        uuid_str = uuid.uuid4().hex
-        os.system(f"gpg --passphrase {uuid_str} --batch --no-tty -c '{render_path}' && mv '{render_path}.gpg' '{render_path}'")
-        task_id = int(task_id)
-        sql1 = f'UPDATE task SET main_file_path="{render_path}" WHERE task_id={task_id}'
-        sql2 = f'UPDATE task SET start_frame={start_frame} WHERE task_id={task_id}'
-        sql3 = f'UPDATE task SET end_frame={end_frame} WHERE task_id={task_id}'
-        sql4 = f'UPDATE task SET uuid_str="{uuid_str}" WHERE task_id={task_id}'
-        sql5 = f'UPDATE task SET blender_version="{blender_version}" WHERE task_id={task_id}'
-        sql6 = f'UPDATE task SET is_cpu={is_cpu} WHERE task_id={task_id}'
-        sql7 = f'UPDATE task SET cuda_visible_devices={cuda_visible_devices} WHERE task_id={task_id}'
-        # updating task with pymysql instead of flask sqlalchemy because the initial commit in this function is causing the connection to sometimes close,
-        # and trying to use it again here fails intermittently
-        connection = pymysql.connect(host="localhost", user="root", password="daemon", database="daemon")
-        with connection:
-            with connection.cursor() as cursor:
-                cursor.execute(sql1)
-                cursor.execute(sql2)
-                cursor.execute(sql3)
-                cursor.execute(sql4)
-                cursor.execute(sql5)
-                cursor.execute(sql6)
-                cursor.execute(sql7)
-            
-            connection.commit()
+            if cached_input:
+                # input already extracted and encrypted by an earlier task from the same job
+                render_path = os.path.join(task_dir, cached_input["main_file"])
+                uuid_str = cached_input["uuid_str"]
+            else:
+                ingest_start_time = time.time()
+                if is_zip:
+                    # zip is read from disk and decrypted one frame at a time so archive is never fully loaded into memory
+                    open_archive = functools.partial(EncryptedFileReader, uuid_str, render_path)
+                    # members unchanged since a previous upload for this job are hardlinked from cache and skipped during extraction
+                    link_previous_job_entry(job_id, task_dir, list_members(open_archive, task_dir))
+                    main_path, _ = extract_archive(open_archive, task_dir, key=uuid_str)
+                    # archive no longer needed after extraction
+                    os.remove(render_path)
+                    render_path = main_path
+
+                ingest_time = download_time + time.time() - ingest_start_time
+                DAEMON_LOGGER.debug(f"Prepared task {task_id} input in {time.time() - ingest_start_time:.2f}s")
+                if cache_key:
+                    add_entry(cache_key, task_dir, os.path.relpath(render_path, task_dir), uuid_str, ingest_time, exclude=["render_settings.json"])
+        except:
+            # failed task is cleaned up by next queue update
+            set_task_status(task_id, "failed")
+            _notify_queue("failed")
+            raise
+
+        with app.app_context():
+            Task.query.filter_by(task_id=task_id).update({"main_file_path": render_path, "start_frame": start_frame, "end_frame": end_frame, \
+                                                          "uuid_str": uuid_str, "blender_version": blender_version, "is_cpu": bool(is_cpu), \
+                                                          "cuda_visible_devices": cuda_visible_devices, "job_id": job_id})
+            db.session.commit()
+    set_task_status(task_id, "ready")
     
     DAEMON_LOGGER.debug(f"Added task {task_id}")
+    # task is ready, so start it now if a gpu is free instead of waiting for next update
+    _notify_queue("pushed")
+
+
+def create_task_dir(task_id):
+    """
+    create directory for task files so render file can be downloaded straight into it
+    return task_dir, or None if directory already exists because task was already pushed
+    """
+    task_dir = os.path.join(FILE_DIR, str(task_id))
+    try:
+        os.makedirs(task_dir)
+    except FileExistsError:
+        return None
+
+    return task_dir
 
 
 def _delete_task_with_id(task_id):
@@ -118,40 +139,94 @@ def _delete_task_with_id(task_id):
     return task_dir
 
 
+def _get_task_slots(task, gpu_indexes=None):
+    """
+    return set of slots a task occupies while running; slots are gpu indexes, "cpu" for cpu renders,
+    or "all" if task may use every gpu
+    """
+    if task.is_cpu:
+        return {"cpu"}
+    if task.cuda_visible_devices:
+        return set(task.cuda_visible_devices.split(","))
+    # task wasn't assigned gpus so it uses all of them
+    return set(gpu_indexes) | {"all"} if gpu_indexes else {"all"}
+
+
 def pop_task(params):
     """
     remove task from queue
     does nothing if already removed from queue
     """
-    task_id = params["task_id"]
+    task_id = int(params["task_id"])
     DAEMON_LOGGER.debug(f"Popping task {task_id}...")
     with app.app_context():
-        task_running = Task.query.first()
-    is_currently_running = True if task_running and task_running.id == task_id else False
+        task = Task.query.filter_by(task_id=task_id).first()
+    is_currently_running = bool(task) and task.status in RUNNING_STATES
     task_dir = _delete_task_with_id(task_id)
-    # kill task if running and clean up files
+    # kill task if running and clean up files; other tasks running on other gpus are left alone
     if is_currently_running:
-        run_shell_cmd(f'pkill -f "task_{task_id}"', very_quiet=True)
-        run_shell_cmd('pkill -f octane', very_quiet=True)
-        run_shell_cmd('pkill -f blender', very_quiet=True)
-    run_shell_cmd(f"rm -rf {task_dir}", very_quiet=True)
+        if task_id == -1:
+            run_shell_cmd('pkill -f octane', very_quiet=True)
+        else:
+            # run.py and the sandboxed blender process both have paths within task dir in their args
+            run_shell_cmd(f'pkill -f "{task_dir}/"', very_quiet=True)
+            # warm render worker rendering the task, if any
+            worker_dir = os.path.join(FILE_DIR, f"worker_{task.cuda_visible_devices or 'all'}")
+            run_shell_cmd(f'pkill -f "{worker_dir}/"', very_quiet=True)
+    if task_dir:
+        run_shell_cmd(f"rm -rf {task_dir}", very_quiet=True)
+        remove_tailer(task_dir)
+        remove_frame_index(task_dir)
     DAEMON_LOGGER.debug(f"Removed task {task_id}...")
 
 
+def _get_task_progress(task):
+    """
+    return dict of render progress for running task
+    """
+    progress = {"last_frame_completed": None, "first_frame_time": None, "subsequent_frames_avg": None, "sample_progress": None, \
+                "peak_memory_mb": None}
+    if task.task_id == -1:
+        return progress
+    # only reads what blender logged since the last status call
+    log_progress = get_log_progress(task.task_dir, task.start_frame)
+    progress["last_frame_completed"] = log_progress["last_frame_completed"]
+    progress["sample_progress"] = log_progress["sample_progress"]
+    progress["peak_memory_mb"] = log_progress["peak_memory_mb"]
+    progress["first_frame_time"], progress["subsequent_frames_avg"] = calculate_frame_times(task.task_dir, task.start_frame, task.rendering_at)
+
+    return progress
+
+
 def queue_status(params):
     """
     return contents of queue
     params is empty dict
+    progress of tasks running on each gpu is under "gpus", which looks like
+    {"0": {"queue": [54], "last_frame_completed": 57, "first_frame_time": 12.34, "subsequent_frames_avg": 9.76, "sample_progress": 0.5,
+           "peak_memory_mb": 2048.0}}
+    a task with no assigned gpus is listed under "all"
+    top-level progress values are for first running task
     """
     with app.app_context():
-        tasks = Task.query.all()
+        tasks = Task.query.order_by(Task.id).all()
     # must include benchmark so we can set status to gpc
     task_ids = [task.task_id for task in tasks]
     last_frame_completed, first_frame_time, subsequent_frames_avg = [None] * 3
+    gpus = {}
     try:
-        if tasks:
-            last_frame_completed = get_last_frame_completed(tasks[0].task_dir, tasks[0].start_frame)
-            first_frame_time, subsequent_frames_avg = calculate_frame_times(tasks[0].task_dir, tasks[0].start_frame)
+        running_tasks = [task for task in tasks if task.status in RUNNING_STATES]
+        progresses = [_get_task_progress(task) for task in running_tasks]
+        for task, progress in zip(running_tasks, progresses):
+            for slot in _get_task_slots(task) - {"cpu"}:
+                gpu = gpus.setdefault(slot, {"queue": []})
+                gpu["queue"].append(task.task_id)
+                gpu.update(progress)
+        # keep reporting first task's progress for backends that don't read per-gpu progress
+        if progresses:
+            last_frame_completed = progresses[0]["last_frame_completed"]
+            first_frame_time = progresses[0]["first_frame_time"]
+            subsequent_frames_avg = progresses[0]["subsequent_frames_avg"]
     except Exception as e:
         DAEMON_LOGGER.exception(f"Caught exception in queue status: {e}")
 
@@ -160,7 +235,7 @@ def queue_status(params):
         db.close_all_sessions()
     
     return {"queue": task_ids, "last_frame_completed": last_frame_completed, "first_frame_time": first_frame_time, \
-            "subsequent_frames_avg": subsequent_frames_avg}
+            "subsequent_frames_avg": subsequent_frames_avg, "gpus": gpus, "input_cache": get_input_cache_stats()}
 
 
 def _read_benchmark():
@@ -173,30 +248,27 @@ def _read_benchmark():
     return benchmark
 
 
-def _handle_benchmark():
+def _handle_benchmark(task):
     """
     start benchmark task or check for benchmark output
     if output exists, send to rentaflop servers
     return True if benchmark task finished, False otherwise
     """
     # check if benchmark started and start if necessary
-    if not os.path.exists("octane/started.txt"):
-        run_shell_cmd("touch octane/started.txt", quiet=True)
+    if task.status == "ready":
+        set_task_status(task.task_id, "rendering")
         DAEMON_LOGGER.debug(f"Starting benchmark...")
-        os.system("./octane/octane --benchmark -a octane/benchmark.txt --no-gui &")
+        process = subprocess.Popen("./octane/octane --benchmark -a octane/benchmark.txt --no-gui", shell=True)
+        _watch_process(process.wait)
 
         return False
 
     # check if benchmark still running
     if not os.path.exists("octane/benchmark.txt"):
         # set timeout on queued task and kill if exceeded time limit
-        start_time = os.path.getmtime("octane/started.txt")
-        start_time = dt.datetime.fromtimestamp(start_time)
-        # must use now instead of utcnow since getmtime is local timestamp on local filesystem timezone
-        current_time = dt.datetime.now()
         # timeout for benchmark is less than normal tasks
         timeout = dt.timedelta(minutes=20)
-        if timeout < (current_time-start_time):
+        if timeout.total_seconds() < (time.time() - task.rendering_at):
             # end benchmark task and let pop_task handle killing octane process
             DAEMON_LOGGER.info("Benchmark timed out! Exiting...")
             
@@ -205,80 +277,208 @@ def _handle_benchmark():
         return False
     
     # benchmark job has finished running, so send output and exit container
+    set_task_status(task.task_id, "uploading")
     server_url = "https://api.rentaflop.com/host/output"
     benchmark = _read_benchmark()
     sandbox_id = os.getenv("SANDBOX_ID")
     data = {"benchmark": str(benchmark), "sandbox_id": str(sandbox_id)}
     DAEMON_LOGGER.debug(f"Sending benchmark score {benchmark} to servers")
-    requests.post(server_url, json=data)
+    http_client.post(server_url, json=data)
+    set_task_status(task.task_id, "done")
     DAEMON_LOGGER.debug("Finished benchmark")
 
     return True
 
 
+def _assign_slots(task, busy_slots, gpu_indexes):
+    """
+    return slots to run queued task on, None if they aren't free yet
+    tasks with a CUDA_VISIBLE_DEVICES directive wait for those gpus; other gpu tasks take the first free gpu
+    """
+    if task.is_cpu or task.cuda_visible_devices or not gpu_indexes:
+        slots = _get_task_slots(task, gpu_indexes)
+        if "all" in slots:
+            # task using every gpu waits for all of them
+            return None if busy_slots - {"cpu"} else slots
+        return None if (slots & busy_slots) or ("all" in busy_slots and "cpu" not in slots) else slots
+
+    for gpu_index in gpu_indexes:
+        if gpu_index not in busy_slots and "all" not in busy_slots:
+            return {gpu_index}
+
+    return None
+
+
+def _start_task(task):
+    """
+    start task in bg
+    """
+    DAEMON_LOGGER.debug(f"Starting task {task.task_id} on GPUs {task.cuda_visible_devices}...")
+    # marked here rather than by run.py so the next update can't start it again while run.py is still loading
+    set_task_status(task.task_id, "preparing")
+    cmd = f"python3 run.py {task.task_dir} '{task.main_file_path}' {task.start_frame} {task.end_frame} {task.uuid_str} {task.blender_version}"
+    # task directives
+    cmd += f" {task.is_cpu} {task.cuda_visible_devices} {task.job_id}"
+    if RENDER_WORKER_MODE:
+        # render from a thread in this process so the gpu's warm render worker persists across tasks
+        args = [task.task_dir, task.main_file_path, str(task.start_frame), str(task.end_frame), task.uuid_str, task.blender_version, \
+                str(task.is_cpu), str(task.cuda_visible_devices), str(task.job_id)]
+        _watch_process(functools.partial(run.main, args, True), task.task_id)
+
+        return
+    # run in background, handling its exit as soon as it happens
+    process = subprocess.Popen(cmd, shell=True)
+    _watch_process(process.wait, task.task_id)
+
+
+def _watch_process(wait, task_id=None):
+    """
+    call wait in background thread and update queue as soon as it returns
+    if task_id is set and task exited without reaching a finished state, it crashed and is marked failed here
+    """
+    def watch():
+        wait()
+        if task_id is not None and get_task_status(task_id) in RUNNING_STATES:
+            DAEMON_LOGGER.error(f"Task {task_id} exited without finishing!")
+            set_task_status(task_id, "failed")
+        try:
+            update_queue(_QUEUE_PARAMS)
+        except Exception as e:
+            DAEMON_LOGGER.exception(f"Caught exception while updating queue: {e}")
+
+    threading.Thread(target=watch, daemon=True).start()
+
+
 def update_queue(params={}):
     """
     checks for any finished tasks and sends results back to servers
     cleans up and removes files afterwards
-    starts the next task, if available
+    starts queued tasks on every free gpu, setting CUDA_VISIBLE_DEVICES for each
+    params looks like {"gpu_indexes": ["0", "1"]}; without gpu_indexes, tasks run one at a time on all gpus
+    called on queue events and periodically as a fallback, so calls are serialized
     """
-    # get first queued task
+    with _UPDATE_LOCK:
+        return _update_queue(params)
+
+
+def _update_queue(params):
+    gpu_indexes = [str(gpu_index) for gpu_index in params.get("gpu_indexes", [])]
     with app.app_context():
-        task = Task.query.first()
-    if not task:
-        return
-    
-    task_id = task.task_id
-    # check if task finished
-    if os.path.exists(os.path.join(task.task_dir, "finished.txt")):
-        pop_task({"task_id": task_id})
-        DAEMON_LOGGER.debug(f"Finished task {task_id}")
+        tasks = Task.query.order_by(Task.id).all()
+    if not tasks:
+        # frees gpus of warm render workers before crypto miner restarts on them
+        stop_idle_workers()
         
-        # make another call to update_queue to start the next task immediately
-        return update_queue()
+        return
 
-    # check if task started
-    if os.path.exists(os.path.join(task.task_dir, "started.txt")):
-        # set timeout on queued task and kill if exceeded time limit
-        start_time = os.path.getmtime(os.path.join(task.task_dir, "started.txt"))
-        start_time = dt.datetime.fromtimestamp(start_time)
-        # must use now instead of utcnow since getmtime is local timestamp on local filesystem timezone
-        current_time = dt.datetime.now()
-        # NOTE: if timeout updated, make sure to also update in retask_task lambda
-        timeout = dt.timedelta(hours=24)
-        if timeout < (current_time-start_time):
-            DAEMON_LOGGER.info(f"Task timed out! Exiting...")
+    running_tasks = []
+    queued_tasks = []
+    n_finished = 0
+    for task in tasks:
+        task_id = task.task_id
+        if task.status in FINISHED_STATES:
             pop_task({"task_id": task_id})
+            DAEMON_LOGGER.debug(f"Finished task {task_id} as {task.status}, phase durations: {get_phase_durations(task)}")
+            n_finished += 1
+            continue
+        # benchmark progress is tracked by _handle_benchmark
+        if task_id == -1:
+            queued_tasks.append(task)
+            continue
+        if task.status in RUNNING_STATES:
+            # set timeout on task and kill if exceeded time limit
+            # NOTE: if timeout updated, make sure to also update in retask_task lambda
+            timeout = dt.timedelta(hours=24)
+            if timeout.total_seconds() < (time.time() - task.preparing_at):
+                DAEMON_LOGGER.info(f"Task {task_id} timed out! Exiting...")
+                pop_task({"task_id": task_id})
+                continue
+            running_tasks.append(task)
+            continue
+        queued_tasks.append(task)
+
+    # last task just finished, so gpus can go back to mining without waiting for the next mining check
+    if n_finished and not running_tasks and not queued_tasks and _ON_IDLE:
+        threading.Thread(target=_ON_IDLE, daemon=True).start()
+    busy_slots = set()
+    for task in running_tasks:
+        busy_slots |= _get_task_slots(task, gpu_indexes)
+    # nothing else is started while benchmark is running
+    if any(task.task_id == -1 and task.status in RUNNING_STATES for task in queued_tasks):
+        queued_tasks = [task for task in queued_tasks if task.task_id == -1]
+    for task in queued_tasks:
+        # task_id will be -1 iff benchmark task, which uses every gpu so it runs by itself in queue order
+        if task.task_id == -1:
+            if busy_slots or task.status not in ["ready"] + RUNNING_STATES:
+                return
+            # benchmark needs the vram warm render workers are holding
+            stop_idle_workers(idle_timeout=0)
+            is_finished = _handle_benchmark(task)
+            if is_finished:
+                pop_task({"task_id": task.task_id})
+                # delete after removing from db so we don't send it again
+                run_shell_cmd('rm octane/benchmark.txt', quiet=True)
             
-            return update_queue()
+                return update_queue(params)
 
-        return
+            return
 
-    # task_id will be -1 iff benchmark task
-    if task_id == -1:
-        is_finished = _handle_benchmark()
-        if is_finished:
-            pop_task({"task_id": task_id})
-            # delete these after removing from db so we don't start it again
-            run_shell_cmd('rm octane/started.txt', quiet=True)
-            run_shell_cmd('rm octane/benchmark.txt', quiet=True)
-            
-            return update_queue()
+        # input is still being downloaded or processed
+        if task.status != "ready":
+            continue
+        slots = _assign_slots(task, busy_slots, gpu_indexes)
+        if slots is None:
+            continue
+        if not task.is_cpu and not task.cuda_visible_devices and gpu_indexes:
+            task.cuda_visible_devices = ",".join(sorted(slots))
+            with app.app_context():
+                Task.query.filter_by(task_id=task.task_id).update({"cuda_visible_devices": task.cuda_visible_devices})
+                db.session.commit()
+        busy_slots |= slots
+        _start_task(task)
 
-        return
 
-    # task exists in db, but now we check to see if fields are set and it's ready to be started
-    if task.uuid_str:
-        # start task in bg
-        DAEMON_LOGGER.debug(f"Starting task {task_id}...")
-        cmd = f"python3 run.py {task.task_dir} '{task.main_file_path}' {task.start_frame} {task.end_frame} {task.uuid_str} {task.blender_version}"
-        # task directives
-        cmd += f" {task.is_cpu} {task.cuda_visible_devices}"
-        # run in background
-        cmd += " &"
-        os.system(cmd)
+def _notify_queue(event):
+    """
+    send event to queue listener in daemon process so queue is updated immediately
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.sendto(event.encode(), QUEUE_SOCKET_PATH)
+    except OSError:
+        # listener isn't running, so event is handled by next periodic update
+        pass
+
+
+def start_queue_listener(params, on_idle=None):
+    """
+    update queue as soon as tasks are pushed or exit rather than only on periodic updates
+    params are passed to update_queue
+    on_idle is called once the queue empties after a task finishes
+    """
+    global _QUEUE_PARAMS, _ON_IDLE
+    _QUEUE_PARAMS = params
+    _ON_IDLE = on_idle
+    if os.path.exists(QUEUE_SOCKET_PATH):
+        os.remove(QUEUE_SOCKET_PATH)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(QUEUE_SOCKET_PATH)
+
+    def listen():
+        while True:
+            sock.recv(1024)
+            try:
+                update_queue(_QUEUE_PARAMS)
+            except Exception as e:
+                DAEMON_LOGGER.exception(f"Caught exception while updating queue: {e}")
+
+    threading.Thread(target=listen, daemon=True).start()
 
 
 # create tmp dir that's cleaned up when TEMP_DIR is destroyed
 TEMP_DIR = tempfile.TemporaryDirectory()
 FILE_DIR = TEMP_DIR.name
+QUEUE_SOCKET_PATH = os.path.join(FILE_DIR, "queue.sock")
+_UPDATE_LOCK = threading.RLock()
+_QUEUE_PARAMS = {}
+_ON_IDLE = None
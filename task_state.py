@@ -0,0 +1,42 @@
+"""
+task lifecycle stored in the task table
+tasks move through TASK_STATES in order, ending in done or failed, and the time each state is entered is recorded
+"""
+import time
+from config import app, db, Task
+
+
+def set_task_status(task_id, status, timestamp=None):
+    """
+    move task to status, recording timestamp it happened at, which defaults to now
+    does nothing if task was already removed from queue
+    """
+    timestamp = time.time() if timestamp is None else timestamp
+    with app.app_context():
+        Task.query.filter_by(task_id=int(task_id)).update({"status": status, f"{status}_at": timestamp})
+        db.session.commit()
+
+
+def get_task_status(task_id):
+    """
+    return status of task, None if it isn't in queue
+    """
+    with app.app_context():
+        task = Task.query.filter_by(task_id=int(task_id)).first()
+
+    return task.status if task else None
+
+
+def get_phase_durations(task):
+    """
+    return dict of seconds task spent in each state it has already left, like {"ingesting": 1.2, "rendering": 360.5}
+    """
+    transitions = [(status, getattr(task, f"{status}_at")) for status in TASK_STATES if getattr(task, f"{status}_at") is not None]
+    transitions.sort(key=lambda transition: transition[1])
+
+    return {status: round(next_time - start_time, 2) for (status, start_time), (_, next_time) in zip(transitions, transitions[1:])}
+
+
+TASK_STATES = ["queued", "ingesting", "ready", "preparing", "rendering", "packaging", "uploading", "done", "failed"]
+RUNNING_STATES = ["preparing", "rendering", "packaging", "uploading"]
+FINISHED_STATES = ["done", "failed"]
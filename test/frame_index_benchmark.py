@@ -0,0 +1,57 @@
+"""
+benchmark for frame timing over large output dirs
+compares listing and stat-ing the whole output dir on every call with the incremental frame index
+run from repo root with:
+python3 test/frame_index_benchmark.py [n_frames] [n_calls]
+"""
+import os
+import sys
+import glob
+import time
+import shutil
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+from frame_index import FrameIndex
+
+
+n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+n_calls = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+output_path = tempfile.mkdtemp()
+try:
+    for i in range(n_frames):
+        with open(os.path.join(output_path, f"{i:04d}.png"), "w") as f:
+            f.write("frame")
+
+    # what calculate_frame_times did on every call
+    start_time = time.time()
+    for _ in range(n_calls):
+        list_of_files = glob.glob(os.path.join(output_path, "*"))
+        first_file = min(list_of_files, key=os.path.getmtime)
+        last_file = max(list_of_files, key=os.path.getmtime)
+        first_frame_finish, last_frame_finish = os.path.getmtime(first_file), os.path.getmtime(last_file)
+    glob_time = (time.time() - start_time) / n_calls
+
+    frame_index = FrameIndex(output_path)
+    start_time = time.time()
+    frame_index.update()
+    initial_index_time = time.time() - start_time
+    start_time = time.time()
+    for i in range(n_calls):
+        # a frame finishes between some calls, like during a render
+        if i % 10 == 0:
+            with open(os.path.join(output_path, f"new{i:04d}.png"), "w") as f:
+                f.write("frame")
+        frame_index.update()
+        first_frame_finish, last_frame_finish = frame_index.get_first_frame_finish(), frame_index.get_last_frame_finish()
+    index_time = (time.time() - start_time) / n_calls
+    if frame_index.n_frames != n_frames + len(range(0, n_calls, 10)):
+        print("Frame index missed frames, frame index test failed!")
+    else:
+        print("Frame index test passed.")
+
+    print(f"{n_frames} frames, {n_calls} calls")
+    print(f"glob + getmtime: {glob_time * 1000:.2f}ms per call")
+    print(f"frame index: {initial_index_time * 1000:.2f}ms to build, {index_time * 1000:.3f}ms per call")
+    print(f"speedup: {glob_time / index_time:.0f}x")
+finally:
+    shutil.rmtree(output_path)
@@ -0,0 +1,141 @@
+"""
+drives the long-poll instruction channel with a local stand-in for the rentaflop instructions endpoint
+channel is started before the stand-in is up and again after it restarts, so it has to back off and reconnect; instructions queued
+on the stand-in must then be dispatched well under a second after they're queued
+run from repo root with:
+python3 test/instruction_channel_test.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import queue
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# keep log, blender store, and temp files like the input cache out of the daemon's own; must be set before importing daemon modules
+test_dir = tempfile.mkdtemp()
+os.environ["RENTAFLOP_LOG_FILE"] = os.path.join(test_dir, "daemon.log")
+os.environ["RENTAFLOP_BLENDER_STORE_DIR"] = os.path.join(test_dir, "blender_store")
+tempfile.tempdir = test_dir
+import main
+import instruction_channel
+
+
+N_INSTRUCTIONS = 5
+MAX_LATENCY = 1.0
+pending_instructions = queue.Queue()
+
+
+class StubChannelHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if data.get("rentaflop_id") != "test":
+            self.send_response(403)
+            self.end_headers()
+            return
+        # hold poll until an instruction is queued or poll times out, like the real endpoint
+        try:
+            instructions = [pending_instructions.get(timeout=data["wait"])]
+        except queue.Empty:
+            instructions = []
+        body = json.dumps({"instructions": instructions}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub(port):
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubChannelHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def wait_for_connection(timeout=10):
+    start_time = time.time()
+    while not main._INSTRUCTION_CHANNEL.is_connected and time.time() - start_time < timeout:
+        time.sleep(0.05)
+
+    return main._INSTRUCTION_CHANNEL.is_connected
+
+
+def measure_latencies(first_task_id):
+    """
+    queue instructions on stand-in one at a time and return seconds from queueing each until it ran
+    """
+    latencies = []
+    for task_id in range(first_task_id, first_task_id + N_INSTRUCTIONS):
+        pending_instructions.put({"cmd": "mine", "params": {"action": "start", "task_id": str(task_id), "queued_at": time.time()}, \
+                                  "rentaflop_id": "test"})
+        try:
+            queued_at, ran_at = dispatched.get(timeout=5)
+        except queue.Empty:
+            latencies.append(float("inf"))
+            continue
+        latencies.append(ran_at - queued_at)
+
+    return latencies
+
+
+# short backoff and polls so the test doesn't wait on production timings
+instruction_channel.BACKOFF_BASE = 0.1
+instruction_channel.BACKOFF_MAX = 0.5
+instruction_channel.POLL_TIMEOUT = 2
+with socket.socket() as s:
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+main.INSTRUCTION_CHANNEL_URL = f"http://127.0.0.1:{port}/api/host/instructions"
+main.RENTAFLOP_CONFIG.update({"rentaflop_id": "test"})
+dispatched = queue.Queue()
+main.CMD_TO_FUNC["mine"] = lambda params: dispatched.put((params["queued_at"], time.time()))
+problems = []
+
+# stand-in isn't up yet, so channel has to keep retrying until it is
+main._start_instruction_channel()
+time.sleep(1)
+if main._INSTRUCTION_CHANNEL.is_connected:
+    problems.append("channel reported connected before stand-in was up")
+server = start_stub(port)
+if not wait_for_connection():
+    problems.append("channel didn't connect once stand-in came up")
+latencies = measure_latencies(0)
+print(f"after connecting: {[round(latency, 4) for latency in latencies]}s from queueing to dispatch")
+if max(latencies) > MAX_LATENCY:
+    problems.append(f"instructions took up to {max(latencies):.2f}s to dispatch")
+
+# restart stand-in; channel should notice and reconnect on its own
+server.shutdown()
+server.server_close()
+# wait for held poll to come back so next one fails against the stopped stand-in
+while main._INSTRUCTION_CHANNEL.is_connected:
+    time.sleep(0.05)
+server = start_stub(port)
+if not wait_for_connection():
+    problems.append("channel didn't reconnect after stand-in restarted")
+latencies = measure_latencies(N_INSTRUCTIONS)
+print(f"after reconnecting: {[round(latency, 4) for latency in latencies]}s from queueing to dispatch")
+if max(latencies) > MAX_LATENCY:
+    problems.append(f"instructions took up to {max(latencies):.2f}s to dispatch after reconnecting")
+metrics = main._INSTRUCTION_CHANNEL.get_metrics()
+print(f"channel metrics: {metrics}")
+if metrics["reconnects"] < 2 or metrics["instructions"] != 2 * N_INSTRUCTIONS:
+    problems.append(f"unexpected channel metrics: {metrics}")
+main._INSTRUCTION_CHANNEL.stop()
+server.shutdown()
+shutil.rmtree(test_dir, ignore_errors=True)
+
+for problem in problems:
+    print(problem)
+if problems:
+    print("Instruction channel test failed!")
+    sys.exit(1)
+print("Instruction channel test passed.")
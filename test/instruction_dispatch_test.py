@@ -0,0 +1,135 @@
+"""
+checks batched checkins and instruction ordering against a local stub of the rentaflop checkin endpoint
+stub queues renders for several tasks with an update in the middle; renders for the same task must run in the order they were
+queued, nothing may run alongside the update, and state should only be built once per batch
+run from repo root with:
+python3 test/instruction_dispatch_test.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# keep log, blender store, and temp files like the input cache out of the daemon's own; must be set before importing daemon modules
+test_dir = tempfile.mkdtemp()
+os.environ["RENTAFLOP_LOG_FILE"] = os.path.join(test_dir, "daemon.log")
+os.environ["RENTAFLOP_BLENDER_STORE_DIR"] = os.path.join(test_dir, "blender_store")
+tempfile.tempdir = test_dir
+import main
+import http_client
+
+
+N_INSTRUCTIONS = 20
+N_TASKS = 5
+RENDER_TIME = 0.1
+checkin_queue = []
+checkin_sizes = []
+
+
+class StubCheckinHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        max_instructions = data.get("max_instructions")
+        if max_instructions:
+            batch = [checkin_queue.pop(0) for _ in range(min(max_instructions, len(checkin_queue)))]
+            response_json = {"instructions": batch}
+        else:
+            # servers without batching return one instruction at a time
+            response_json = checkin_queue.pop(0) if checkin_queue else {}
+        checkin_sizes.append(max_instructions)
+        body = json.dumps(response_json).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def queue_instructions():
+    checkin_queue.clear()
+    checkin_queue.extend({"cmd": "mine", "params": {"action": "start", "task_id": str(i % N_TASKS), "seq": i}, "rentaflop_id": "test"} \
+                         for i in range(N_INSTRUCTIONS))
+    checkin_queue.insert(N_INSTRUCTIONS // 2, {"cmd": "update", "params": {}, "rentaflop_id": "test"})
+
+
+def check_order(events):
+    """
+    return list of ordering problems in events
+    """
+    problems = []
+    update_idx = next(i for i, event in enumerate(events) if event[0] == "update")
+    if update_idx != N_INSTRUCTIONS // 2 or events[update_idx + 1][0] != "update done":
+        problems.append(f"update didn't run alone after everything queued before it: {events}")
+    for task_id in map(str, range(N_TASKS)):
+        seqs = [event[2] for event in events if event[0] == "mine" and event[1] == task_id]
+        if seqs != sorted(seqs):
+            problems.append(f"task {task_id} instructions ran out of order: {seqs}")
+
+    return problems
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), StubCheckinHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+server_url = f"http://127.0.0.1:{server.server_port}/api/host/daemon"
+main.post_to_rentaflop = lambda data, endpoint, quiet=False: http_client.post(server_url, json=data).json()
+n_states = [0]
+def fake_get_state(*args, **kwargs):
+    n_states[0] += 1
+    return {}
+main.get_state = fake_get_state
+main.http_client.get_public_ip = lambda: "127.0.0.1"
+main.RENTAFLOP_CONFIG.update({"rentaflop_id": "test", "sandbox_id": "test", \
+                              "crypto_config": {"email": "", "wallet_address": "", "task_miner_currency": ""}})
+events = []
+events_lock = threading.Lock()
+def fake_mine(params):
+    with events_lock:
+        events.append(("mine", params["task_id"], params["seq"]))
+    time.sleep(RENDER_TIME)
+def fake_update(params):
+    with events_lock:
+        events.append(("update",))
+    time.sleep(RENDER_TIME)
+    with events_lock:
+        events.append(("update done",))
+main.CMD_TO_FUNC["mine"] = fake_mine
+main.CMD_TO_FUNC["update"] = fake_update
+
+problems = []
+batched_post = main.post_to_rentaflop
+# second run stands in for a server that ignores max_instructions
+unbatched_post = lambda data, endpoint, quiet=False: batched_post(dict(data, max_instructions=None), endpoint, quiet)
+for batch_size, post in [(main.CHECKIN_BATCH_SIZE, batched_post), (None, unbatched_post)]:
+    mode = "batched" if batch_size else "one at a time"
+    main.post_to_rentaflop = post
+    queue_instructions()
+    events.clear()
+    checkin_sizes.clear()
+    n_states[0] = 0
+    start_time = time.time()
+    main._handle_checkin()
+    elapsed = time.time() - start_time
+    if len([event for event in events if event[0] == "mine"]) != N_INSTRUCTIONS:
+        problems.append(f"{mode}: not every instruction ran: {events}")
+    problems += [f"{mode}: {problem}" for problem in check_order(events)]
+    print(f"{mode}: {N_INSTRUCTIONS + 1} instructions in {elapsed:.2f}s with {len(checkin_sizes)} checkins and {n_states[0]} state builds " \
+          f"({(N_INSTRUCTIONS + 1) * RENDER_TIME:.2f}s if run one by one)")
+    if batch_size and n_states[0] > (N_INSTRUCTIONS + 1) // batch_size + 1:
+        problems.append(f"{mode}: state built {n_states[0]} times")
+print(f"dispatch metrics: {main._DISPATCHER.get_metrics()}")
+server.shutdown()
+shutil.rmtree(test_dir, ignore_errors=True)
+
+for problem in problems:
+    print(problem)
+if problems:
+    print("Instruction dispatch test failed!")
+    sys.exit(1)
+print("Instruction dispatch test passed.")
@@ -0,0 +1,106 @@
+"""
+checks crypto miner stats collected from a local stub of the t-rex api against the stats h-stats.sh would report
+covers default, blake3, dual-algo, and pre-0.19.10 summaries, algorithms that aren't valid regexes, and numbers formatted like jq
+prints them, plus the snapshot file h-stats.sh prints
+run from repo root with:
+python3 test/trex_stats_test.py
+"""
+import os
+import sys
+import copy
+import json
+import shutil
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+# keep daemon's log and first startup check untouched; must be set before importing daemon modules
+test_dir = tempfile.mkdtemp()
+os.environ["RENTAFLOP_LOG_FILE"] = os.path.join(test_dir, "daemon.log")
+from gpu_telemetry import set_backend, FakeBackend
+from trex_stats import TrexStatsCollector
+
+
+SUMMARY = {
+    "gpus": [{"gpu_user_id": 0, "hashrate": 50000000, "temperature": 60, "fan_speed": 70, "pci_bus": 1, "shares": {"invalid_count": 1}},
+             {"gpu_user_id": 1, "hashrate": 40000000, "temperature": 61, "fan_speed": 71, "pci_bus": 2, "shares": {"invalid_count": None}}],
+    "hashrate": 90000000, "uptime": 100, "accepted_count": 10, "rejected_count": 1, "invalid_count": 1, "algorithm": "ethash",
+    "version": "0.26.8",
+}
+DUAL_STAT = {"gpus": [{"hashrate": 1000, "shares": {"invalid_count": 2}}, {"hashrate": 2000, "shares": {}}], "hashrate": 3000,
+             "accepted_count": 5, "rejected_count": 0, "invalid_count": 2, "algorithm": "kheavyhash"}
+# gpus listed out of order so bus numbers and invalid counts have to be looked up by gpu id
+OLD_SUMMARY = dict(copy.deepcopy(SUMMARY), version="0.19.5", stat_by_gpu=[{"invalid_count": 3}, {"invalid_count": 4}])
+OLD_SUMMARY["gpus"].reverse()
+EXPECTED_BASE = {"temp": [60, 61], "fan": [70, 71], "uptime": 100, "ar": [10, 1, 1, "1;0"], "bus_numbers": [1, 2], "algo": "ethash",
+                 "ver": "0.26.8", "total_khs": "90000"}
+# (name, summary, TREX_ALGO, expected khs, expected stats)
+CASES = [
+    ("default", SUMMARY, "ethash", 90000.0, dict(EXPECTED_BASE, hs=[50000000, 40000000], hs_units="hs")),
+    ("blake3", SUMMARY, "blake3", 90000.0, dict(EXPECTED_BASE, hs=[50000, 40000], hs_units="khs")),
+    # h-stats.sh treats an algorithm that isn't a valid regex as not matching blake3
+    ("invalid algo regex", SUMMARY, "eth[", 90000.0, dict(EXPECTED_BASE, hs=[50000000, 40000000], hs_units="hs")),
+    ("fractional khs", dict(SUMMARY, hashrate=90000500), "ethash", 90000.5,
+     dict(EXPECTED_BASE, hs=[50000000, 40000000], hs_units="hs", total_khs="90000.5")),
+    ("dual", dict(SUMMARY, dual_stat=DUAL_STAT), "ethash", 90000.0,
+     dict(EXPECTED_BASE, hs=[50000000, 40000000], hs_units="hs", hs2=[1000, 2000], hs_units2="hs", ar2=[5, 0, 2, "2;0"],
+          algo2="kheavyhash", total_khs2="3")),
+    ("pre-0.19.10", OLD_SUMMARY, "ethash", 90000.0,
+     dict(EXPECTED_BASE, temp=[61, 60], fan=[71, 70], ar=[10, 1, 1, "4;3"], bus_numbers=[2, 1], ver="0.19.5",
+          hs=[40000000, 50000000], hs_units="hs")),
+]
+current_summary = {}
+
+
+class StubTrexHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/summary":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = json.dumps(current_summary).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+# fake gpus have bus ids 00000000:01:00.0 and 00000000:02:00.0, which pre-0.19.10 bus numbers are read from
+set_backend(FakeBackend())
+server = HTTPServer(("127.0.0.1", 0), StubTrexHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+snapshot_path = os.path.join(test_dir, "rentaflop_trex_stats.txt")
+collector = TrexStatsCollector(base_url=f"http://127.0.0.1:{server.server_port}", snapshot_path=snapshot_path)
+failures = []
+try:
+    for name, summary, trex_algo, expected_khs, expected_stats in CASES:
+        current_summary = summary
+        os.environ["TREX_ALGO"] = trex_algo
+        khs, stats = collector.collect()
+        if khs != expected_khs or stats != expected_stats:
+            failures.append(f"{name}: expected {expected_khs} {expected_stats}, got {khs} {stats}")
+        with open(snapshot_path, "r") as f:
+            snapshot = f.read().splitlines()
+        # khs line is printed like jq prints numbers, so it matches total_khs
+        if snapshot != [expected_stats["total_khs"], json.dumps(stats)]:
+            failures.append(f"{name}: snapshot doesn't match collected stats: {snapshot}")
+
+    # miner not running
+    server.shutdown()
+    server.server_close()
+    khs, stats = collector.collect()
+    if (khs, stats) != (0, "null"):
+        failures.append(f"unreachable miner: expected 0 null, got {khs} {stats}")
+finally:
+    shutil.rmtree(test_dir)
+
+for failure in failures:
+    print(failure)
+if failures:
+    print("T-rex stats test failed!")
+    sys.exit(1)
+print(f"T-rex stats test passed ({len(CASES)} summaries).")
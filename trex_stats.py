@@ -0,0 +1,185 @@
+"""
+collects crypto miner stats from the t-rex api and reshapes them into the stats hive expects
+replaces reshaping the api response with jq in h-stats.sh; the latest stats are also written to a snapshot file h-stats.sh can print
+stats look like the example in utils.get_state
+"""
+import os
+import re
+import json
+import time
+import threading
+import requests
+import http_client
+from config import DAEMON_LOGGER
+from gpu_telemetry import get_gpus
+
+
+def _is_older_version(version, target):
+    """
+    return True iff t-rex version string like "0.26.8" is older than target
+    """
+    def parse(v):
+        return [int(part) for part in re.findall(r"\d+", v or "")]
+
+    return parse(version) < parse(target)
+
+
+def _get_invalid_counts(summary):
+    """
+    return invalid share count of each gpu
+    """
+    if _is_older_version(summary.get("version"), "0.20.0"):
+        stat_by_gpu = summary.get("stat_by_gpu", [])
+        counts = []
+        for gpu in summary.get("gpus", []):
+            gpu_id = gpu.get("gpu_user_id")
+            counts.append(stat_by_gpu[gpu_id].get("invalid_count") if isinstance(gpu_id, int) and gpu_id < len(stat_by_gpu) else None)
+    else:
+        counts = [gpu.get("shares", {}).get("invalid_count") for gpu in summary.get("gpus", [])]
+
+    return [count or 0 for count in counts]
+
+
+def _get_bus_numbers(summary):
+    """
+    return pci bus number of each gpu in decimal
+    """
+    if not _is_older_version(summary.get("version"), "0.19.10"):
+        return [gpu.get("pci_bus") for gpu in summary.get("gpus", [])]
+    # older versions don't report buses, so they're looked up by gpu id
+    bus_ids = [gpu["bus_id"] for gpu in get_gpus()]
+    bus_numbers = []
+    for gpu in summary.get("gpus", []):
+        gpu_id = gpu.get("gpu_user_id")
+        if isinstance(gpu_id, int) and gpu_id < len(bus_ids) and bus_ids[gpu_id]:
+            # bus id looks like 00000000:0A:00.0
+            bus_numbers.append(int(bus_ids[gpu_id].split(":")[-2], 16))
+
+    return bus_numbers
+
+
+def _jq_number(value):
+    """
+    return value as jq would print it, where whole numbers like 90000.0 print as 90000
+    """
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+
+    return value
+
+
+def _is_blake3(trex_algo):
+    """
+    return True iff trex_algo matches like h-stats.sh's [[ 'blake3' =~ $TREX_ALGO ]], where an invalid regex doesn't match
+    """
+    try:
+        return re.search(trex_algo, "blake3") is not None
+    except re.error:
+        return False
+
+
+def reshape_summary(summary, trex_algo=None):
+    """
+    return khs, stats from t-rex /summary response in the format h-stats.sh produced
+    trex_algo is hive's configured algorithm, which decides whether hash rates are reported in khs
+    """
+    trex_algo = os.getenv("TREX_ALGO", "") if trex_algo is None else trex_algo
+    gpus = summary.get("gpus", [])
+    khs = _jq_number((summary.get("hashrate") or 0) / 1000)
+    gpuerr = ";".join(str(count) for count in _get_invalid_counts(summary))
+    stats = {"temp": [gpu.get("temperature") for gpu in gpus], "fan": [gpu.get("fan_speed") for gpu in gpus], \
+             "uptime": summary.get("uptime"), \
+             "ar": [summary.get("accepted_count"), summary.get("rejected_count"), summary.get("invalid_count"), gpuerr], \
+             "bus_numbers": _get_bus_numbers(summary), "algo": summary.get("algorithm"), "ver": summary.get("version"), \
+             "total_khs": str(khs)}
+    dual_stat = summary.get("dual_stat")
+    if dual_stat:
+        stats["hs"] = [gpu.get("hashrate") for gpu in gpus]
+        stats["hs_units"] = "hs"
+        dual_gpuerr = ";".join(str(gpu.get("shares", {}).get("invalid_count") or 0) for gpu in dual_stat.get("gpus", []))
+        stats["hs2"] = [gpu.get("hashrate") for gpu in dual_stat.get("gpus", [])]
+        stats["hs_units2"] = "hs"
+        stats["ar2"] = [dual_stat.get("accepted_count"), dual_stat.get("rejected_count"), dual_stat.get("invalid_count"), dual_gpuerr]
+        stats["algo2"] = dual_stat.get("algorithm") or os.getenv("TREX_ALGO2", "")
+        stats["total_khs2"] = str(_jq_number((dual_stat.get("hashrate") or 0) / 1000))
+    # same check h-stats.sh does, where an unset algorithm matches as well
+    elif _is_blake3(trex_algo):
+        stats["hs"] = [_jq_number((gpu.get("hashrate") or 0) / 1000) for gpu in gpus]
+        stats["hs_units"] = "khs"
+    else:
+        stats["hs"] = [gpu.get("hashrate") for gpu in gpus]
+        stats["hs_units"] = "hs"
+
+    return khs, stats
+
+
+class TrexStatsCollector:
+    """
+    polls t-rex api over a kept-alive http_client connection and caches the reshaped stats
+    """
+    def __init__(self, port=4059, base_url=None, snapshot_path=None):
+        self.base_url = base_url or f"http://127.0.0.1:{port}"
+        self.snapshot_path = snapshot_path or get_snapshot_path(port)
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def collect(self):
+        """
+        read and reshape stats from t-rex, writing them to the snapshot file
+        return khs, stats; stats is "null" if miner couldn't be reached
+        """
+        try:
+            response = http_client.get(f"{self.base_url}/summary", timeout=REQUEST_TIMEOUT, max_retries=1)
+            response.raise_for_status()
+            khs, stats = reshape_summary(response.json())
+        except (requests.exceptions.RequestException, ValueError) as e:
+            DAEMON_LOGGER.debug(f"Failed to read crypto miner stats: {e}")
+            khs, stats = 0, "null"
+        self._write_snapshot(khs, stats)
+
+        return khs, stats
+
+    def _write_snapshot(self, khs, stats):
+        # same two lines h-stats.sh prints; replaced atomically so h-stats.sh never reads a partial file
+        tmp_path = f"{self.snapshot_path}.{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(f"{khs}\n{json.dumps(stats)}\n")
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            DAEMON_LOGGER.error(f"Failed to write crypto miner stats snapshot: {e}")
+
+    def get_stats(self, max_age=None):
+        """
+        return khs, stats, collecting again if cached stats are older than max_age seconds
+        """
+        max_age = STATS_TTL if max_age is None else max_age
+        with self._lock:
+            if self._cache is None or time.time() - self._cache[0] > max_age:
+                self._cache = (time.time(), self.collect())
+
+            return self._cache[1]
+
+
+def get_snapshot_path(port):
+    return os.path.join(SNAPSHOT_DIR, f"rentaflop_trex_stats_{port}.txt")
+
+
+def get_collector(port):
+    """
+    return shared collector for t-rex api on port
+    """
+    key = port
+    with _COLLECTORS_LOCK:
+        if key not in _COLLECTORS:
+            _COLLECTORS[key] = TrexStatsCollector(port)
+
+        return _COLLECTORS[key]
+
+
+REQUEST_TIMEOUT = 3
+STATS_TTL = 5
+# fixed rather than tempfile.gettempdir() since h-stats.sh is run by hive with its own environment; must match path in h-stats.sh
+SNAPSHOT_DIR = "/tmp"
+_COLLECTORS = {}
+_COLLECTORS_LOCK = threading.Lock()
@@ -0,0 +1,288 @@
+"""
+streams output files to the presigned upload locations rentaflop servers hand out
+files are read from disk in blocks as they're sent, so they're never loaded into memory and size isn't limited like it is
+when requests is given the whole file
+locations with part_urls are uploaded in parts that are retried individually and resumed from the last acknowledged part,
+otherwise the file is sent as one presigned form post
+location requests carry the upload_id of any unfinished upload of the file so servers re-sign that upload instead of starting over
+"""
+import os
+import json
+import fcntl
+import time
+import uuid
+import hashlib
+import tempfile
+import threading
+import http_client
+from config import DAEMON_LOGGER, UPLOAD_RATE_LIMIT
+from output_packaging import record_upload_throughput
+
+
+class _RateLimiter:
+    """
+    token bucket limiting bytes per second, no limit if rate is None
+    bucket is kept in a flocked file at state_path so every task's run.py draws on the same budget rather than each getting its own
+    """
+    def __init__(self, rate, state_path):
+        self.rate = rate
+        self.state_path = state_path
+
+    def consume(self, n_bytes):
+        if not self.rate:
+            return
+        with open(self.state_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            now = time.time()
+            try:
+                allowance, last_check = map(float, f.read().split())
+            except ValueError:
+                allowance, last_check = self.rate, now
+            # allow at most a second's worth of burst
+            allowance = min(self.rate, allowance + max(now - last_check, 0) * self.rate) - n_bytes
+            f.seek(0)
+            f.truncate()
+            f.write(f"{allowance} {now}")
+            # lock is released on close
+        wait = -allowance / self.rate if allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class _StreamHasher:
+    """
+    sha256 of a file built from the blocks read while uploading it, so the file isn't read again just to checksum it
+    blocks re-sent by retries are skipped, and ranges never read, like parts uploaded before a resume, are read from disk
+    """
+    def __init__(self, path):
+        self.path = path
+        self.position = 0
+        self.sha256 = hashlib.sha256()
+        self._lock = threading.Lock()
+
+    def _read_gap(self, end):
+        with open(self.path, "rb") as f:
+            f.seek(self.position)
+            while self.position < end:
+                data = f.read(min(BLOCK_SIZE, end - self.position))
+                if not data:
+                    raise Exception(f"{self.path} was truncated during upload")
+                self.sha256.update(data)
+                self.position += len(data)
+
+    def update(self, offset, data):
+        """
+        add data read from offset in file
+        """
+        with self._lock:
+            if offset > self.position:
+                self._read_gap(offset)
+            if offset + len(data) > self.position:
+                self.sha256.update(data[self.position - offset:])
+                self.position = offset + len(data)
+
+    def hexdigest(self):
+        with self._lock:
+            self._read_gap(os.path.getsize(self.path))
+
+            return self.sha256.hexdigest()
+
+
+class _FileBody:
+    """
+    file-like request body that streams length bytes of file at path from offset, wrapped in optional preamble and epilogue
+    has a length so requests sends Content-Length rather than chunked encoding, which presigned urls don't accept
+    blocks read from file are passed to hasher if given
+    """
+    def __init__(self, path, offset=0, length=None, preamble=b"", epilogue=b"", hasher=None):
+        self.path = path
+        self.offset = offset
+        self.length = os.path.getsize(path) - offset if length is None else length
+        self.buffers = [preamble]
+        self.epilogue = epilogue
+        self.remaining = self.length
+        self.hasher = hasher
+        self.f = None
+
+    def __len__(self):
+        return len(self.buffers[0]) + self.length + len(self.epilogue)
+
+    def read(self, size=-1):
+        size = BLOCK_SIZE if size is None or size < 0 else size
+        if self.buffers[0]:
+            data, self.buffers[0] = self.buffers[0][:size], self.buffers[0][size:]
+            return data
+        if self.remaining > 0:
+            if self.f is None:
+                self.f = open(self.path, "rb")
+                self.f.seek(self.offset)
+            position = self.f.tell()
+            data = self.f.read(min(size, self.remaining))
+            if not data:
+                raise Exception(f"{self.path} was truncated during upload")
+            self.remaining -= len(data)
+            if self.hasher:
+                self.hasher.update(position, data)
+            _RATE_LIMITER.consume(len(data))
+            return data
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        data, self.epilogue = self.epilogue[:size], self.epilogue[size:]
+
+        return data
+
+
+def _form_body(fields, path, hasher=None):
+    """
+    return multipart/form-data body for presigned post with fields and file at path, and its content type
+    """
+    boundary = uuid.uuid4().hex
+    preamble = b""
+    for k in fields:
+        preamble += f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{fields[k]}\r\n'.encode()
+    # file must be the last field for s3 presigned posts
+    preamble += f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{os.path.basename(path)}"\r\n' \
+        f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+    epilogue = f"\r\n--{boundary}--\r\n".encode()
+
+    return _FileBody(path, preamble=preamble, epilogue=epilogue, hasher=hasher), f"multipart/form-data; boundary={boundary}"
+
+
+def _with_retries(func, description, max_retries):
+    """
+    return func(), retrying with exponential backoff on failure
+    """
+    for attempt in range(max_retries):
+        try:
+            return func()
+        except Exception as e:
+            DAEMON_LOGGER.error(f"{description} failed on attempt {attempt + 1}/{max_retries}: {e}")
+            if attempt == max_retries - 1:
+                raise
+            time.sleep(min(2**attempt, 30))
+
+
+def _post_form(url, fields, path, hasher=None):
+    body, content_type = _form_body(fields, path, hasher)
+    # body is read as it's sent, so retries are handled by callers with a fresh body
+    response = http_client.post(url, data=body, headers={"Content-Type": content_type}, timeout=REQUEST_TIMEOUT, max_retries=1)
+    response.raise_for_status()
+
+
+def _get_progress_path(path):
+    # kept outside the output dir so it's never mistaken for output
+    return os.path.join(tempfile.gettempdir(), f"rentaflop_upload_progress_{hashlib.sha1(path.encode()).hexdigest()}.json")
+
+
+def _get_fingerprint(path):
+    # parts sent before file was rewritten, like a repackaged tarball, can't be combined with the new contents
+    stat = os.stat(path)
+
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _read_progress(path):
+    """
+    return saved progress of an unfinished upload of file at path, {} if there's none for its current contents
+    """
+    try:
+        with open(_get_progress_path(path), "r") as f:
+            progress = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if progress.get("fingerprint") != _get_fingerprint(path):
+        return {}
+
+    return progress
+
+
+def get_resumable_upload_id(path):
+    """
+    return upload_id of an unfinished upload of file at path in parts, None if there isn't one
+    sent with upload location requests so servers re-sign the same upload and acknowledged parts aren't sent again
+    """
+    return _read_progress(path).get("upload_id")
+
+
+def _load_progress(path, upload_id):
+    """
+    return {part_number: etag} of parts already acknowledged for upload_id
+    """
+    progress = _read_progress(path)
+    if progress.get("upload_id") != upload_id:
+        return {}
+
+    return {int(part_number): etag for part_number, etag in progress["parts"].items()}
+
+
+def _save_progress(path, upload_id, parts):
+    progress_path = _get_progress_path(path)
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"upload_id": upload_id, "fingerprint": _get_fingerprint(path), "parts": parts}, f)
+    os.replace(tmp_path, progress_path)
+
+
+def _put_part(url, path, offset, length, hasher=None):
+    response = http_client.put(url, data=_FileBody(path, offset, length, hasher=hasher), timeout=REQUEST_TIMEOUT, max_retries=1)
+    response.raise_for_status()
+
+    return response.headers.get("ETag", "").strip('"')
+
+
+def _upload_parts(location, path, max_retries, hasher=None):
+    """
+    upload file in parts to location's part_urls, skipping parts acknowledged by an earlier attempt at the same upload_id
+    return [{"part_number": ..., "etag": ...}] servers need to complete the upload
+    """
+    upload_id, part_urls, part_size = location.get("upload_id"), location["part_urls"], int(location["part_size"])
+    size = os.path.getsize(path)
+    parts = _load_progress(path, upload_id)
+    if parts:
+        DAEMON_LOGGER.info(f"Resuming upload of {os.path.basename(path)} after {len(parts)}/{len(part_urls)} parts")
+    for i, url in enumerate(part_urls):
+        part_number = i + 1
+        if part_number in parts:
+            continue
+        offset = i * part_size
+        length = min(part_size, size - offset)
+        parts[part_number] = _with_retries(lambda: _put_part(url, path, offset, length, hasher), f"Upload of part {part_number}", max_retries)
+        _save_progress(path, upload_id, parts)
+    os.remove(_get_progress_path(path))
+
+    return [{"part_number": part_number, "etag": parts[part_number]} for part_number in sorted(parts)]
+
+
+def upload_file(location, path, max_retries=None):
+    """
+    upload file at path to location, the json response from rentaflop servers' upload location request
+    location has url and fields for a presigned post, or part_urls, part_size, and upload_id for an upload in parts
+    return stats like {"bytes": ..., "seconds": ..., "bytes_per_second": ..., "sha256": ...}, plus "upload_id" and "parts" for
+    uploads in parts; sha256 is computed from the bytes as they're sent
+    raises Exception once retries are exhausted
+    """
+    max_retries = max_retries or MAX_RETRIES
+    start_time = time.time()
+    size = os.path.getsize(path)
+    hasher = _StreamHasher(path)
+    stats = {}
+    if location.get("part_urls"):
+        stats["upload_id"] = location.get("upload_id")
+        stats["parts"] = _upload_parts(location, path, max_retries, hasher)
+    else:
+        _with_retries(lambda: _post_form(location["url"], location.get("fields", {}), path, hasher), \
+                      f"Upload of {os.path.basename(path)}", max_retries)
+    seconds = max(time.time() - start_time, 1e-6)
+    record_upload_throughput(size, seconds)
+    stats.update({"bytes": size, "seconds": round(seconds, 2), "bytes_per_second": round(size / seconds), "sha256": hasher.hexdigest()})
+
+    return stats
+
+
+BLOCK_SIZE = 1024 * 1024
+MAX_RETRIES = 5
+# (connect, read) timeouts; read timeout applies to each socket operation rather than the whole upload
+REQUEST_TIMEOUT = (10, 120)
+_RATE_LIMITER = _RateLimiter(UPLOAD_RATE_LIMIT, os.path.join(tempfile.gettempdir(), "rentaflop_upload_rate"))
@@ -0,0 +1,180 @@
+"""
+uploads render output frame by frame while the render is still running
+frames are picked up from blender's "Saved:" log lines as soon as they're written and sent by a bounded pool of upload workers,
+so only the last frame is left to upload once rendering finishes
+"""
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import http_client
+from config import DAEMON_LOGGER
+from upload_client import upload_file, get_resumable_upload_id
+
+
+class FrameUploader:
+    """
+    watches a task's log for finished frames and uploads each one to its own location from rentaflop servers
+    """
+    def __init__(self, task_id, output_path, n_workers=None):
+        self.task_id = task_id
+        self.output_path = output_path
+        self.executor = ThreadPoolExecutor(max_workers=n_workers or UPLOAD_WORKERS)
+        self.futures = {}
+        # filename -> {"size": ..., "sha256": ...} of each frame acknowledged by storage
+        self.uploaded = {}
+        self.failed = []
+        # summed over uploads, so concurrent uploads make this longer than wall time and throughput is per connection
+        self.upload_seconds = 0
+        # set to False if servers don't hand out per-file upload locations, in which case output is sent as a tarball at the end
+        self.is_incremental = True
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watch_thread = None
+
+    def start(self, log_path):
+        """
+        start following log_path for saved frames
+        """
+        self._watch_thread = threading.Thread(target=self._watch_log, args=(log_path,), daemon=True)
+        self._watch_thread.start()
+
+    def _watch_log(self, log_path):
+        # log is created by the render, so wait for it
+        while not os.path.exists(log_path):
+            if self._stop_event.wait(LOG_POLL_INTERVAL):
+                return
+        with open(log_path, "r", errors="replace") as f:
+            partial = ""
+            while True:
+                line = f.readline()
+                if not line:
+                    # read whatever was written before stop was requested, then exit
+                    if self._stop_event.is_set():
+                        return
+                    self._stop_event.wait(LOG_POLL_INTERVAL)
+                    # log was truncated by a new render attempt
+                    if os.fstat(f.fileno()).st_size < f.tell():
+                        f.seek(0)
+                        partial = ""
+                    continue
+                line = partial + line
+                if not line.endswith("\n"):
+                    partial = line
+                    continue
+                partial = ""
+                self.handle_line(line)
+
+    def handle_line(self, line):
+        """
+        queue upload of frame if line is blender's confirmation that it finished writing one
+        """
+        line = line.strip()
+        if not line.startswith("Saved:"):
+            return
+        path = line[len("Saved:"):].strip().strip("'\"")
+        # path is as blender sees it, so only its name is used
+        self.submit(os.path.join(self.output_path, os.path.basename(path)))
+
+    def submit(self, path):
+        """
+        queue upload of output file at path unless it's already queued
+        """
+        filename = os.path.basename(path)
+        with self._lock:
+            if not self.is_incremental or filename in self.futures:
+                return
+            self.futures[filename] = self.executor.submit(self._upload, path, filename)
+
+    def _get_upload_location(self, path, filename):
+        """
+        return upload location for filename as expected by upload_client.upload_file, None if servers don't support per-file uploads
+        """
+        data = {"task_id": str(self.task_id), "sandbox_id": str(os.getenv("SANDBOX_ID")), "filename": filename}
+        # asks for fresh part urls for the same upload so a retry picks up after the parts an earlier attempt finished
+        upload_id = get_resumable_upload_id(path)
+        if upload_id:
+            data["upload_id"] = upload_id
+        # only hands out an upload location, so it's safe to repeat
+        location = http_client.post(SERVER_URL, json=data, timeout=(10, 30), is_idempotent=True).json()
+        key = location.get("key") or location.get("fields", {}).get("key", "")
+        # older servers ignore filename and return the task's tarball location, which frames must not overwrite
+        if not (location.get("url") or location.get("part_urls")) or filename not in key:
+            return None
+
+        return location
+
+    def _upload(self, path, filename):
+        """
+        upload one output file, retrying on failure with a fresh location in case the last one's urls expired
+        """
+        size = os.path.getsize(path)
+        for attempt in range(MAX_RETRIES):
+            try:
+                location = self._get_upload_location(path, filename)
+                if location is None:
+                    DAEMON_LOGGER.info("Servers don't support per-frame uploads, falling back to uploading a tarball")
+                    with self._lock:
+                        self.is_incremental = False
+                    return
+                upload_stats = upload_file(location, path, max_retries=1)
+                with self._lock:
+                    # checksummed as it was sent rather than read again
+                    self.uploaded[filename] = {"size": size, "sha256": upload_stats["sha256"]}
+                    if "parts" in upload_stats:
+                        # servers complete uploads in parts with each part's etag
+                        self.uploaded[filename].update(upload_id=upload_stats["upload_id"], parts=upload_stats["parts"])
+                    self.upload_seconds += upload_stats["seconds"]
+                return
+            except Exception as e:
+                DAEMON_LOGGER.error(f"Upload of {filename} failed: {e}")
+            time.sleep(min(2**attempt, 30))
+
+        with self._lock:
+            self.failed.append(filename)
+
+    def finish(self):
+        """
+        stop following log, upload any output files not seen in it, such as videos, and wait for all uploads
+        return manifest of uploaded files like [{"filename": "0001.png", "size": 123, "sha256": ...}], None if falling back to a tarball
+        raises Exception if any file fails to upload
+        """
+        self._stop_event.set()
+        if self._watch_thread:
+            self._watch_thread.join()
+        for filename in sorted(os.listdir(self.output_path)):
+            self.submit(os.path.join(self.output_path, filename))
+        for future in list(self.futures.values()):
+            future.result()
+        self.executor.shutdown()
+        if not self.is_incremental:
+            return None
+        if self.failed:
+            raise Exception(f"Failed to upload output files: {self.failed}")
+
+        return [dict(self.uploaded[filename], filename=filename) for filename in sorted(self.uploaded)]
+
+    def get_bytes_per_second(self):
+        """
+        return average per-connection upload throughput, None if nothing was uploaded
+        """
+        if not self.upload_seconds:
+            return None
+
+        return round(sum(entry["size"] for entry in self.uploaded.values()) / self.upload_seconds)
+
+    def cancel(self):
+        """
+        stop following log and drop uploads that haven't started
+        """
+        self._stop_event.set()
+        # futures are cancelled one by one since shutdown's cancel_futures needs python 3.9
+        for future in list(self.futures.values()):
+            future.cancel()
+        self.executor.shutdown(wait=False)
+
+
+SERVER_URL = "https://api.rentaflop.com/host/output"
+UPLOAD_WORKERS = 4
+MAX_RETRIES = 5
+LOG_POLL_INTERVAL = 0.5
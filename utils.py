@@ -2,7 +2,14 @@
 utility functions to be used in various parts of host software
 """
 import subprocess
-from config import DAEMON_LOGGER, REGISTRATION_FILE, app, db, Overclock
+from config import DAEMON_LOGGER, REGISTRATION_FILE, app, db, Overclock, DB_BACKEND
+from input_cache import get_cache_key, link_entry
+from encryption import EncryptedFileWriter
+from log_tailer import get_log_progress
+from frame_index import get_frame_index
+from gpu_telemetry import get_gpus, is_process_running
+from trex_stats import get_collector
+import http_client
 import time
 import json
 import requests
@@ -13,8 +20,10 @@ import tempfile
 import copy
 import socket
 import math
-import glob
 import datetime as dt
+import hashlib
+import fcntl
+import threading
 
 
 # look up series here https://en.wikipedia.org/wiki/GeForce_40_series
@@ -57,6 +66,10 @@ SUPPORTED_GPUS = {
 CRYPTO_STATS = {"total_khs": "0.0"}
 # NOTE: if updated, also update daemon.py, launchpad.js, and host_update lambda
 TEST_HOSTS = ["rentaflop-one", "rentaflop-two", "rentaflop-three"]
+OC_LOCK_FILE = os.path.join(tempfile.gettempdir(), "rentaflop_oc.lock")
+OC_LOCK_TIMEOUT = 120
+_OC_LOCK = threading.local()
+MYSQL_MIGRATED_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), ".mysql_migrated")
 # from https://docs.blender.org/manual/en/2.80/files/media/video_formats.html
 VIDEO_FORMATS = [".mpg", ".mpeg", ".dvd", ".vob", ".mp4", ".avi", ".mov", ".dv", ".ogg", ".ogv", ".mkv", ".flv"]
 
@@ -105,17 +118,12 @@ def get_mining_stats():
     """
     return hash rate and gpu mining stats for gpus
     """
-    khs = 0
-    stats = "null"
     # 4059 is default port from hive
     crypto_port = 4059
-    khs_stats = run_shell_cmd(f"./h-stats.sh {crypto_port}", format_output=False, quiet=True)
-    if khs_stats:
-        khs_stats = khs_stats.splitlines()
-    if len(khs_stats) == 2:
-        khs = float(khs_stats[0])
-        stats = json.loads(khs_stats[1])
-    
+    # read in-process from the t-rex api; also refreshes the snapshot h-stats.sh prints
+    khs, stats = get_collector(crypto_port).get_stats()
+    khs = float(khs)
+
     # TODO if running gpc, apply rentaflop multiplier to estimate additional crypto earnings
 
     return khs, stats
@@ -158,6 +166,7 @@ def get_state(available_resources, queue_status, gpu_only=False, quiet=False, ve
           ],
         },
         "version": "01e243e",
+        "input_cache": {"date": "2023-01-01", "hits": 12, "misses": 2, "saved_minutes": 31.5},
         "khs": 346.3, // total hash rate
         "stats": { 
           "hs": [123, 223.3], //array of hashes
@@ -173,6 +182,40 @@ def get_state(available_resources, queue_status, gpu_only=False, quiet=False, ve
       }
     }
     """
+    if not version:
+        version = run_shell_cmd("git rev-parse --short HEAD", quiet=quiet, format_output=False).replace("\n", "")
+    crypto_state = get_crypto_state()
+    # get task queue status
+    result = queue_status({}) if (crypto_state[2] != "null" and is_queue_ready()) else {}
+
+    return build_state(available_resources, crypto_state, result, gpu_only=gpu_only, version=version, algo=algo)
+
+
+def get_crypto_state():
+    """
+    return is_mining, khs, stats for crypto miner; stats is "null" if miner is running but stats couldn't be read
+    """
+    if is_process_running("t-rex"):
+        khs, stats = get_mining_stats()
+
+        return True, khs, stats
+
+    # TODO still return values times multiplier when renders or benchmarks are running
+    return False, 0, {}
+
+
+def is_queue_ready():
+    """
+    return True once daemon has been up long enough for task queue status to be read
+    """
+    return round(time.time() - _START_TIME) > 10
+
+
+def build_state(available_resources, crypto_state, result, gpu_only=False, version=None, algo=None):
+    """
+    return state as described in get_state from already-gathered parts
+    crypto_state is return value of get_crypto_state and result is return value of queue_status, {} if not read
+    """
     global CRYPTO_STATS
     state = {}
     gpu_indexes = available_resources["gpu_indexes"]
@@ -182,20 +225,13 @@ def get_state(available_resources, queue_status, gpu_only=False, quiet=False, ve
     state["n_gpus"] = str(n_gpus)
     state["status"] = "stopped"
     state["queue"] = []
-    khs = 0
-    stats = {}
-    if not version:
-        version = run_shell_cmd("git rev-parse --short HEAD", quiet=quiet, format_output=False).replace("\n", "")
+    is_mining, khs, stats = crypto_state
+    # parts may be cached and shared between calls, so they're copied before being filled in
+    stats = copy.deepcopy(stats)
     if not algo:
         algo = "rentaflop"
-    # get crypto mining state
-    output = run_shell_cmd(f"nvidia-smi", very_quiet=True)
-    if "t-rex" in output:
+    if is_mining:
         state["status"] = "crypto"
-        khs, stats = get_mining_stats()
-    else:
-        # TODO still return values times multiplier when renders or benchmarks are running
-        pass
 
     if stats != "null":
         stats["uptime"] = round(time.time() - _START_TIME)
@@ -204,17 +240,26 @@ def get_state(available_resources, queue_status, gpu_only=False, quiet=False, ve
         # currently mining crypto and found higher stats so we save these to be displayed to hive during non-crypto mining tasks
         if "total_khs" in stats and float(stats["total_khs"]) > float(CRYPTO_STATS["total_khs"]):
             CRYPTO_STATS = stats
-        
-    # get task queue status
-    result = queue_status({}) if (isinstance(stats, dict) and stats.get("uptime", 0) > 10) else {}
+
     task_queue = result.get("queue")
     last_frame_completed = result.get("last_frame_completed")
     first_frame_time = result.get("first_frame_time")
     subsequent_frames_avg = result.get("subsequent_frames_avg")
+    input_cache_stats = result.get("input_cache")
+    gpu_progress = copy.deepcopy(result.get("gpus", {}))
     # check for existing queue items
     if task_queue:
         state["status"] = "gpc"
         state["queue"] = task_queue
+    # per-gpu state and progress of the task running on each gpu; tasks without assigned gpus run on all of them
+    for gpu in state["gpus"]:
+        progress = gpu_progress.get(str(gpu["index"])) or gpu_progress.get("all")
+        if progress:
+            gpu["state"] = "gpc"
+            gpu.update(progress)
+        else:
+            gpu["state"] = "crypto" if state["status"] == "crypto" else "stopped"
+            gpu["queue"] = []
     if last_frame_completed is not None:
         state["last_frame_completed"] = last_frame_completed
     if first_frame_time:
@@ -231,6 +276,8 @@ def get_state(available_resources, queue_status, gpu_only=False, quiet=False, ve
         state["resources"] = {"gpu_indexes": available_resources["gpu_indexes"]}
         state["khs"] = khs
         state["stats"] = stats
+        if input_cache_stats:
+            state["input_cache"] = input_cache_stats
 
     return state            
 
@@ -308,9 +355,9 @@ def post_to_rentaflop(data, endpoint, quiet=False):
     if not quiet:
         DAEMON_LOGGER.debug(f"Sent to /api/host/{endpoint}: {data}")
     try:
-        response = requests.post(rentaflop_url, json=data)
+        response = http_client.post(rentaflop_url, json=data, endpoint=f"POST /api/host/{endpoint}")
         response_json = response.json()
-    except (requests.exceptions.ConnectionError, json.decoder.JSONDecodeError) as e:
+    except (requests.exceptions.RequestException, json.decoder.JSONDecodeError) as e:
         DAEMON_LOGGER.error(f"Exception during post request: {e}")
 
         return None
@@ -385,9 +432,8 @@ def start_crypto_miner(crypto_port, hostname, crypto_config):
     """
     start crypto miner on gpus; do nothing if already running
     """
-    # do nothing if running
-    output = run_shell_cmd(f"nvidia-smi | grep 't-rex'", very_quiet=True)
-    if output:
+    # do nothing if running; fresh read so a miner started moments ago isn't started twice
+    if is_process_running("t-rex", max_age=0):
         return
     
     # create temp config file, run miner, then delete file
@@ -419,9 +465,9 @@ def check_correct_driver():
     check for correct driver version
     install if not found, otherwise do nothing
     """
-    smi_output = run_shell_cmd("nvidia-smi --query-gpu=gpu_name --format=csv")
+    gpu_names = [gpu["name"] for gpu in get_gpus()]
     # 40 series gpus require newer drivers
-    # has_40_series = "RTX 40" in smi_output
+    # has_40_series = any("RTX 40" in gpu_name for gpu_name in gpu_names)
     # target_version = "525.105.17" if has_40_series else "510.73.05"
     target_version = "535.154.05"
     # check if installed
@@ -541,13 +587,17 @@ def disable_oc(gpu_indexes):
     leave power limit settings alone so as to not cause overheating; overclock alone causes issues with rendering
     """
     gpu_indexes = [int(gpu) for gpu in gpu_indexes]
+    # changing settings without the lock would race whoever holds it, so they're left alone
+    if not _lock_oc():
+        DAEMON_LOGGER.error("Skipping overclock change since overclock settings are locked!")
+
+        return
     original_oc_settings, oc_hash, db = read_oc_settings()
     current_oc_settings, current_oc_hash = get_oc_settings()
     # do nothing if overclocking not set
     if not current_oc_settings:
         # release Overclock table lock
-        with app.app_context():
-            db.session.commit()
+        _release_oc_lock()
         
         return
     
@@ -558,8 +608,7 @@ def disable_oc(gpu_indexes):
     # do nothing if 0 because it means none of the supported gpus are overclocked anyways
     if n_gpus == 0:
         # release Overclock table lock
-        with app.app_context():
-            db.session.commit()
+        _release_oc_lock()
 
         return
 
@@ -586,13 +635,17 @@ def enable_oc(gpu_indexes):
     set overclock settings to original oc_settings
     """
     gpu_indexes = [int(gpu) for gpu in gpu_indexes]
+    # changing settings without the lock would race whoever holds it, so they're left alone
+    if not _lock_oc():
+        DAEMON_LOGGER.error("Skipping overclock change since overclock settings are locked!")
+
+        return
     original_oc_settings, oc_hash, db = read_oc_settings()
     current_oc_settings, current_oc_hash = get_oc_settings()
     # do nothing if overclocking not set
     if not current_oc_settings or not original_oc_settings:
         # release Overclock table lock
-        with app.app_context():
-            db.session.commit()
+        _release_oc_lock()
 
         return
 
@@ -600,8 +653,7 @@ def enable_oc(gpu_indexes):
     # do nothing if user set new oc settings, since we assume these are already enabled
     if is_different:
         # release Overclock table lock
-        with app.app_context():
-            db.session.commit()
+        _release_oc_lock()
 
         return
     new_oc_settings = copy.deepcopy(current_oc_settings)
@@ -646,16 +698,65 @@ def write_oc_settings(oc_settings, oc_hash, db, commit=True):
 
         if commit:
             db.session.commit()
+    if commit:
+        _unlock_oc()
+
+
+def _lock_oc():
+    """
+    acquire lock on overclock settings for this thread, held until _unlock_oc
+    with_for_update alone isn't enough since sqlite has no row locks and the lock only lasts as long as the app context that took it
+    return True iff lock is held by this thread
+    """
+    if getattr(_OC_LOCK, "file", None):
+        return True
+    lock_file = open(OC_LOCK_FILE, "a")
+    start_time = time.time()
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            # flock is released when its holder exits, so timing out means a live holder is stuck mid-update
+            if time.time() - start_time > OC_LOCK_TIMEOUT:
+                DAEMON_LOGGER.error("Timed out waiting for overclock lock!")
+                lock_file.close()
+
+                return False
+            time.sleep(0.1)
+    _OC_LOCK.file = lock_file
+
+    return True
+
+
+def _unlock_oc():
+    """
+    release this thread's lock on overclock settings if held
+    """
+    lock_file = getattr(_OC_LOCK, "file", None)
+    if lock_file:
+        _OC_LOCK.file = None
+        lock_file.close()
+
+
+def _release_oc_lock():
+    """
+    commit any pending overclock changes and release lock acquired by read_oc_settings
+    """
+    with app.app_context():
+        db.session.commit()
+    _unlock_oc()
 
 
 def read_oc_settings():
     """
     read oc settings and hash from db
     requires overclock settings to already exist in db
-    requires calling function to free the overclock table lock by calling db.session.commit()
+    requires calling function to free the overclock lock by calling _release_oc_lock or write_oc_settings
     """
-    # with_for_update acquires lock on the overclock table, which is necessary to avoid multiple concurrent threads from messing up the settings
-    # if a concurrent thread tries to read or write the table when another thread has the lock, it will wait until the lock is released
+    # lock is necessary to avoid multiple concurrent threads and processes from messing up the settings
+    # if a concurrent thread tries to read the settings when another thread has the lock, it will wait until the lock is released
+    _lock_oc()
     with app.app_context():
         existing_oc_settings = db.session.query(Overclock.oc_settings).with_for_update().first()
     existing_oc_settings = existing_oc_settings[0]
@@ -690,6 +791,38 @@ def install_or_update_benchmark():
     run_shell_cmd("mkdir -p octane && tar -xzf octane.tar.gz -C octane --strip-components 1")
 
 
+def _start_mysql():
+    """
+    start local mysql server and create daemon database
+    """
+    run_shell_cmd("sudo apt-get install mysql-server -y", quiet=True)
+    run_shell_cmd("sudo systemctl enable mysql", quiet=True)
+    run_shell_cmd("/etc/init.d/mysql start", quiet=True)
+    run_shell_cmd("mkdir /var/log/mysql", quiet=True)
+    run_shell_cmd("sudo chown -R mysql:mysql /var/log/mysql", quiet=True)
+    run_shell_cmd("sudo systemctl start mysql", quiet=True)
+    run_shell_cmd('''mysql -u root -e "ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY 'daemon';"''', quiet=True)
+    run_shell_cmd('mysql -u root -pdaemon -e "create database daemon;"', quiet=True)
+    run_shell_cmd('mysql -u root -pdaemon -e "SET session wait_timeout=10;"', quiet=True)
+    run_shell_cmd('mysql -u root -pdaemon -e "SET interactive_timeout=10;"', quiet=True)
+
+
+def _migrate_from_mysql():
+    """
+    one-time switch of existing installations from the local mysql server to the embedded sqlite database
+    daemon tables are recreated on every startup, so there's no data to carry over; mysql server is stopped and kept from
+    starting at boot to free its memory, and setting RENTAFLOP_DB_BACKEND=mysql switches back
+    """
+    if os.path.exists(MYSQL_MIGRATED_FILE):
+        return
+    if os.path.exists("/etc/init.d/mysql"):
+        DAEMON_LOGGER.info("Switching daemon database from mysql to sqlite...")
+        run_shell_cmd("/etc/init.d/mysql stop", quiet=True)
+        run_shell_cmd("sudo systemctl stop mysql", quiet=True)
+        run_shell_cmd("sudo systemctl disable mysql", quiet=True)
+    run_shell_cmd(f"touch {MYSQL_MIGRATED_FILE}", quiet=True)
+
+
 def check_installation():
     """
     check installation for requirements not necessarily installed during first startup
@@ -704,14 +837,12 @@ def check_installation():
     run_shell_cmd("sudo apt-get install firejail firejail-profiles -y", quiet=True)
     run_shell_cmd('rm octane/started.txt', quiet=True)
     run_shell_cmd('rm octane/benchmark.txt', quiet=True)
-    run_shell_cmd("/etc/init.d/mysql start", quiet=True)
-    run_shell_cmd("mkdir /var/log/mysql", quiet=True)
-    run_shell_cmd("sudo chown -R mysql:mysql /var/log/mysql", quiet=True)
-    run_shell_cmd("sudo systemctl start mysql", quiet=True)
-    run_shell_cmd('''mysql -u root -e "ALTER USER 'root'@'localhost' IDENTIFIED WITH mysql_native_password BY 'daemon';"''', quiet=True)
-    run_shell_cmd('mysql -u root -pdaemon -e "create database daemon;"', quiet=True)
-    run_shell_cmd('mysql -u root -pdaemon -e "SET session wait_timeout=10;"', quiet=True)
-    run_shell_cmd('mysql -u root -pdaemon -e "SET interactive_timeout=10;"', quiet=True)
+    # blender archives are no longer cached now that versions are extracted once into blender store
+    run_shell_cmd('rm -f blender-*.tar.xz', quiet=True)
+    if DB_BACKEND == "mysql":
+        _start_mysql()
+    else:
+        _migrate_from_mysql()
     with app.app_context():
         db.drop_all()
         db.create_all()
@@ -732,27 +863,121 @@ def install_all_requirements():
     # install dependencies
     run_shell_cmd("sudo apt-get install ca-certificates curl gnupg lsb-release -y")
     run_shell_cmd("sudo apt-get update -y")
-    run_shell_cmd("sudo apt-get install mysql-server -y")
+    if DB_BACKEND == "mysql":
+        run_shell_cmd("sudo apt-get install mysql-server -y")
     run_shell_cmd("sudo apt-get install python3-pip -y && pip3 install speedtest-cli")
     run_shell_cmd("git config --global --add safe.directory /hive/miners/custom/rentaflop/rentaflop-miner")
 
 
-def get_render_file(rentaflop_id, job_id):
+def _open_download_file(file_path, key):
+    """
+    open file_path for writing a download, encrypting contents with key if set
+    """
+    if key:
+        return EncryptedFileWriter(key, file_path)
+
+    return open(file_path, "wb")
+
+
+def _stream_to_file(file_url, file_path, key=None, chunk_size=1024*1024, max_retries=5):
     """
-    fetch render file from rentaflop servers
-    return file, filename
+    stream contents of file_url straight to file_path without buffering the whole file in memory
+    if key is set, chunks are encrypted as they arrive so plaintext never touches the disk
+    hashes chunks as they arrive and resumes with an HTTP Range request if the connection drops
+    return sha256 hex digest of plaintext file contents
+    """
+    sha256 = hashlib.sha256()
+    n_written = 0
+    total_size = None
+    tries = 0
+    f = _open_download_file(file_path, key)
+    try:
+        while total_size is None or n_written < total_size:
+            headers = {"Range": f"bytes={n_written}-"} if n_written else {}
+            try:
+                # retries are handled here so they can resume where the last attempt stopped
+                with http_client.get(file_url, headers=headers, stream=True, max_retries=1) as response:
+                    response.raise_for_status()
+                    if n_written and response.status_code != 206:
+                        # server ignored range request so we must start over; reopening truncates file
+                        DAEMON_LOGGER.info("Server does not support resuming download, restarting from beginning...")
+                        f.close()
+                        f = _open_download_file(file_path, key)
+                        sha256 = hashlib.sha256()
+                        n_written = 0
+                    if response.status_code == 206:
+                        # looks like "bytes 1000-4999/5000"
+                        total_size = int(response.headers["Content-Range"].split("/")[-1])
+                    elif "Content-Length" in response.headers:
+                        total_size = int(response.headers["Content-Length"])
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        n_written += len(chunk)
+                # no length given by server, so a clean end of stream means we're done
+                if total_size is None:
+                    total_size = n_written
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+                DAEMON_LOGGER.info(f"Download interrupted after {n_written} bytes: {e}")
+            if total_size is not None and n_written >= total_size:
+                break
+            tries += 1
+            if tries > max_retries:
+                raise Exception(f"Failed to download {file_path} after {max_retries} retries!")
+            DAEMON_LOGGER.info(f"Resuming download from byte {n_written}...")
+            time.sleep(min(2 ** tries, 30))
+    finally:
+        f.close()
+
+    return sha256.hexdigest()
+
+
+def _get_etag(file_url):
+    """
+    return ETag of file at file_url without downloading its contents, None if not available
+    uses a 1 byte range request since presigned GET urls can't be used for HEAD requests
+    """
+    try:
+        with http_client.get(file_url, headers={"Range": "bytes=0-0"}, stream=True) as response:
+            if not response.ok:
+                return None
+
+            return response.headers.get("ETag")
+    except requests.exceptions.RequestException:
+        return None
+
+
+def get_render_file(rentaflop_id, job_id, task_dir, key):
+    """
+    fetch render file from rentaflop servers, streaming it to disk in task_dir encrypted with key
+    download is skipped if the job's file is already in the input cache, in which case cached files are linked into task_dir
+    right away so they can't be evicted before the task is pushed
+    return path to downloaded file (None if cached), filename, input cache key (None if file has no ETag), cached input from
+    input_cache.link_entry (None if downloaded)
     """
     server_url = "https://api.rentaflop.com/host/input"
     data = {"rentaflop_id": str(rentaflop_id), "job_id": str(job_id)}
-    api_response = requests.post(server_url, json=data)
+    # only hands out a download url, so it's safe to repeat
+    api_response = http_client.post(server_url, json=data, is_idempotent=True)
     file_url = api_response.json()["url"]
-    file_response = requests.get(file_url, stream=True)
-    render_file = file_response.content
     # parse out filename from download URL
     # NOTE: if s3 upload dir changes, then this must also change
     filename = file_url.split("https://rentaflop-render-uploads.s3.amazonaws.com/")[1].split("?AWSAccessKeyId=")[0]
+    extension = os.path.splitext(filename)[1]
+    etag = _get_etag(file_url)
+    # without an ETag there's no key to look the input up by before downloading, so it isn't cached
+    cache_key = get_cache_key(job_id, etag) if etag else None
+    if cache_key:
+        cached_input = link_entry(cache_key, task_dir)
+        if cached_input:
+            return None, filename, cache_key, cached_input
+
+    render_path = os.path.join(task_dir, f"render_file{extension}")
+    start_time = time.time()
+    _stream_to_file(file_url, render_path, key=key)
+    DAEMON_LOGGER.debug(f"Downloaded and encrypted {filename} ({os.path.getsize(render_path)} bytes) in {time.time() - start_time:.2f}s")
 
-    return render_file, filename
+    return render_path, filename, cache_key, None
 
 
 def pull_latest_code():
@@ -769,45 +994,29 @@ def get_last_frame_completed(task_dir, start_frame):
     """
     return last frame number completed, None if 0 frames completed
     """
-    log_path = os.path.join(task_dir, "log.txt")
-    output = run_shell_cmd(f"tail -100 {log_path} | grep -e 'Fra:'", very_quiet=True, format_output=False)
-    if not output:
-        return None
-    
-    lines = output.splitlines()
-    frame_in_progress = start_frame
-    for line in reversed(lines):
-        if line.startswith("Fra:"):
-            frame_in_progress = int(line.split()[0].replace("Fra:", ""))
-            break
-
-    if frame_in_progress == start_frame:
-        return None
-
-    return frame_in_progress - 1
+    return get_log_progress(task_dir, start_frame)["last_frame_completed"]
 
 
-def calculate_frame_times(task_dir, start_frame):
+def calculate_frame_times(task_dir, start_frame, render_start_time):
     """
     calculate total time in minutes spent rendering frames, not including preprocessing
-    requires started_render.txt to exist plus frames are still present
+    render_start_time is unix time task entered rendering state, None if it hasn't yet
+    requires frames to still be present
     return first_frame_time, subsequent_frames_avg
     """
-    start_file_path = os.path.join(task_dir, "started_render.txt")
-    if not os.path.exists(start_file_path):
+    if render_start_time is None:
         return None, None
     
-    output_files = os.path.join(task_dir, "output/*")
-    list_of_files = glob.glob(output_files)
-    if not list_of_files:
+    # only frames added since the last call are stat-ed
+    frame_index = get_frame_index(task_dir)
+    n_frames = frame_index.n_frames
+    if not n_frames:
         return None, None
 
-    n_frames = len(list_of_files)
-    render_start_time = os.path.getmtime(start_file_path)
     render_start_time = dt.datetime.fromtimestamp(render_start_time)
     # videos will output just one file, such as 0001-0500.mov
     if n_frames == 1:
-        _, file_ext = os.path.splitext(list_of_files[0])
+        _, file_ext = os.path.splitext(frame_index.first_frame)
         # if it is indeed a video file, we have to use logs to determine frame finish times
         if file_ext.lower() in VIDEO_FORMATS:
             last_frame_completed = get_last_frame_completed(task_dir, start_frame)
@@ -826,22 +1035,14 @@ def calculate_frame_times(task_dir, start_frame):
             else:
                 return None, None
 
-    first_file = min(list_of_files, key=os.path.getmtime)
-    last_file = max(list_of_files, key=os.path.getmtime)
-    first_frame_finish = os.path.getmtime(first_file)
-    first_frame_finish = dt.datetime.fromtimestamp(first_frame_finish)
-    last_frame_finish = os.path.getmtime(last_file)
-    last_frame_finish = dt.datetime.fromtimestamp(last_frame_finish)
-
+    first_frame_finish = dt.datetime.fromtimestamp(frame_index.get_first_frame_finish())
     first_frame_duration = first_frame_finish-render_start_time
     first_frame_time = first_frame_duration.total_seconds()/60.0
     # handle 1-frame task edge case
     if n_frames == 1:
         subsequent_frames_avg = first_frame_time
     else:
-        subsequent_frames_duration = last_frame_finish-first_frame_finish
-        subsequent_frames_time = subsequent_frames_duration.total_seconds()/60.0
-        subsequent_frames_avg = subsequent_frames_time / (n_frames - 1)
+        subsequent_frames_avg = frame_index.get_subsequent_frames_avg()/60.0
 
     return first_frame_time, subsequent_frames_avg
 